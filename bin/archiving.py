@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import re
+import glob
+import argparse
+import hashlib
+import subprocess
+import multiprocessing
+import distutils.spawn
+
+import staging
+
+"""
+Archive the output of a run.
+
+Output is moved into the archive straight away, this is just renames so it is
+quick. Post-processing is slower so it is done by postprocess(), normally in
+a background process started with start() so that the next run needn't wait
+for it. Only the files that were collected are processed:
+
+    - tiled files (ocean_x.nc.0000, ocean_x.nc.0001, ...) are combined
+      with mppnccombine, bin/mppnccombine is used if it's there,
+    - netcdf files are compressed with nccopy,
+    - md5 checksums are written to 'md5sums'.
+
+Compression and checksums are done several files at a time in a process pool.
+Each step is skipped, with a message, if the tool it needs can't be found.
+When everything is done the marker file ARCHIVE_COMPLETE is written.
+
+It can also be run by hand on an archive directory, e.g. to redo one that
+didn't complete:
+
+    archiving.py <archive_dir>
+"""
+
+COMPLETE_MARKER = 'ARCHIVE_COMPLETE'
+
+# Relative to the experiment directory, and where they go in the archive.
+OUTPUTS = [('OCN_RUNDIR', 'ocean*'), (os.path.join('ICE_RUNDIR', 'HISTORY'), 'iceh*')]
+
+def collect(exp_dir, archive_dir):
+    """
+    Move model output from 'exp_dir' into 'archive_dir'. Returns the files
+    moved.
+    """
+
+    moved = []
+    for d, pattern in OUTPUTS:
+        dest = os.path.join(archive_dir, d)
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+
+        for f in glob.glob(os.path.join(exp_dir, d, pattern)):
+            staging.move(f, os.path.join(dest, os.path.basename(f)))
+            moved.append(os.path.join(dest, os.path.basename(f)))
+
+    return moved
+
+def find_tool(names):
+    """
+    Find an executable, those in this directory, e.g. bin/mppnccombine,
+    before those on the PATH.
+    """
+
+    bin_dir = os.path.dirname(os.path.realpath(__file__))
+    for name in names:
+        path = os.path.join(bin_dir, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+    for name in names:
+        path = distutils.spawn.find_executable(name)
+        if path is not None:
+            return path
+    return None
+
+def outputs(archive_dir):
+    """
+    The model output in 'archive_dir', as put there by collect().
+    """
+
+    files = []
+    for d, pattern in OUTPUTS:
+        files.extend(glob.glob(os.path.join(archive_dir, d, pattern)))
+    return sorted(files)
+
+def combine(files, mppnccombine):
+    """
+    Combine the tiled files among 'files', the tiles are removed. Returns
+    the files left afterwards.
+    """
+
+    tiles = {}
+    others = []
+    for f in files:
+        m = re.search(r'^(.+\.nc)\.\d{4}$', f)
+        if m:
+            tiles.setdefault(m.group(1), []).append(f)
+        else:
+            others.append(f)
+
+    for output, parts in sorted(tiles.items()):
+        ret = subprocess.call([mppnccombine, '-r', output] + sorted(parts))
+        if ret != 0:
+            print 'mppnccombine failed on %s, the tiles have been kept.' % output
+            others.extend(parts)
+        elif output not in others:
+            others.append(output)
+
+    return sorted(others)
+
+def compress(filename, nccopy, level):
+    """
+    Compress a netcdf file in place.
+    """
+
+    tmp = filename + '.compressing'
+    ret = subprocess.call([nccopy, '-d', str(level), '-s', filename, tmp])
+    if ret != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        print 'nccopy failed on %s, it has been left uncompressed.' % filename
+        return
+    os.rename(tmp, filename)
+
+def md5sum(filename):
+
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def process_file(args):
+    """
+    Compress and checksum one file, run in a process pool.
+    """
+
+    (filename, nccopy, level) = args
+
+    if nccopy is not None and filename.endswith('.nc'):
+        compress(filename, nccopy, level)
+    return md5sum(filename)
+
+def postprocess(archive_dir, files=None, processes=4, compress_level=5):
+    """
+    Combine, compress and checksum the output in 'archive_dir', then write
+    the completion marker. Only 'files' are processed, by default the
+    model output found by outputs(). Anything else in the archive, such as
+    the inputs replaced by the next run, is left alone.
+    """
+
+    marker = os.path.join(archive_dir, COMPLETE_MARKER)
+    if os.path.exists(marker):
+        os.remove(marker)
+
+    if files is None:
+        files = outputs(archive_dir)
+
+    mppnccombine = find_tool(['mppnccombine', 'mppnccombine.exe'])
+    nccopy = find_tool(['nccopy'])
+    if mppnccombine is None:
+        print 'mppnccombine not found, tiled output will not be combined.'
+    if nccopy is None or compress_level == 0:
+        print 'Output in %s will not be compressed.' % archive_dir
+        nccopy = None
+
+    if mppnccombine is not None:
+        files = combine(files, mppnccombine)
+    files = sorted(files)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        sums = pool.map(process_file, [(f, nccopy, compress_level) for f in files])
+    finally:
+        pool.close()
+        pool.join()
+
+    with open(os.path.join(archive_dir, 'md5sums'), 'w') as f:
+        for filename, s in zip(files, sums):
+            f.write('%s  %s\n' % (s, os.path.relpath(filename, archive_dir)))
+
+    with open(marker, 'w') as f:
+        f.write('%s files\n' % len(files))
+
+def start(archive_dir, files=None, processes=4, compress_level=5):
+    """
+    Run postprocess() in a background process, join() it before exiting.
+    """
+
+    proc = multiprocessing.Process(target=postprocess, args=(archive_dir, files, processes, compress_level))
+    proc.start()
+    return proc
+
+def is_complete(archive_dir):
+
+    return os.path.exists(os.path.join(archive_dir, COMPLETE_MARKER))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archive_dir", help="The archive directory to post-process.")
+    parser.add_argument("--processes", default=4, type=int, help="The number of files to work on at once, defaults to 4.")
+    parser.add_argument("--compress", default=5, type=int, choices=range(10), help="nccopy compression level, 0 for none, defaults to 5.")
+
+    args = parser.parse_args()
+
+    postprocess(args.archive_dir, None, args.processes, args.compress)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
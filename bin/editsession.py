@@ -0,0 +1,165 @@
+import os
+import shutil
+
+from fnamelist import FortranNamelist, Namcouple
+
+"""
+Edit the configuration files of an experiment together.
+
+Each file is read once, however many changes are made to it, and all the
+changes are made in memory. commit() checks that the files agree with each
+other and then writes out those that have changed, each to a temporary file
+first which is then renamed into place. If anything goes wrong before the
+renames no file is touched. Used as a context manager it commits when the
+block finishes without an exception:
+
+    with EditSession() as session:
+        nml = session.namelist('exp/config/input.nml')
+        nml.set_value('ocean_model_nml', 'dt_ocean', 1800)
+"""
+
+# Namelist values that must be the same, as (file name, group, variable).
+# These are only checked if one of them was changed in the session, and only
+# for the files that the session has loaded.
+CONSISTENT = [('coupling timestep', [('input.nml', 'auscom_ice_nml', 'dt_cpl'),
+                                     ('input.nml', 'ocean_solo_nml', 'dt_cpld'),
+                                     ('input_ice.nml', 'coupling_nml', 'dt_cpl_io')]),
+              ('ice timestep', [('input_ice.nml', 'coupling_nml', 'dt_cice'),
+                                ('cice_in.nml', 'setup_nml', 'dt')]),
+              ('run length', [('input_atm.nml', 'coupling', 'runtime'),
+                              ('input_ice.nml', 'coupling_nml', 'runtime')])]
+
+def normalise(value):
+    """
+    So that e.g. '1800' and '1800.0' compare equal.
+    """
+
+    try:
+        return float(value)
+    except ValueError:
+        return value.strip().lower()
+
+class EditSession:
+    """
+    A set of configuration files being edited together, see above.
+    """
+
+    def __init__(self):
+        # Keyed by absolute path, the file object and its original contents.
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def load(self, filename, cls, *args):
+
+        path = os.path.abspath(filename)
+        if path not in self.files:
+            obj = cls(path, *args)
+            self.files[path] = (obj, str(obj))
+        return self.files[path][0]
+
+    def namelist(self, filename):
+        """
+        The FortranNamelist for 'filename', read the first time it's asked for.
+        """
+
+        return self.load(filename, FortranNamelist)
+
+    def namcouple(self, filename, model=None):
+        """
+        The Namcouple for 'filename', read the first time it's asked for.
+        """
+
+        return self.load(filename, Namcouple, model)
+
+    def modified(self):
+        """
+        The files whose contents have changed.
+        """
+
+        return sorted([path for path, (obj, original) in self.files.items() if str(obj) != original])
+
+    def changes(self):
+        """
+        What has changed in each modified file, a dictionary of lists of
+        (line number, old line, new line).
+        """
+
+        changes = {}
+        for path in self.modified():
+            (obj, original) = self.files[path]
+            old = original.splitlines()
+            new = str(obj).splitlines()
+            # Edits don't add or remove lines.
+            assert len(old) == len(new)
+            changes[path] = [(i + 1, o, n) for i, (o, n) in enumerate(zip(old, new)) if o != n]
+
+        return changes
+
+    def validate(self):
+        """
+        Check that the files agree with each other. Returns a list of
+        problems, empty if there are none.
+        """
+
+        problems = []
+
+        namelists = {}
+        runtimes = {}
+        for path, (obj, _) in self.files.items():
+            if isinstance(obj, FortranNamelist):
+                namelists[os.path.basename(path)] = obj
+            else:
+                runtimes[path] = normalise(obj.get_keyword('RUNTIME')[0])
+
+        if len(set(runtimes.values())) > 1:
+            problems.append('$RUNTIME differs between namcouple files: %s' %
+                            ', '.join(['%s %s' % (p, int(r)) for p, r in sorted(runtimes.items())]))
+
+        for description, variables in CONSISTENT:
+            values = []
+            changed = False
+            for name, group, variable in variables:
+                nml = namelists.get(name)
+                if nml is None or (group, 0) not in nml.index or variable not in nml.index[(group, 0)]:
+                    continue
+                values.append(('%s %s %s' % (name, group, variable), nml.get_value(group, variable)))
+                changed = changed or (group, variable) in nml.changed
+
+            if changed and len(set([normalise(v) for _, v in values])) > 1:
+                problems.append('Inconsistent %s: %s' % (description, ', '.join(['%s = %s' % v for v in values])))
+
+        return problems
+
+    def commit(self):
+        """
+        Validate and write out the modified files. Raises ValueError, before
+        anything is written, if the files don't agree.
+        """
+
+        problems = self.validate()
+        if problems:
+            raise ValueError('Not writing configuration:\n    ' + '\n    '.join(problems))
+
+        modified = self.modified()
+        try:
+            for path in modified:
+                with open(path + '.tmp', 'w') as f:
+                    f.write(str(self.files[path][0]))
+                shutil.copymode(path, path + '.tmp')
+        except:
+            for path in modified:
+                if os.path.exists(path + '.tmp'):
+                    os.remove(path + '.tmp')
+            raise
+
+        for path in modified:
+            os.rename(path + '.tmp', path)
+            self.files[path] = (self.files[path][0], str(self.files[path][0]))
+
+        return modified
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import argparse
+import threading
+import time
+import yaml
+
+import run
+import scheduler
+
+"""
+Run many experiments at once within a CPU budget, e.g. a spin-up ensemble
+or a parameter sweep.
+
+Each experiment is prepared and run for a number of submits, as run.py does,
+in its own thread. An experiment holds the CPUs given in its run_config.yaml
+from when it starts until its last submit is done. Experiments are started
+in the order given whenever there are enough CPUs free. All the jobs are
+waited on by a single scheduler.JobMonitor.
+"""
+
+def experiment_cpus(config):
+    """
+    The number of CPUs used by a run, from its run_config.yaml contents.
+    """
+
+    if 'ncpus' in config:
+        return int(config['ncpus'])
+
+    return sum([int(config[m]['ncpus']) for m in ['atm', 'ice', 'ocean']])
+
+
+def run_ensemble(experiments, cpus, run_one):
+    """
+    Run experiments concurrently without using more than 'cpus' at once.
+
+    'experiments' is a list of (name, ncpus) tuples. run_one(name) runs an
+    experiment to completion and returns 0 on success.
+
+    Returns a list of dictionaries with the name, ncpus, return code, start
+    and end time of each experiment.
+    """
+
+    for name, ncpus in experiments:
+        assert ncpus <= cpus, 'Experiment %s needs %s CPUs, more than the budget of %s' % (name, ncpus, cpus)
+
+    lock = threading.Lock()
+    cpus_free = threading.Condition(lock)
+    state = {'free' : cpus}
+    results = []
+
+    def run_thread(name, ncpus, result):
+
+        result['start'] = time.time()
+        try:
+            result['ret'] = run_one(name)
+        except Exception as e:
+            print 'Experiment %s failed: %s' % (name, e)
+            result['ret'] = 1
+        result['end'] = time.time()
+
+        with lock:
+            state['free'] += ncpus
+            cpus_free.notify()
+
+    threads = []
+    pending = list(experiments)
+    with lock:
+        while pending:
+            # First fit, in the order given.
+            ready = [e for e in pending if e[1] <= state['free']]
+            if not ready:
+                cpus_free.wait(1)
+                continue
+
+            name, ncpus = ready[0]
+            pending.remove(ready[0])
+            state['free'] -= ncpus
+
+            print 'Starting %s on %s CPUs, %s CPUs free' % (name, ncpus, state['free'])
+            result = {'name' : name, 'ncpus' : ncpus}
+            results.append(result)
+            thread = threading.Thread(target=run_thread, args=(name, ncpus, result))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+    for thread in threads:
+        # join() with a timeout so that KeyboardInterrupt still works.
+        while thread.is_alive():
+            thread.join(1)
+
+    return results
+
+
+def report(results, cpus, sim_years):
+    """
+    Print the time taken by each experiment and the throughput of the whole
+    ensemble. 'sim_years' is the simulated years done by each experiment.
+    """
+
+    start = min([r['start'] for r in results])
+    end = max([r['end'] for r in results])
+    elapsed = max(end - start, 1e-6)
+
+    print '%-30s %6s %6s %12s %8s' % ('experiment', 'ncpus', 'ret', 'wall (s)', 'SYPD')
+    for r in results:
+        wall = max(r['end'] - r['start'], 1e-6)
+        print '%-30s %6s %6s %12.1f %8.2f' % (r['name'], r['ncpus'], r['ret'], wall, sim_years*86400 / wall)
+
+    succeeded = [r for r in results if r['ret'] == 0]
+    core_seconds = sum([r['ncpus']*(r['end'] - r['start']) for r in results])
+
+    print 'Experiments: %s, succeeded: %s' % (len(results), len(succeeded))
+    print 'Elapsed: %.1f s' % elapsed
+    print 'Aggregate throughput: %.2f simulated years per day' % (len(succeeded)*sim_years*86400 / elapsed)
+    print 'CPU utilisation: %.1f%% of %s CPUs' % (100*core_seconds / (cpus*elapsed), cpus)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("experiments", nargs='*', help="The experiments to run, defaults to all those under exp/ with a run_config.yaml.")
+    parser.add_argument("--cpus", required=True, type=int, help="The most CPUs to use at once.")
+    parser.add_argument("--submits", default=1, type=int, help="The number of times to submit each experiment.")
+    parser.add_argument("--submit_runtime_months", default=12, type=int, help="The length of each submit in months, defaults to 12.")
+    parser.add_argument("--new_run", action='store_true', default=False, help="Set this option to indicate a new run.")
+    parser.add_argument("--init_date", default='00010101', type=str, help="The initial date of the entire run, this is a string of form yyyymmdd.")
+    parser.add_argument("--input_dir", default='/short/v45/auscom', type=str, help="Where input data is kept for each experiment.")
+    parser.add_argument("--run_direct", action='store_true', default=False, help="Run the models directly, don't use qsub. Same as --scheduler direct.")
+    parser.add_argument("--scheduler", default='pbs', choices=['pbs', 'direct', 'local'], help="How to run the models, see run.py. Defaults to 'pbs'.")
+    parser.add_argument("--model", default='auscom', help="Which model to run. Should be either 'auscom' or 'access', defaults to 'auscom'")
+
+    args = parser.parse_args()
+
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    exps_dir = os.path.abspath(os.path.join(script_path, '../exp/'))
+
+    names = args.experiments
+    if not names:
+        names = sorted([d for d in os.listdir(exps_dir) if os.path.exists(os.path.join(exps_dir, d, 'run_config.yaml'))])
+
+    configs = {}
+    for name in names:
+        with open(os.path.join(exps_dir, name, 'run_config.yaml')) as f:
+            configs[name] = yaml.safe_load(f)
+
+    experiments = [(name, experiment_cpus(configs[name])) for name in names]
+    for name, ncpus in experiments:
+        if ncpus > args.cpus:
+            sys.stderr.write('Experiment %s needs %s CPUs, more than --cpus %s.\n' % (name, ncpus, args.cpus))
+            return 1
+
+    if args.run_direct:
+        args.scheduler = 'direct'
+    job_scheduler = scheduler.make_scheduler(args.scheduler)
+    monitor = scheduler.JobMonitor(job_scheduler)
+    init_date = run.str_to_date(args.init_date)
+
+    def run_one(name):
+
+        exp_dir = os.path.join(exps_dir, name)
+        if args.new_run:
+            input_dir = os.path.abspath(os.path.join(args.input_dir, name))
+            assert (os.path.exists(input_dir))
+            run.prepare_newrun(exp_dir, args.model, input_dir)
+        else:
+            run.prepare_contrun(exp_dir, args.model, init_date)
+
+        return run.run_submits(name, args.model, exp_dir, configs[name], job_scheduler, init_date,
+                               args.submit_runtime_months, args.submits, args.new_run, monitor=monitor)
+
+    results = run_ensemble(experiments, args.cpus, run_one)
+    monitor.stop()
+    run.clean_up()
+
+    report(results, args.cpus, args.submits*args.submit_runtime_months / 12.0)
+
+    return 0 if all([r['ret'] == 0 for r in results]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
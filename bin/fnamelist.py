@@ -1,6 +1,106 @@
 
+import os
 import re
 import sys
+import shutil
+
+def replace_file(filename, text):
+    """
+    Write 'text' to a new file and rename it over 'filename'. Files staged
+    into the run directories may be hard links to the originals, writing
+    them in place would change the originals too.
+    """
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    if os.path.exists(filename):
+        shutil.copymode(filename, tmp)
+    os.rename(tmp, filename)
+
+class NamcoupleLine(object):
+    """
+    A line of a namcouple file split into whitespace separated tokens. Tokens
+    can be changed, all whitespace is kept as it was.
+    """
+
+    def __init__(self, text):
+        self.pieces = re.split(r'(\s+)', text)
+        # The pieces that are tokens, the rest is whitespace.
+        self.positions = [i for i, p in enumerate(self.pieces) if i % 2 == 0 and p != '']
+
+    def is_comment(self):
+        return len(self.positions) == 0 or self.pieces[self.positions[0]].startswith('#')
+
+    def tokens(self):
+        return [self.pieces[i] for i in self.positions]
+
+    def __getitem__(self, i):
+        return self.pieces[self.positions[i]]
+
+    def __setitem__(self, i, value):
+        self.pieces[self.positions[i]] = str(value)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __str__(self):
+        return ''.join(self.pieces)
+
+
+class NamcoupleField(object):
+    """
+    A field in the $STRINGS section of a namcouple file.
+
+    The first line of a field block has the source and target names, label,
+    coupling period, number of transformations, restart file and status.
+    The second line has, optionally, the grid dimensions, then the source and
+    target grid names, LAG and SEQ. After that there are the transformations,
+    these are kept as lines.
+    """
+
+    def __init__(self, header, grids, lines):
+        self.header = header
+        self.grids = grids
+        self.lines = lines
+
+    def keyword(self, name):
+        """
+        Index of the token on the grids line like 'name=...'.
+        """
+
+        for i, t in enumerate(self.grids.tokens()):
+            if t.upper().startswith(name + '='):
+                return i
+        return None
+
+    def get_lag(self):
+        return int(self.grids[self.keyword('LAG')].split('=')[1])
+
+    def set_lag(self, lag):
+        lag = int(lag)
+        self.grids[self.keyword('LAG')] = 'LAG=+%d' % lag if lag > 0 else 'LAG=%d' % lag
+
+    source = property(lambda self: self.header[0])
+    target = property(lambda self: self.header[1])
+    period = property(lambda self: int(self.header[3]), lambda self, v: self.header.__setitem__(3, int(v)))
+    restart = property(lambda self: self.header[5])
+    status = property(lambda self: self.header[6])
+    source_grid = property(lambda self: self.grids[self.keyword('LAG') - 2])
+    target_grid = property(lambda self: self.grids[self.keyword('LAG') - 1])
+    lag = property(get_lag, set_lag)
+
+    def transformations(self):
+        """
+        The names of the transformations applied to the field.
+        """
+
+        lines = [l for l in self.lines if not l.is_comment()]
+        if self.status in ['EXPORTED', 'EXPOUT', 'AUXILARY']:
+            # Skip the grid periodicity line.
+            lines = lines[1:]
+        return lines[0].tokens() if lines else []
+
 
 class Namcouple:
     """
@@ -8,61 +108,127 @@ class Namcouple:
 
     Allows fields to be modified.
 
-    Presently only supports $RUNTIME
+    The file is read once into lines. Keyword sections like $RUNTIME are
+    indexed by name, and the $STRINGS section is split into a list of
+    NamcoupleField. Queries and changes work on these, e.g. to set the
+    coupling period of all the ice to ocean fields:
+
+        for f in nc.select(restart='INPUT/i2o.nc'):
+            f.period = 3600
+
+    Only the tokens that are changed differ when it's written out.
     """
 
-    def __init__(self, filename, model):
+    statuses = ['EXPORTED', 'IGNORED', 'EXPOUT', 'IGNOUT', 'AUXILARY']
+
+    def __init__(self, filename, model=None):
         self.filename = filename
         self.model = model
         with open(filename, 'r') as f:
-            self.str = f.read()
+            self.parse(f.read())
+
+    def is_field_header(self, line):
+
+        t = line.tokens()
+        return (len(t) == 7 and t[2].isdigit() and t[3].isdigit() and t[4].isdigit()
+                and t[6] in self.statuses)
+
+    def parse(self, text):
+
+        self.lines = [NamcoupleLine(l) for l in text.splitlines(True)]
+        self.keywords = {}
+        self.fields = []
+
+        section = None
+        field_lines = None
+        for line in self.lines:
+            if line.is_comment():
+                if field_lines is not None:
+                    field_lines.append(line)
+                continue
+
+            if line[0].startswith('$'):
+                if field_lines is not None:
+                    self.add_field(field_lines)
+                    field_lines = None
+                section = line[0][1:].upper()
+                if section == 'END':
+                    section = None
+            elif section == 'STRINGS':
+                if self.is_field_header(line):
+                    if field_lines is not None:
+                        self.add_field(field_lines)
+                    field_lines = [line]
+                elif field_lines is not None:
+                    field_lines.append(line)
+            elif section is not None and section not in self.keywords:
+                # The first line of a keyword section holds its value.
+                self.keywords[section] = line
+
+        if field_lines is not None:
+            self.add_field(field_lines)
+
+    def add_field(self, lines):
+
+        header = lines[0]
+        rest = [l for l in lines[1:] if not l.is_comment()]
+        grids = rest[0]
+        self.fields.append(NamcoupleField(header, grids, lines[lines.index(grids) + 1:]))
+
+    def get_keyword(self, keyword):
+        """
+        The value of a keyword section, e.g. 'RUNTIME', as a list of tokens.
+        """
+
+        assert keyword in self.keywords, 'No $%s in %s' % (keyword, self.filename)
+        return self.keywords[keyword].tokens()
 
     def set_runtime(self, runtime):
 
-        m = re.search(r"^[ \t]*\$RUNTIME.*?^[ \t]*(\d+)", self.str, re.MULTILINE | re.DOTALL)
-        assert(m is not None)
-        self.str = self.str[:m.start(1)] + str(runtime) + self.str[m.end(1):]
+        assert 'RUNTIME' in self.keywords, 'No $RUNTIME in %s' % self.filename
+        self.keywords['RUNTIME'][0] = runtime
 
-    def set_ocean_timestep(self, timestep):
+    def select(self, **criteria):
+        """
+        Return the fields that have all the given attributes, e.g.
+        select(source_grid='cice', target_grid='nt62').
+        """
 
-        def substitute_timestep(regex):
-            """
-            Make one change at a time, each change affects subsequent matches.
-            """
-            timestep_changed = False
-            while True:
-                matches = re.finditer(regex, self.str, re.MULTILINE | re.DOTALL)
-                none_updated = True
-                for m in matches:
-                    if m.group(1) == timestep:
-                        continue
-                    else:
-                        self.str = self.str[:m.start(1)] + timestep + self.str[m.end(1):]
-                        none_updated = False
-                        timestep_changed = True
-                        break
-
-                if none_updated:
-                    break
-
-            if not timestep_changed:
-                sys.stderr.write('WARNING: no timstep values were updated.\n')
+        return [f for f in self.fields
+                if all([getattr(f, k) == v for k, v in criteria.items()])]
+
+    def set_ocean_timestep(self, timestep):
+        """
+        Set the lag of the fields going between the atmosphere and ice, and
+        the coupling period of the fields between the ice and ocean.
+        """
 
         if self.model == 'auscom':
-            substitute_timestep(r"nt62 cice LAG=\+(\d+) ")
-            substitute_timestep(r"cice nt62 LAG=\+(\d+) ")
-            substitute_timestep(r"\d+ (\d+) \d+ INPUT/i2o.nc EXPORTED")
-            substitute_timestep(r"\d+ (\d+) \d+ INPUT/o2i.nc EXPORTED")
+            lag_grids = [('nt62', 'cice'), ('cice', 'nt62')]
+            restarts = ['i2o.nc', 'o2i.nc']
+            status = 'EXPORTED'
         else:
-            substitute_timestep(r"cice um1t LAG=\+(\d+) ")
-            substitute_timestep(r"cice um1u LAG=\+(\d+) ")
-            substitute_timestep(r"cice um1v LAG=\+(\d+) ")
-            substitute_timestep(r"\d+ (\d+) \d+ i2o.nc IGNORED")
-            substitute_timestep(r"\d+ (\d+) \d+ o2i.nc IGNORED")
+            lag_grids = [('cice', 'um1t'), ('cice', 'um1u'), ('cice', 'um1v')]
+            restarts = ['i2o.nc', 'o2i.nc']
+            status = 'IGNORED'
+
+        changed = 0
+        for f in self.fields:
+            if (f.source_grid, f.target_grid) in lag_grids and f.lag > 0:
+                f.lag = timestep
+                changed += 1
+            if os.path.basename(f.restart) in restarts and f.status == status:
+                f.period = timestep
+                changed += 1
+
+        if changed == 0:
+            sys.stderr.write('WARNING: no timstep values were updated.\n')
+
+    def __str__(self):
+        return ''.join([str(l) for l in self.lines])
 
     def write(self):
-        with open(self.filename, 'w') as f:
-            f.write(self.str)
+        replace_file(self.filename, str(self))
 
 
 class FortranNamelist:
@@ -70,32 +236,140 @@ class FortranNamelist:
     Class to represent a Fortran namelist file.
 
     Can be used to modify fields.
+
+    The file is split into tokens once, the value of each variable being a
+    single token, and an index is kept from (group, variable) to the value
+    token. Getting and setting a value is a dictionary lookup and writing
+    out is a join, so everything that isn't changed, including formatting
+    and comments, is kept exactly as it was.
+
+    Group and variable names are not case sensitive. Array elements like
+    latpnt(1) and derived type members like cable_user%CABLE_RUNTIME_COUPLED
+    are variables in their own right. A value may be an array, e.g.
+    histfreq = 'm','x','x', it is get and set as a whole. If a group appears
+    more than once 'index' selects which, counting from 0.
     """
 
+    token_regex = re.compile(r"""
+        (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+       |(?P<comment>![^\n]*)
+       |(?P<end>&end\b|/)
+       |(?P<group>&\w+)
+       |(?P<name>[a-z_][\w%]*(?:\([^)=]*\))?[ \t]*=)
+       |(?P<space>\s+)
+       |(?P<comma>,)
+       |(?P<value>[^\s,!'"/&=]+)
+       |(?P<other>.)
+       """, re.IGNORECASE | re.VERBOSE | re.DOTALL)
+
     def __init__(self, filename):
         self.filename = filename
         with open(filename, 'r') as f:
-            self.str = f.read()
+            self.parse(f.read())
 
-    def get_value(self, record, variable):
+    def parse(self, text):
         """
-        Return the value, start index and end index.
+        Split 'text' into tokens and build the index.
         """
 
-        # The %% is to escape the format character '%'
-        regex = r"%s[ \t]*=[ \t]*(.*?)(?=\s+,?\s*(?:[%%\w]+[ \t]*=)|(?:/))"
-        m = re.search((r"&%s.*?" + regex) % (record, variable), self.str, re.MULTILINE | re.DOTALL)
-        assert(m is not None)
+        self.tokens = []
+        self.index = {}
+        self.changed = set()
+        counts = {}
 
-        return (m.group(1), m.start(1), m.end(1) if m.group(1)[-1] != '\n' else m.end(1) - 1)
+        group = None
+        variable = None
+        pending = []
 
-    def set_value(self, record, variable, value):
+        for m in self.token_regex.finditer(text):
+            kind = m.lastgroup
+            token = m.group()
 
-        (_, start, end) = self.get_value(record, variable)
+            if group is None:
+                if kind == 'group':
+                    name = token[1:].lower()
+                    group = (name, counts.get(name, 0))
+                    counts[name] = group[1] + 1
+                    self.index[group] = {}
+                self.tokens.append(token)
+                continue
 
-        self.str = self.str[:start] + str(value) + self.str[end:]
+            if kind in ['end', 'name', 'group']:
+                if variable is not None:
+                    self.add_value(group, variable, pending)
+                    variable = None
+                    pending = []
 
-    def write(self):
-        with open(self.filename, 'w') as f:
-            f.write(self.str)
+                if kind == 'name':
+                    variable = re.sub(r'\s', '', token[:-1]).lower()
+                elif kind == 'end':
+                    group = None
+                self.tokens.append(token)
+            elif variable is not None:
+                pending.append((kind, token))
+            else:
+                self.tokens.append(token)
+
+        if variable is not None:
+            self.add_value(group, variable, pending)
 
+        assert ''.join(self.tokens) == text
+
+    def add_value(self, group, variable, pending):
+        """
+        Add the tokens after 'variable =', merging those that make up the
+        value into one. Whitespace, comments and commas either side of the
+        value are kept as they are.
+        """
+
+        kinds = [k for k, _ in pending]
+        first = 0
+        while first < len(pending) and kinds[first] in ['space', 'comment', 'comma']:
+            first += 1
+        last = len(pending)
+        while last > first and kinds[last - 1] in ['space', 'comment', 'comma']:
+            last -= 1
+
+        if first == last:
+            # No value, put an empty one straight after the '='.
+            first = last = 0
+
+        self.tokens.extend([t for _, t in pending[:first]])
+        # As in Fortran, a later assignment of the same variable wins.
+        self.index[group][variable] = len(self.tokens)
+        self.tokens.append(''.join([t for _, t in pending[first:last]]))
+        self.tokens.extend([t for _, t in pending[last:]])
+
+    def find(self, record, variable, index):
+
+        group = (record.lower(), index)
+        assert group in self.index, 'No &%s in %s' % (record, self.filename)
+        variables = self.index[group]
+        assert variable.lower() in variables, 'No %s in &%s in %s' % (variable, record, self.filename)
+
+        return variables[variable.lower()]
+
+    def get_value(self, record, variable, index=0):
+        """
+        Return the value, as it appears in the file.
+        """
+
+        return self.tokens[self.find(record, variable, index)]
+
+    def set_value(self, record, variable, value, index=0):
+        """
+        Set a value. Lists and tuples are written as arrays, anything else
+        is written with str().
+        """
+
+        if isinstance(value, (list, tuple)):
+            value = ', '.join([str(v) for v in value])
+
+        self.tokens[self.find(record, variable, index)] = str(value)
+        self.changed.add((record.lower(), variable.lower()))
+
+    def __str__(self):
+        return ''.join(self.tokens)
+
+    def write(self):
+        replace_file(self.filename, str(self))
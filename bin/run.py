@@ -12,13 +12,21 @@ import datetime
 import calendar
 import copy
 import yaml
-from fnamelist import FortranNamelist, Namcouple
+from fnamelist import FortranNamelist
+from editsession import EditSession
+import staging
+import scheduler
+import archiving
+import telemetry
 from operator import xor
 
 """
 Set off auscom and access runs. Getting very messy, move to payu. 
 """
 
+# Background archive post-processing, waited for by clean_up().
+archive_procs = []
+
 run_script = """
 #!/bin/csh -f
 
@@ -33,7 +41,11 @@ run_script = """
 module load openmpi/1.6.5-mlx
 module load ipm
 
+date +%s > <run_times>
 mpirun --mca mtl ^mxm --mca orte_base_help_aggregate 0 -wdir <atm_dir> -n <atm_ncpus> <exp_dir>/matmxx : -wdir <ice_dir> -n <ice_ncpus> <exp_dir>/cicexx : -wdir <ocn_dir> -n <ocn_ncpus> <exp_dir>/mom5xx 2> <ocn_dir>/stderr.txt 1> <ocn_dir>/stdout.txt
+date +%s >> <run_times>
+<post_segment>
+touch <sentinel>
 
 """
 
@@ -42,45 +54,54 @@ def prepare_newrun(exp_dir, model, input_dir):
     Anything that needs to be done before the model starts.
     """
 
-    # Delete and remake old INPUT and RESTART dirs, these get polluted. e.g. by oasis writing over the restart files.
+    # Work out what goes where. Inputs are linked unless the models write to
+    # them, in which case they are copied, see staging.py.
+    files = []
     for d, m in [('ATM_RUNDIR', 'atm'), ('ICE_RUNDIR', 'ice'), ('OCN_RUNDIR', 'ocn')]:
 
         rundir = os.path.join(exp_dir, d)
-        if os.path.exists(rundir):
-            shutil.rmtree(rundir)
-
         if model == 'access' and d == 'ATM_RUNDIR':
             input = rundir
         else:
             input = os.path.join(exp_dir, d, 'INPUT')
 
-        restart = os.path.join(exp_dir, d, 'RESTART')
-        history = os.path.join(exp_dir, d, 'HISTORY')
-        os.makedirs(input)
-        os.makedirs(restart)
-        os.makedirs(history)
-
-        # Copy over inputs and fix perms.
+        # Inputs.
         for f in glob.glob('%s/*' % os.path.join(input_dir, m)):
-            shutil.copy(f, input)
-            os.chmod(os.path.join(input, os.path.basename(f)), 0664)
+            files.append((f, input, staging.is_writable(f)))
 
-        # Copy oasis files into input dir. 
+        # Oasis files.
         for f in glob.glob('%s/*' % os.path.join(input_dir, 'oasis')):
             if model == 'access':
-                shutil.copy(f, rundir)
-                os.chmod(os.path.join(rundir, os.path.basename(f)), 0664)
+                files.append((f, rundir, staging.is_writable(f)))
             else:
-                shutil.copy(f, input)
-                os.chmod(os.path.join(input, os.path.basename(f)), 0664)
+                files.append((f, input, staging.is_writable(f)))
 
         # For some reason cice needs o2i.nc in a special place. FIXME.
         if model == 'access' and d == 'ICE_RUNDIR':
-            shutil.copy(os.path.join(rundir, 'o2i.nc'), os.path.join(restart, 'o2i.nc'))
+            files.append((os.path.join(input_dir, 'oasis', 'o2i.nc'), os.path.join(rundir, 'RESTART'), True))
 
-        # Copy fresh config files into place. 
+        # Fresh config files, these are modified so are always copied.
         for f in glob.glob('%s/config/*' % exp_dir):
-            shutil.copy(f, os.path.join(exp_dir, d))
+            files.append((f, rundir, True))
+
+    # Clear out anything left over from previous runs, e.g. oasis writing
+    # over the restart files. Staged files are kept, they are checked
+    # against the staging manifest and only replaced if they've changed.
+    for d in ['ATM_RUNDIR', 'ICE_RUNDIR', 'OCN_RUNDIR']:
+        rundir = os.path.join(exp_dir, d)
+        keep = set([os.path.basename(f) for f, dest, _ in files if dest == rundir])
+        staging.clean_dir(rundir, keep | set(['INPUT']))
+        staging.clean_dir(os.path.join(rundir, 'INPUT'),
+                          [os.path.basename(f) for f, dest, _ in files if dest == os.path.join(rundir, 'INPUT')])
+
+    for dest in set([os.path.join(exp_dir, d, sub) for d in ['ATM_RUNDIR', 'ICE_RUNDIR', 'OCN_RUNDIR']
+                                                   for sub in ['RESTART', 'HISTORY']] +
+                    [dest for _, dest, _ in files]):
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+
+    counts = staging.stage(files)
+    print 'Staged inputs: %(linked)s linked, %(copied)s copied, %(skipped)s unchanged' % counts
 
     shutil.copytree(os.path.join(exp_dir, 'atm_tmp_ctrl'), os.path.join(exp_dir, 'ATM_RUNDIR', 'tmp_ctrl'))
     os.makedirs(os.path.join(exp_dir, 'ATM_RUNDIR', 'tmp'))
@@ -92,26 +113,31 @@ def prepare_newrun(exp_dir, model, input_dir):
         nml.write()
 
 
-def prepare_contrun(exp_dir, model, cont_date):
+def prepare_contrun(exp_dir, model, cont_date, archive_dir=None):
     """
     Anything that needs to be done before a continuation run, apart from setting up the dates.
     
     There are some things that the models should take care of themselves.
+
+    Restarts are moved, not copied, into place. Inputs they replace are moved
+    to 'archive_dir', by default a directory under exp_dir/archive.
     """
 
     cont_date_str = date_to_str(cont_date)
+    if archive_dir is None:
+        archive_dir = os.path.join(exp_dir, 'archive', 'inputs_before_%s' % cont_date_str)
 
     ice_input = os.path.join(exp_dir, 'ICE_RUNDIR', 'INPUT')
     ice_restart = os.path.join(exp_dir, 'ICE_RUNDIR', 'RESTART')
     ocn_input = os.path.join(exp_dir, 'OCN_RUNDIR', 'INPUT')
     ocn_restart = os.path.join(exp_dir, 'OCN_RUNDIR', 'RESTART')
 
-    # Copy over some CICE files. 
+    # Copy over some CICE files. mice.nc is written in place so it needs a copy.
     if model == 'access':
         shutil.copy(os.path.join(exp_dir, 'ICE_RUNDIR', 'mice.nc'), ice_input)
     else:
-        shutil.copy(os.path.join(ice_restart, 'u_star.nc'), ice_input)
-        shutil.copy(os.path.join(ice_restart, 'sicemass.nc'), ice_input)
+        staging.promote(ice_restart, ice_input, os.path.join(archive_dir, 'ICE_RUNDIR', 'INPUT'),
+                        ['u_star.nc', 'sicemass.nc'])
 
     # Setup the CICE restart. 
     # Check that restart file for this start date exists. 
@@ -119,23 +145,25 @@ def prepare_contrun(exp_dir, model, cont_date):
     with open(os.path.join(ice_restart, 'ice.restart_file'), 'w') as f:
         f.write('iced.%s' % cont_date_str)
 
-    # Copy over ocean restarts.
-    for f in glob.glob('%s/*' % ocn_restart):
-        shutil.copy(f, ocn_input)
+    # Move ocean restarts into place, the model writes new ones to RESTART.
+    staging.promote(ocn_restart, ocn_input, os.path.join(archive_dir, 'OCN_RUNDIR', 'INPUT'))
 
-    # Copy fresh config files into place. FIXME: This is being done in newrun also.
+    # Copy fresh config files into place, those that haven't been changed are skipped.
+    files = []
     for d in ['ATM_RUNDIR', 'ICE_RUNDIR','OCN_RUNDIR']:
         for f in glob.glob('%s/config/*' % exp_dir):
-            shutil.copy(f, os.path.join(exp_dir, d))
+            files.append((f, os.path.join(exp_dir, d), True))
+    staging.stage(files)
 
     if model == 'access':
-        # Copy over the oasis restarts. FIXME: should this be done for auscom model?
+        # Copy over the oasis restarts, both copies are written to. FIXME: should this be done for auscom model?
         shutil.copy(os.path.join(ocn_input, 'o2i.nc'), ice_restart)
 
-        # Copy over UM restart file. 
+        # Link the UM restart file, it is only read.
         um_restart_src = os.path.join(exp_dir, 'ATM_RUNDIR', 'aiihca.da%s' % date_to_um_date(cont_date))
         um_restart_dest = os.path.join(exp_dir, 'ATM_RUNDIR', 'PIC2C-0.25.astart')
-        shutil.copy(um_restart_src, um_restart_dest)
+        staging.remove(um_restart_dest)
+        staging.link(um_restart_src, um_restart_dest)
 
         # Tell CABLE that this is a cont run.
         nml = FortranNamelist(os.path.join(exp_dir, 'ATM_RUNDIR', 'cable.nml'))
@@ -235,8 +263,13 @@ def set_next_startdate(exp_dir, init_date, prev_start_date, runtime_per_submit,
     Tell the models when to start by modifying the input namelists.
 
     runtime_per_submit is in months.
+
+    All the files are read once and written together at the end, see
+    editsession.py.
     """
 
+    session = EditSession()
+
     if prev_start_date is None:
         start_date = init_date
     else:
@@ -260,17 +293,16 @@ def set_next_startdate(exp_dir, init_date, prev_start_date, runtime_per_submit,
 
     # Atmos.
     if model == 'auscom': 
-        nml = FortranNamelist(os.path.join(atm_rundir, 'input_atm.nml'))
+        nml = session.namelist(os.path.join(atm_rundir, 'input_atm.nml'))
         # The start of the experiment.
         nml.set_value('coupling', 'init_date', init_str)
         # The start of the run.
         nml.set_value('coupling', 'inidate', run_str)
         nml.set_value('coupling', 'truntime0', days_since_start*86400)
         nml.set_value('coupling', 'runtime', days_this_run*86400)
-        nml.write()
     else:
         # Changes for the UM. 
-        nml = FortranNamelist(os.path.join(atm_rundir, 'tmp_ctrl', 'CNTLALL'))
+        nml = session.namelist(os.path.join(atm_rundir, 'tmp_ctrl', 'CNTLALL'))
         # Run length
         nml.set_value('NLSTCALL', 'RUN_TARGET_END', '0, 0, %s, 0, 0, 0' % days_this_run)
         # Resubmit increement
@@ -278,11 +310,9 @@ def set_next_startdate(exp_dir, init_date, prev_start_date, runtime_per_submit,
         # Start time
         nml.set_value('NLSTCALL', 'MODEL_BASIS_TIME', '%s, %s, %s, 0, 0, 0' % (run_str[0:4], run_str[4:6], run_str[6:8]))
         nml.set_value('NLSTCALL', 'ANCIL_REFTIME', '%s, %s, %s, 0, 0, 0' % (run_str[0:4], run_str[4:6], run_str[6:8]))
-        nml.write()
 
-        nml = FortranNamelist(os.path.join(atm_rundir, 'tmp_ctrl', 'SIZES'))
+        nml = session.namelist(os.path.join(atm_rundir, 'tmp_ctrl', 'SIZES'))
         nml.set_value('STSHCOMP', 'RUN_TARGET_END', '0, 0, %s, 0, 0, 0' % days_this_run)
-        nml.write()
 
         def dump_times_string(start_date, num_dumps):
             """
@@ -305,31 +335,28 @@ def set_next_startdate(exp_dir, init_date, prev_start_date, runtime_per_submit,
 
             return str
 
-        nml = FortranNamelist(os.path.join(atm_rundir, 'tmp_ctrl', 'CNTLGEN'))
+        nml = session.namelist(os.path.join(atm_rundir, 'tmp_ctrl', 'CNTLGEN'))
         nml.set_value('NLSTCGEN', 'DUMPTIMESim', dump_times_string(start_date, runtime_per_submit))
-        nml.write()
 
     # Ice
     ice_rundir = os.path.join(exp_dir, 'ICE_RUNDIR')
-    nml = FortranNamelist(os.path.join(ice_rundir, 'cice_in.nml'))
+    nml = session.namelist(os.path.join(ice_rundir, 'cice_in.nml'))
     nml.set_value('setup_nml', 'year_init', start_date.year)
     nml.set_value('setup_nml', 'runtype', '\'initial\'') if newrun else nml.set_value('setup_nml', 'runtype', '\'continue\'')
     nml.set_value('setup_nml', 'restart', '.false.') if newrun else nml.set_value('setup_nml', 'restart', '.true.')
-    (dt, _, _) = nml.get_value('setup_nml', 'dt')
+    dt = nml.get_value('setup_nml', 'dt')
     assert(days_this_run*86400 % int(dt) == 0)
     nml.set_value('setup_nml', 'npt', (days_this_run*86400) // int(dt))
-    nml.write()
-    nml = FortranNamelist(os.path.join(ice_rundir, 'input_ice.nml'))
+    nml = session.namelist(os.path.join(ice_rundir, 'input_ice.nml'))
     nml.set_value('coupling_nml', 'init_date', init_str)
     nml.set_value('coupling_nml', 'inidate', run_str)
     nml.set_value('coupling_nml', 'runtime0', days_since_start*86400)
     nml.set_value('coupling_nml', 'runtime', days_this_run*86400)
     nml.set_value('coupling_nml', 'jobnum', submit_num)
-    nml.write()
 
     # Ocean
     ocn_rundir = os.path.join(exp_dir, 'OCN_RUNDIR')
-    nml = FortranNamelist(os.path.join(ocn_rundir, 'input.nml'))
+    nml = session.namelist(os.path.join(ocn_rundir, 'input.nml'))
     nml.set_value('ocean_solo_nml', 'years', runtime_per_submit // 12)
     nml.set_value('ocean_solo_nml', 'months', runtime_per_submit % 12)
     nml.set_value('ocean_solo_nml', 'days', 0)
@@ -338,26 +365,37 @@ def set_next_startdate(exp_dir, init_date, prev_start_date, runtime_per_submit,
     nml.set_value('ocean_solo_nml', 'seconds', 0)
     # This date_init value is read from RESTART/ocean_solo.res if it exists. 
     nml.set_value('ocean_solo_nml', 'date_init', str(start_date.year).zfill(4) + ',' + str(start_date.month).zfill(2) + ',01,0,0,0')
-    nml.write()
 
     # Oasis namcouple
     for r in [atm_rundir, ice_rundir, ocn_rundir]:
-        nc = Namcouple(os.path.join(r, 'namcouple'), model)
+        nc = session.namcouple(os.path.join(r, 'namcouple'), model)
         # FIXME: there is a bug in the models, an extra timestep is made at the end of a month. 
         # This then causes an assertion failure in oasis. For the time being just increase the 
         # oasis max by one day. 
         nc.set_runtime((days_this_run + 1)*86400)
-        nc.write()
+
+    session.commit()
 
     return (start_date, end_date)
 
 def clean_up():
-    pass
+    """
+    Wait for background archiving to finish.
+    """
+
+    for proc in archive_procs:
+        proc.join()
+        if proc.exitcode != 0:
+            print 'Archive post-processing failed, exit code %s' % proc.exitcode
+    del archive_procs[:]
 
 
-def make_run_script(exp_name, model, exp_dir, config):
+def make_run_script(exp_name, model, exp_dir, config, sentinel, post_segment=False):
     """
-    Create either auscom or access script. 
+    Create either auscom or access script. The auscom script touches the
+    file 'sentinel' when the run is done, and writes the times before and
+    after the model runs for telemetry.py. If 'post_segment' is True it also
+    prepares the next segment of a chain before exiting, see chain().
 
     HACK: for now just submit pre-existing access run script. 
     """
@@ -384,6 +422,15 @@ def make_run_script(exp_name, model, exp_dir, config):
 
         script = script.replace('<exp_dir>' , exp_dir)
         script = script.replace('<exp_name>' , exp_name[:15])
+        script = script.replace('<sentinel>' , sentinel)
+        script = script.replace('<run_times>' , os.path.join(exp_dir, telemetry.RUN_TIMES))
+
+        hook = ''
+        if post_segment:
+            # A failed hook fails the job, so the next segment doesn't run.
+            run_py = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'run.py')
+            hook = '%s %s %s --post_segment || exit 1' % (sys.executable, run_py, os.path.basename(exp_dir))
+        script = script.replace('<post_segment>', hook)
 
         qsub_script = os.path.join(exp_dir, 'qsub_run.sh')
         with open(qsub_script, 'w') as f:
@@ -393,38 +440,43 @@ def make_run_script(exp_name, model, exp_dir, config):
 
     return qsub_script
 
-def run(exp_name, model, exp_dir, config, run_direct):
+def run(exp_name, model, exp_dir, config, job_scheduler, monitor=None):
     """
     Submit a job, wait for it to finish, check that it completed properly.
-    """
-
-    def wait(run_id):
 
-        while True:
-            time.sleep(10)
-            qsub_out = ''
-            try: 
-                qsub_out = subprocess.check_output(['qstat', run_id], stderr=subprocess.STDOUT)
-            except subprocess.CalledProcessError as err:
-                qsub_out = err.output
+    'job_scheduler' is a backend from scheduler.py. The job is waited for
+    with 'monitor', a scheduler.JobMonitor, one is made if not given.
+    """
 
-            if 'Job has finished' in qsub_out:
-                break
+    # Touched by the run script when it's done.
+    sentinel = os.path.join(exp_dir, 'run_complete')
+    for f in [sentinel, os.path.join(exp_dir, telemetry.RUN_TIMES)]:
+        if os.path.exists(f):
+            os.remove(f)
 
-    qsub_script = make_run_script(exp_name, model, exp_dir, config)
+    qsub_script = make_run_script(exp_name, model, exp_dir, config, sentinel)
 
     # Submit the experiment
-    if run_direct:
-        subprocess.call([qsub_script], shell=True)
-        run_id = str(time.time())
+    run_id = job_scheduler.submit(qsub_script)
+    print 'Job submitted, runid: %s' % run_id
+
+    # Wait for termination.
+    if monitor is None:
+        monitor = scheduler.JobMonitor(job_scheduler)
+        monitor.wait(run_id, sentinel)
+        monitor.stop()
     else:
-        run_id = subprocess.check_output(['qsub', qsub_script])
-        run_id = run_id.rstrip()
+        monitor.wait(run_id, sentinel)
 
-        print 'Job submitted, runid: %s' % run_id
+    (success, output) = check_run(exp_dir, model)
 
-        # Wait for termination.
-        wait(run_id)
+    return (success, output, run_id)
+
+def check_run(exp_dir, model):
+    """
+    Check that a run completed properly. Returns whether it did and the
+    output file to look at.
+    """
 
     # Read the output file and check that run suceeded.
     ocn_dir = '%s/OCN_RUNDIR' % (exp_dir)
@@ -439,25 +491,163 @@ def run(exp_name, model, exp_dir, config, run_direct):
     else:
         success = (('End of MATM' in s) and ('End of CICE' in s) and ('MOM4: --- completed ---' in s))
 
-    return (success, output, run_id)
+    return (success, output)
+
+def run_submits(exp_name, model, exp_dir, config, job_scheduler, init_date, runtime_months, submits, new_run,
+                skip_run=False, monitor=None):
+    """
+    Do 'submits' runs of an experiment one after the other, archiving each
+    and setting up the next. The experiment should already be prepared.
 
-def archive(exp_dir, model, run_name):
+    Returns 0 on success.
+    """
+
+    start_date = None
+    end_date = None
+    for num_submits in range(submits): 
+
+        start_date, end_date = set_next_startdate(exp_dir, init_date, start_date, runtime_months, num_submits + 1, new_run, model)
+        new_run = False
+
+        if not skip_run:
+            submit_time = time.time()
+            (ret, err, run_id) = run(exp_name, model, exp_dir, config, job_scheduler, monitor)
+            if not ret:
+                print 'Run failed, see %s' % err
+                return 1
+
+            telemetry.record(telemetry.default_db(), exp_name, model, exp_dir, config, run_id, start_date, end_date,
+                             ndays_between_dates(start_date, end_date, model == 'access'), time.time() - submit_time)
+            
+        archive_dir = archive(exp_dir, model, '%s_to_%s' % (start_date, end_date))
+        prepare_contrun(exp_dir, model, end_date, archive_dir)
+
+    return 0
+
+def read_chain_state(exp_dir):
+
+    with open(os.path.join(exp_dir, 'chain_state.yaml')) as f:
+        return yaml.safe_load(f)
+
+def write_chain_state(exp_dir, state):
+
+    filename = os.path.join(exp_dir, 'chain_state.yaml')
+    with open(filename + '.tmp', 'w') as f:
+        yaml.safe_dump(state, f, default_flow_style=False)
+    os.rename(filename + '.tmp', filename)
+
+def chain(exp_name, model, exp_dir, config, job_scheduler, init_date, runtime_months, segments, new_run):
+    """
+    Submit all the segments of a run at once, each depending on the one
+    before. This way the next segment waits in the queue while the current
+    one runs, rather than after it.
+
+    Each job runs post_segment() when the model finishes. This archives the
+    segment and sets up the next one, keeping track of where the chain is
+    up to in exp_dir/chain_state.yaml.
+    """
+
+    start_date, end_date = set_next_startdate(exp_dir, init_date, None, runtime_months, 1, new_run, model)
+
+    state = {'model' : model,
+             'init_date' : date_to_str(init_date),
+             'runtime_months' : runtime_months,
+             'segments' : segments,
+             'segment' : 1,
+             'start_date' : date_to_str(start_date),
+             'end_date' : date_to_str(end_date)}
+    write_chain_state(exp_dir, state)
+
+    sentinel = os.path.join(exp_dir, 'run_complete')
+    qsub_script = make_run_script(exp_name, model, exp_dir, config, sentinel, post_segment=True)
+
+    run_ids = []
+    for i in range(segments):
+        depends_on = run_ids[-1] if run_ids else None
+        run_ids.append(job_scheduler.submit(qsub_script, depends_on))
+        print 'Segment %s submitted, runid: %s' % (i + 1, run_ids[-1])
+
+    # All segments use the same script so the sentinel can't tell them
+    # apart, wait on the scheduler instead.
+    monitor = scheduler.JobMonitor(job_scheduler)
+    for i, run_id in enumerate(run_ids):
+        monitor.wait(run_id)
+        print 'Segment %s finished, runid: %s' % (i + 1, run_id)
+    monitor.stop()
+
+    state = read_chain_state(exp_dir)
+    if state['segment'] <= segments:
+        print 'Chain stopped at segment %s, see %s' % (state['segment'], os.path.join(exp_dir, 'OCN_RUNDIR', 'stdout.txt'))
+        return 1
+
+    return 0
+
+def post_segment(exp_dir):
+    """
+    Run by a chained job after the model: check the run, archive it and
+    get ready for the next segment.
+    """
+
+    state = read_chain_state(exp_dir)
+    model = state['model']
+
+    (ret, err) = check_run(exp_dir, model)
+    if not ret:
+        print 'Run failed, see %s' % err
+        return 1
+
+    init_date = str_to_date(state['init_date'])
+    start_date = str_to_date(state['start_date'])
+    end_date = str_to_date(state['end_date'])
+
+    with open(os.path.join(exp_dir, 'run_config.yaml')) as f:
+        config = yaml.safe_load(f)
+    # The job id isn't known here. The model timers give the run time.
+    telemetry.record(telemetry.default_db(), os.path.basename(exp_dir), model, exp_dir, config, None,
+                     start_date, end_date, ndays_between_dates(start_date, end_date, model == 'access'))
+
+    # The job ends when this returns, taking anything left running with it,
+    # so don't post-process in the background.
+    archive_dir = archive(exp_dir, model, '%s_to_%s' % (start_date, end_date), background=False)
+    prepare_contrun(exp_dir, model, end_date, archive_dir)
+
+    state['segment'] += 1
+    if state['segment'] <= state['segments']:
+        start_date, end_date = set_next_startdate(exp_dir, init_date, start_date, state['runtime_months'],
+                                                  state['segment'], False, model)
+        state['start_date'] = date_to_str(start_date)
+        state['end_date'] = date_to_str(end_date)
+    write_chain_state(exp_dir, state)
+
+    return 0
+
+def archive(exp_dir, model, run_name, background=True):
     """
     Do some data processing.
 
     This is a hack, need to move to payu tool.
+
+    Ocean and ice output is moved into the archive, then combined, compressed
+    and checksummed, see archiving.py. If 'background' is True the
+    post-processing is left running, clean_up() waits for it.
+
+    Returns the archive directory.
     """
 
     archive_dir = os.path.join(exp_dir, 'archive', run_name)
     os.makedirs(archive_dir)
 
-    # Move ocean netcdf files into archive. 
-    src = os.path.join(exp_dir, 'OCN_RUNDIR')
-    dest = os.path.join(archive_dir, 'OCN_RUNDIR')
+    # Only what is collected here is post-processed. The inputs replaced by
+    # the next run are also moved into this archive, maybe while the
+    # post-processing is going on.
+    files = archiving.collect(exp_dir, archive_dir)
+
+    if background:
+        archive_procs.append(archiving.start(archive_dir, files))
+    else:
+        archiving.postprocess(archive_dir, files)
 
-    os.makedirs(dest)
-    for f in glob.glob('%s/ocean*' % src):
-        shutil.move(f, os.path.join(dest, os.path.basename(f)))
+    return archive_dir
 
 
 def main():
@@ -470,12 +660,26 @@ def main():
     parser.add_argument("--new_run", action='store_true', default=False, help="Set this option to indicate a new run.")
     parser.add_argument("--init_date", default='00010101', type=str, help="The initial date of the entire run, this is a string of form yyyymmdd.")
     parser.add_argument("--input_dir", default='/short/v45/auscom', type=str, help="Where input data is kept for each experiment.")
-    parser.add_argument("--run_direct", action='store_true', default=False, help="Run the model directly, don't use qsub.")
+    parser.add_argument("--run_direct", action='store_true', default=False, help="Run the model directly, don't use qsub. Same as --scheduler direct.")
+    parser.add_argument("--scheduler", default='pbs', choices=['pbs', 'direct', 'local'], help="How to run the model, 'pbs' submits to PBS, 'direct' runs it straight away and 'local' runs it in the background on this machine. Defaults to 'pbs'.")
     parser.add_argument("--skip_run", action='store_true', help="Don't actually run the model, just prepare, archive and resubmit. Used for testing purposes.")
     parser.add_argument("--model", default='auscom', help="Which model to run. Should be either 'auscom' or 'access', defaults to 'auscom'")
+    parser.add_argument("--chain", action='store_true', default=False, help="Submit all the submits at once, each depending on the one before, see chain().")
+    parser.add_argument("--post_segment", action='store_true', default=False, help="Used by chained jobs to archive a segment and prepare the next one.")
 
     args = parser.parse_args()
 
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    exp_dir = os.path.abspath(os.path.join(script_path, '../exp/', args.experiment))
+
+    if args.post_segment:
+        return post_segment(exp_dir)
+
+    if args.chain and (args.model != 'auscom' or args.skip_run):
+        sys.stderr.write('Arg --chain only supported for the auscom model and not with --skip_run.\n')
+        parser.print_help()
+        return 1
+
     if (args.submit_runtime_days != 0):
         sys.stderr.write('Arg --submit_runtime_days not supported\n')
         parser.print_help()
@@ -488,8 +692,6 @@ def main():
 
     # Strange, datetime.date doesn't have strptime()
     init_date = str_to_date(args.init_date)
-    script_path = os.path.dirname(os.path.realpath(__file__))
-    exp_dir = os.path.abspath(os.path.join(script_path, '../exp/', args.experiment))
     input_dir = os.path.abspath(os.path.join(args.input_dir, args.experiment))
 
     # Read the config file. 
@@ -503,27 +705,22 @@ def main():
     else:
         prepare_contrun(exp_dir, args.model, init_date)
 
-    # FIXME: check that an archive directory for this date does not already exist. 
+    if args.run_direct:
+        args.scheduler = 'direct'
+    job_scheduler = scheduler.make_scheduler(args.scheduler)
 
-    start_date = None
-    end_date = None
-    for num_submits in range(args.submits): 
+    if args.chain:
+        return chain(args.experiment, args.model, exp_dir, config, job_scheduler, init_date,
+                     args.submit_runtime_months, args.submits, args.new_run)
 
-        start_date, end_date = set_next_startdate(exp_dir, init_date, start_date, args.submit_runtime_months, num_submits + 1, args.new_run, args.model)
-        args.new_run = False
+    # FIXME: check that an archive directory for this date does not already exist. 
 
-        if not args.skip_run:
-            (ret, err, run_id) = run(args.experiment, args.model, exp_dir, config, args.run_direct)
-            if not ret:
-                print 'Run failed, see %s' % err
-                return 1
-            
-        archive(exp_dir, args.model, '%s_to_%s' % (start_date, end_date))
-        prepare_contrun(exp_dir, args.model, end_date)
+    ret = run_submits(args.experiment, args.model, exp_dir, config, job_scheduler, init_date,
+                      args.submit_runtime_months, args.submits, args.new_run, args.skip_run)
 
     clean_up()
 
-    return 0
+    return ret
         
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,299 @@
+import os
+import sys
+import time
+import threading
+import itertools
+import subprocess
+
+"""
+Job scheduler backends and a monitor that waits for many jobs at once.
+
+Each backend submits a run script and reports whether jobs have finished.
+The monitor checks for a completion sentinel file, which the run script
+touches when it is done, and falls back to asking the scheduler with an
+exponential backoff. This catches jobs that never get to the end of the
+script, e.g. those killed for going over walltime.
+"""
+
+class Scheduler(object):
+    """
+    Interface for scheduler backends.
+    """
+
+    def submit(self, script, depends_on=None):
+        """
+        Submit 'script' and return a job id. If 'depends_on' is a job id the
+        new job only starts once that one has finished successfully, if it
+        fails the new job never runs and is reported as finished.
+        """
+        raise NotImplementedError
+
+    def finished(self, job_ids):
+        """
+        Return the subset of 'job_ids' that have finished.
+        """
+        raise NotImplementedError
+
+
+class PBSScheduler(Scheduler):
+    """
+    Submit with qsub and query with qstat.
+    """
+
+    def submit(self, script, depends_on=None):
+
+        cmd = ['qsub']
+        if depends_on is not None:
+            cmd += ['-W', 'depend=afterok:%s' % depends_on]
+        return subprocess.check_output(cmd + [script]).strip()
+
+    def finished(self, job_ids):
+
+        # One qstat for all the jobs.
+        try:
+            out = subprocess.check_output(['qstat'] + list(job_ids), stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as err:
+            out = err.output
+
+        return parse_qstat(out, job_ids)
+
+
+def parse_qstat(output, job_ids):
+    """
+    The subset of 'job_ids' that qstat 'output' says have finished, e.g.
+
+        qstat: 123.r-man2 Job has finished, use -x or -H to obtain historical job information
+        qstat: Unknown Job Id 124.r-man2
+
+    Ids are matched whole, so 23.r-man2 is not taken to be 123.r-man2.
+    """
+
+    done = set()
+    for line in output.splitlines():
+        if 'Job has finished' in line or 'Unknown Job Id' in line:
+            words = [w.strip(',:;') for w in line.split()]
+            done.update([j for j in job_ids if j in words])
+
+    return done
+
+
+class DirectScheduler(Scheduler):
+    """
+    Run the script straight away in the foreground, the job has finished
+    when submit() returns.
+    """
+
+    def __init__(self):
+        self.returncodes = {}
+        # Unique even when several threads submit at once.
+        self.ids = itertools.count(1)
+
+    def submit(self, script, depends_on=None):
+
+        job_id = 'direct.%s' % next(self.ids)
+        if depends_on is not None and self.returncodes[depends_on] != 0:
+            self.returncodes[job_id] = self.returncodes[depends_on]
+        else:
+            self.returncodes[job_id] = subprocess.call([script], shell=True)
+        return job_id
+
+    def finished(self, job_ids):
+        return set(job_ids)
+
+
+class LocalJob(object):
+    """
+    A script run in the background by a thread, after another LocalJob if
+    'after' is given.
+    """
+
+    def __init__(self, script, after=None):
+
+        self.returncode = None
+        self.done = threading.Event()
+
+        thread = threading.Thread(target=self.run, args=(script, after))
+        thread.daemon = True
+        thread.start()
+
+    def run(self, script, after):
+
+        if after is not None:
+            after.done.wait()
+            if after.returncode != 0:
+                # Same as afterok, the job is dropped.
+                self.returncode = after.returncode
+                self.done.set()
+                return
+
+        self.returncode = subprocess.call([script], shell=True)
+        self.done.set()
+
+
+class LocalScheduler(Scheduler):
+    """
+    Run the script in the background on this machine. A stand-in for a
+    batch scheduler, e.g. for testing.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.ids = itertools.count(1)
+
+    def submit(self, script, depends_on=None):
+
+        after = None
+        if depends_on is not None:
+            after = self.jobs[depends_on]
+
+        job_id = 'local.%s' % next(self.ids)
+        self.jobs[job_id] = LocalJob(script, after)
+        return job_id
+
+    def finished(self, job_ids):
+        return set([j for j in job_ids if self.jobs[j].done.is_set()])
+
+
+def make_scheduler(name):
+    """
+    Create a scheduler backend by name, one of 'pbs', 'direct' or 'local'.
+    """
+
+    schedulers = {'pbs' : PBSScheduler, 'direct' : DirectScheduler, 'local' : LocalScheduler}
+    return schedulers[name]()
+
+
+class JobMonitor(object):
+    """
+    Wait for many jobs in one background thread.
+
+    Sentinel files are checked every 'sentinel_interval' seconds, this is
+    cheap. The scheduler is asked about all the outstanding jobs at once,
+    straight away and then at intervals starting at 'min_interval' seconds
+    and doubling each time up to 'max_interval'.
+
+    If asking the scheduler fails, e.g. qstat can't be run, the monitor
+    stops and every wait(), now or later, raises the error.
+    """
+
+    def __init__(self, scheduler, sentinel_interval=1, min_interval=10, max_interval=300):
+
+        self.scheduler = scheduler
+        self.sentinel_interval = sentinel_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.jobs = {}
+        self.done = {}
+        self.stopped = False
+        self.thread = None
+        # sys.exc_info() of a failed scheduler query.
+        self.error = None
+
+    def add(self, job_id, sentinel=None):
+        """
+        Start watching 'job_id'. If 'sentinel' is given the job is taken to
+        have finished once that file exists. Returns an Event which is set
+        when the job finishes.
+        """
+
+        event = threading.Event()
+        with self.lock:
+            self.done[job_id] = event
+            if self.error is not None:
+                # Nothing is watching any more, see monitor().
+                event.set()
+                return event
+
+            self.jobs[job_id] = {'sentinel' : sentinel, 'event' : event,
+                                 'interval' : self.min_interval,
+                                 'next_check' : time.time()}
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.monitor)
+                self.thread.daemon = True
+                self.thread.start()
+            self.wakeup.notify()
+
+        return event
+
+    def wait(self, job_id, sentinel=None):
+        """
+        Wait for a single job to finish. Raises the error if the scheduler
+        couldn't be asked about it.
+        """
+
+        if job_id not in self.done:
+            self.add(job_id, sentinel)
+
+        # wait() with a timeout so that KeyboardInterrupt still works.
+        while not self.done[job_id].wait(self.sentinel_interval):
+            pass
+
+        if self.error is not None:
+            exc_type, exc_value, exc_tb = self.error
+            raise exc_type, exc_value, exc_tb
+
+    def stop(self):
+
+        with self.lock:
+            self.stopped = True
+            self.wakeup.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def finish(self, job_id):
+        """
+        Must be called with the lock held.
+        """
+
+        job = self.jobs.pop(job_id)
+        job['event'].set()
+
+    def monitor(self):
+
+        with self.lock:
+            while not self.stopped:
+                now = time.time()
+
+                for job_id, job in self.jobs.items():
+                    if job['sentinel'] is not None and os.path.exists(job['sentinel']):
+                        self.finish(job_id)
+
+                due = [j for j, job in self.jobs.items() if job['next_check'] <= now]
+                if due:
+                    # Don't hold the lock while the scheduler is queried.
+                    self.lock.release()
+                    error = None
+                    try:
+                        finished = self.scheduler.finished(due)
+                    except Exception:
+                        error = sys.exc_info()
+                    finally:
+                        self.lock.acquire()
+
+                    if error is not None:
+                        # Wake up everyone waiting so that they see the error.
+                        self.error = error
+                        for job_id in self.jobs.keys():
+                            self.finish(job_id)
+                        return
+
+                    for job_id in due:
+                        if job_id not in self.jobs:
+                            continue
+                        if job_id in finished:
+                            self.finish(job_id)
+                        else:
+                            job = self.jobs[job_id]
+                            job['next_check'] = time.time() + job['interval']
+                            job['interval'] = min(job['interval']*2, self.max_interval)
+
+                if self.jobs:
+                    timeout = min([job['next_check'] for job in self.jobs.values()]) - time.time()
+                    timeout = max(0, min(timeout, self.sentinel_interval))
+                else:
+                    timeout = None
+                self.wakeup.wait(timeout)
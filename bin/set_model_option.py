@@ -2,8 +2,9 @@
 
 import argparse
 import sys
+import os
 import re
-from fnamelist import FortranNamelist, Namcouple
+from editsession import EditSession
 from datetime import datetime, timedelta
 
 """
@@ -12,86 +13,80 @@ Modify atmosphere, ice, ocean and coupler namelists files to set a configuration
 Relies on the the experiments directory being at ../exp
 """
 
-input_atm = "../exp/%s/config/input_atm.nml"
-namcouple = ["../exp/%s/config/namcouple"]
-input_ice = "../exp/%s/config/input_ice.nml"
-cice_in = "../exp/%s/config/cice_in.nml"
-input_ocn = "../exp/%s/config/input.nml"
+exp_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../exp')
 
+input_atm = os.path.join(exp_dir, "%s/config/input_atm.nml")
+namcouple = [os.path.join(exp_dir, "%s/config/namcouple")]
+input_ice = os.path.join(exp_dir, "%s/config/input_ice.nml")
+cice_in = os.path.join(exp_dir, "%s/config/cice_in.nml")
+input_ocn = os.path.join(exp_dir, "%s/config/input.nml")
 
-def set_runtime(experiment, runtime):
+
+def set_runtime(session, experiment, runtime):
 
     # Change runtime in the namcouple files.
     for n in namcouple:
-        nc = Namcouple(n % (experiment))
+        nc = session.namcouple(n % (experiment))
         nc.set_runtime(runtime)
-        nc.write()
 
-    nml = FortranNamelist(input_atm % (experiment))
+    nml = session.namelist(input_atm % (experiment))
     nml.set_value('coupling', 'runtime', runtime)
-    nml.write()
 
-    nml = FortranNamelist(input_ice % (experiment))
+    nml = session.namelist(input_ice % (experiment))
     nml.set_value('coupling_nml', 'runtime', runtime)
-    nml.write()
 
     sec = timedelta(seconds=int(runtime))
     d = datetime(1, 1, 1) + sec
 
-    nml = FortranNamelist(input_ocn % (experiment))
+    nml = session.namelist(input_ocn % (experiment))
     nml.set_value('ocean_solo_nml', 'years', d.year - 1)
     nml.set_value('ocean_solo_nml', 'months', d.month - 1)
     nml.set_value('ocean_solo_nml', 'days', d.day - 1)
     nml.set_value('ocean_solo_nml', 'hours', d.hour)
     nml.set_value('ocean_solo_nml', 'minutes', d.minute)
     nml.set_value('ocean_solo_nml', 'seconds', d.second)
-    nml.write()
 
-def set_ocean_timestep(experiment, timestep):
+def set_ocean_timestep(session, experiment, timestep):
 
-    nml = FortranNamelist(input_ocn % (experiment))
+    nml = session.namelist(input_ocn % (experiment))
     nml.set_value('ocean_model_nml', 'dt_ocean', timestep)
-    nml.write()
 
-def set_ice_timestep(experiment, timestep):
+def set_ice_timestep(session, experiment, timestep):
 
-    nml = FortranNamelist(input_ice % (experiment))
+    nml = session.namelist(input_ice % (experiment))
     nml.set_value('coupling_nml', 'dt_cice', timestep)
-    nml.write()
 
-    nml = FortranNamelist(cice_in % (experiment))
+    nml = session.namelist(cice_in % (experiment))
 
     # Read in the current timestep and runtime, needed to calculate new runtime (in units of timestep). 
-    (dt, _, _) = nml.get_value('setup_nml', 'dt')
-    (npt, _, _) =  nml.get_value('setup_nml', 'npt')
+    dt = nml.get_value('setup_nml', 'dt')
+    npt = nml.get_value('setup_nml', 'npt')
     runtime = int(dt)*int(npt)
+    if runtime % int(timestep) != 0:
+        raise ValueError('Ice timestep %s does not divide the ice run time of %s seconds (dt = %s, npt = %s)' %
+                         (timestep, runtime, dt, npt))
     new_npt = runtime // int(timestep)
 
     nml.set_value('setup_nml', 'dt', timestep)
     nml.set_value('setup_nml', 'npt', new_npt)
-    nml.write()
 
-def set_coupling_timestep(experiment, timestep, model):
+def set_coupling_timestep(session, experiment, timestep, model):
 
     # Change timestep in the namcouple files.
     for n in namcouple:
-        nc = Namcouple(n % (experiment), model)
+        nc = session.namcouple(n % (experiment), model)
         nc.set_ocean_timestep(timestep)
-        nc.write()
 
     if model == 'auscom': 
-        nml = FortranNamelist(input_atm % (experiment))
+        nml = session.namelist(input_atm % (experiment))
         nml.set_value('coupling', 'dt_atm', timestep)
-        nml.write()
 
-    nml = FortranNamelist(input_ocn % (experiment))
+    nml = session.namelist(input_ocn % (experiment))
     nml.set_value('auscom_ice_nml', 'dt_cpl', timestep)
     nml.set_value('ocean_solo_nml', 'dt_cpld', timestep)
-    nml.write()
 
-    nml = FortranNamelist(input_ice % (experiment))
+    nml = session.namelist(input_ice % (experiment))
     nml.set_value('coupling_nml', 'dt_cpl_io', timestep)
-    nml.write()
 
 def main():
 
@@ -105,14 +100,23 @@ def main():
 
     args = parser.parse_args()
 
-    if args.runtime:
-        set_runtime(args.experiment, args.runtime)
-    if args.ocean_timestep:
-        set_ocean_timestep(args.experiment, args.ocean_timestep)
-    if args.ice_timestep:
-        set_ice_timestep(args.experiment, args.ice_timestep)
-    if args.coupling_timestep:
-        set_coupling_timestep(args.experiment, args.coupling_timestep, args.model)
+    # All the changes are written out together, or not at all.
+    session = EditSession()
+
+    try:
+        if args.runtime:
+            set_runtime(session, args.experiment, args.runtime)
+        if args.ocean_timestep:
+            set_ocean_timestep(session, args.experiment, args.ocean_timestep)
+        if args.ice_timestep:
+            set_ice_timestep(session, args.experiment, args.ice_timestep)
+        if args.coupling_timestep:
+            set_coupling_timestep(session, args.experiment, args.coupling_timestep, args.model)
+
+        session.commit()
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        return 1
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,217 @@
+import os
+import errno
+import shutil
+import json
+import multiprocessing.pool
+
+"""
+Stage input files into the model run directories.
+
+Read-only inputs are hard linked, or symlinked when they are on a different
+file system, rather than copied. Files that the models write to are copied,
+several at a time. A manifest is kept in each directory so that files which
+haven't changed since they were last staged are skipped.
+"""
+
+# The models write to these in place so they must be copied, not linked.
+WRITABLE_FILES = ['a2i.nc', 'i2a.nc', 'i2o.nc', 'o2i.nc', 'u_star.nc', 'sicemass.nc', 'mice.nc']
+
+MANIFEST = '.staging_manifest.json'
+
+def is_writable(filename):
+    """
+    Whether a file needs to be copied rather than linked.
+    """
+
+    return os.path.basename(filename) in WRITABLE_FILES
+
+def file_stamp(filename):
+    """
+    Size and modification time of a file, used to tell whether it has changed.
+    """
+
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime]
+
+def read_manifest(dest_dir):
+
+    filename = os.path.join(dest_dir, MANIFEST)
+    if not os.path.exists(filename):
+        return {}
+
+    with open(filename) as f:
+        return json.load(f)
+
+def write_manifest(dest_dir, manifest):
+
+    filename = os.path.join(dest_dir, MANIFEST)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(filename + '.tmp', filename)
+
+def is_current(src, dest, entry):
+    """
+    Whether 'dest' is still what was staged from 'src', as recorded in the
+    manifest 'entry'.
+    """
+
+    if entry is None or not os.path.lexists(dest):
+        return False
+    if entry['src'] != src or entry['src_stamp'] != file_stamp(src):
+        return False
+
+    if entry['method'] == 'hardlink':
+        return os.path.samefile(src, dest)
+    elif entry['method'] == 'symlink':
+        return os.path.islink(dest) and os.readlink(dest) == src
+    else:
+        # Copies may have been written to by the model.
+        return entry['dest_stamp'] == file_stamp(dest)
+
+def remove(path):
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def link(src, dest):
+    """
+    Hard link 'src' to 'dest', falling back to a symlink if that's not
+    possible. Returns the method used.
+    """
+
+    try:
+        os.link(src, dest)
+        return 'hardlink'
+    except OSError as e:
+        if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+            raise
+    os.symlink(src, dest)
+    return 'symlink'
+
+def copy(src, dest):
+
+    shutil.copy(src, dest)
+    os.chmod(dest, 0664)
+    return 'copy'
+
+def clean_dir(directory, keep):
+    """
+    Remove everything from 'directory' except the names in 'keep' and the
+    staging manifest.
+    """
+
+    if not os.path.exists(directory):
+        return
+
+    for name in os.listdir(directory):
+        if name not in keep and name != MANIFEST:
+            remove(os.path.join(directory, name))
+
+def stage(files, threads=8):
+    """
+    Put files in place. 'files' is a list of (src, dest_dir, writable)
+    tuples, writable files are copied and the others are linked. Files
+    that are unchanged since the last time they were staged are skipped.
+
+    Returns a dictionary with the number of files linked, copied and
+    skipped.
+    """
+
+    counts = {'linked' : 0, 'copied' : 0, 'skipped' : 0}
+
+    manifests = {}
+    copies = []
+    for src, dest_dir, writable in files:
+        name = os.path.basename(src)
+        src = os.path.realpath(src)
+        dest = os.path.join(dest_dir, name)
+
+        if dest_dir not in manifests:
+            manifests[dest_dir] = read_manifest(dest_dir)
+        manifest = manifests[dest_dir]
+
+        entry = manifest.get(name)
+        if is_current(src, dest, entry) and (entry['method'] == 'copy') == writable:
+            counts['skipped'] += 1
+            continue
+
+        remove(dest)
+        if writable:
+            copies.append((src, dest_dir, dest))
+        else:
+            manifest[name] = {'src' : src, 'src_stamp' : file_stamp(src), 'method' : link(src, dest)}
+            counts['linked'] += 1
+
+    # Copying is mostly waiting on the file system, so do several at once.
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+        methods = pool.map(lambda c: copy(c[0], c[2]), copies)
+    finally:
+        pool.close()
+        pool.join()
+
+    for (src, dest_dir, dest), method in zip(copies, methods):
+        manifests[dest_dir][os.path.basename(dest)] = {'src' : src, 'src_stamp' : file_stamp(src),
+                                                       'dest_stamp' : file_stamp(dest), 'method' : method}
+        counts['copied'] += 1
+
+    for dest_dir, manifest in manifests.items():
+        # Forget about anything that is no longer there.
+        for name in manifest.keys():
+            if not os.path.lexists(os.path.join(dest_dir, name)):
+                del manifest[name]
+        write_manifest(dest_dir, manifest)
+
+    return counts
+
+def move(src, dest):
+    """
+    Rename 'src' to 'dest', this is a copy only if they are on different
+    file systems.
+    """
+
+    try:
+        os.rename(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dest)
+
+def promote(src_dir, dest_dir, archive_dir, names=None):
+    """
+    Move files from 'src_dir' into 'dest_dir', e.g. restarts into INPUT
+    for the next run. Files in 'dest_dir' that are replaced are moved to
+    'archive_dir'. 'names' are the files to move, defaults to everything
+    in 'src_dir'. A name that is missing from 'src_dir' but already in
+    'dest_dir' has been promoted before and is skipped, so this can be
+    called again for the same restarts.
+
+    Returns the names of the files moved.
+    """
+
+    if names is None:
+        names = sorted(os.listdir(src_dir))
+
+    moved = []
+    manifest = read_manifest(dest_dir)
+    for name in names:
+        dest = os.path.join(dest_dir, name)
+        if not os.path.lexists(os.path.join(src_dir, name)) and os.path.lexists(dest):
+            continue
+
+        if os.path.lexists(dest):
+            if not os.path.exists(archive_dir):
+                os.makedirs(archive_dir)
+            move(dest, os.path.join(archive_dir, name))
+        move(os.path.join(src_dir, name), dest)
+
+        # This is no longer a staged input.
+        manifest.pop(name, None)
+        moved.append(name)
+
+    if os.path.exists(os.path.join(dest_dir, MANIFEST)):
+        write_manifest(dest_dir, manifest)
+
+    return moved
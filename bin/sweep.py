@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import shutil
+import itertools
+import argparse
+import multiprocessing
+import yaml
+
+import staging
+import telemetry
+import set_model_option
+from editsession import EditSession
+
+"""
+Make a set of experiments for a parameter sweep.
+
+A variant of a base experiment is made for every combination of parameter
+values, e.g.
+
+    sweep.py cnyf2.mom5-0.25 --param dt_ocean=900,1800 --param dt_cpl=900,1800 \
+             --param cice_in.nml:ice_nml:ndte=120,240
+
+makes 8 experiments under exp/. Parameters are either one of the options
+of set_model_option.py (runtime, dt_ocean, dt_ice, dt_cpl) or a namelist
+value in the experiment config directory, given as file:group:variable.
+
+Variants are made several at a time in a process pool. Small files are
+copied, larger ones, such as model executables, are hard linked. The
+changes are made to the configuration in memory and written out in one go,
+see editsession.py. Each variant has a manifest, sweep_manifest.yaml,
+recording the base experiment, the parameters and every line that differs
+from the base.
+"""
+
+# Files at least this size are linked rather than copied.
+LINK_MIN_BYTES = 2**20
+
+# Not part of an experiment's definition, these are made by running it.
+SKIP = ['ATM_RUNDIR', 'ICE_RUNDIR', 'OCN_RUNDIR', 'archive', 'chain_state.yaml',
+        'run_complete', 'qsub_run.sh', staging.MANIFEST, telemetry.RUN_TIMES]
+
+MANIFEST = 'sweep_manifest.yaml'
+
+OPTIONS = {'runtime' : set_model_option.set_runtime,
+           'dt_ocean' : set_model_option.set_ocean_timestep,
+           'dt_ice' : set_model_option.set_ice_timestep,
+           'dt_cpl' : set_model_option.set_coupling_timestep}
+
+def parse_param(arg):
+    """
+    Split 'name=v1,v2,...' into the name and list of values.
+    """
+
+    name, values = arg.split('=', 1)
+    if name not in OPTIONS:
+        assert len(name.split(':')) == 3, 'Unknown parameter %s' % name
+    return (name, values.split(','))
+
+def variant_name(base, params):
+    """
+    The experiment name of a variant, e.g. base.dt_ocean-900.ndte-120
+    """
+
+    parts = [base]
+    for name, value in params:
+        parts.append('%s-%s' % (name.split(':')[-1], value))
+    return '.'.join(parts)
+
+def copy_experiment(src, dest):
+    """
+    Copy the experiment definition in 'src' to 'dest', linking large files.
+    """
+
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [d for d in dirs if d not in SKIP]
+        dest_root = os.path.join(dest, os.path.relpath(root, src))
+        os.makedirs(dest_root)
+
+        for f in files:
+            if f in SKIP or f == MANIFEST:
+                continue
+            path = os.path.join(root, f)
+            if os.path.getsize(path) >= LINK_MIN_BYTES and not os.path.islink(path):
+                staging.link(path, os.path.join(dest_root, f))
+            else:
+                shutil.copy2(path, os.path.join(dest_root, f))
+
+def make_variant(args):
+    """
+    Make one variant. Run in a process pool, returns the name and None or an
+    error message.
+    """
+
+    (base, name, params, model) = args
+
+    exp_dir = set_model_option.exp_dir
+    dest = os.path.join(exp_dir, name)
+    if os.path.exists(dest):
+        return (name, 'already exists')
+
+    try:
+        copy_experiment(os.path.join(exp_dir, base), dest)
+
+        session = EditSession()
+        for param, value in params:
+            if param == 'dt_cpl':
+                OPTIONS[param](session, name, value, model)
+            elif param in OPTIONS:
+                OPTIONS[param](session, name, value)
+            else:
+                filename, group, variable = param.split(':')
+                nml = session.namelist(os.path.join(dest, 'config', filename))
+                nml.set_value(group, variable, value)
+
+        changes = session.changes()
+        session.commit()
+    except Exception as e:
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        return (name, str(e))
+
+    manifest = {'base' : base,
+                'parameters' : dict(params),
+                'changes' : dict([(os.path.relpath(path, dest),
+                                   [{'line' : l, 'old' : o, 'new' : n} for l, o, n in lines])
+                                  for path, lines in changes.items()])}
+    with open(os.path.join(dest, MANIFEST), 'w') as f:
+        yaml.safe_dump(manifest, f, default_flow_style=False)
+
+    return (name, None)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("experiment", help="The base experiment.")
+    parser.add_argument("--param", action='append', default=[], help="A parameter and its values, name=v1,v2,... where name is one of %s or file:group:variable for a namelist in the experiment's config directory. Give once for each parameter." % ', '.join(sorted(OPTIONS.keys())))
+    parser.add_argument("--model", default="auscom", help="The model being used, either access or auscom.")
+    parser.add_argument("--processes", default=multiprocessing.cpu_count(), type=int, help="The number of variants to make at once, defaults to the number of CPUs.")
+    parser.add_argument("--dry_run", action='store_true', default=False, help="Just list the variants that would be made.")
+
+    args = parser.parse_args()
+
+    if not args.param:
+        sys.stderr.write('No --param given.\n')
+        parser.print_help()
+        return 1
+
+    params = [parse_param(p) for p in args.param]
+    names = [n for n, _ in params]
+    variants = []
+    for values in itertools.product(*[v for _, v in params]):
+        combination = zip(names, values)
+        variants.append((args.experiment, variant_name(args.experiment, combination), combination, args.model))
+
+    if args.dry_run:
+        for v in variants:
+            print v[1]
+        return 0
+
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        results = pool.map(make_variant, variants)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = 0
+    for name, error in results:
+        if error is not None:
+            print 'Failed to make %s: %s' % (name, error)
+            failed += 1
+
+    print 'Made %s of %s variants of %s' % (len(results) - failed, len(results), args.experiment)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import re
+import argparse
+import sqlite3
+import time
+
+"""
+Keep a record of how fast runs go.
+
+After each run the wall time, simulated days, CPU layout and the component
+timers written by the models are stored in a SQLite database, by default
+exp/telemetry.db, shared by all experiments. The report shows simulated years
+per day (SYPD) and core-hours per simulated year (CHSY) for each run, over
+time, and averaged for each experiment and CPU layout:
+
+    telemetry.py [--experiment <name>] [--timers]
+"""
+
+SCHEMA = """
+create table if not exists runs (
+    id integer primary key,
+    experiment text,
+    model text,
+    run_id text,
+    start_date text,
+    end_date text,
+    recorded real,
+    elapsed real,
+    walltime real,
+    runtime real,
+    sim_days integer,
+    atm_ncpus integer,
+    ice_ncpus integer,
+    ocn_ncpus integer,
+    ncpus integer
+);
+create table if not exists timers (
+    run integer references runs(id),
+    component text,
+    name text,
+    seconds real
+);
+"""
+
+# MOM mpp clock summary lines, format (a32,4f14.6,f7.3,3i6).
+MOM_TIMER = re.compile(r'^(.{32})\s*([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+\d+\s+\d+\s+\d+\s*$')
+# CICE timer lines, format ('Timer ',i3,': ',a9,f11.2,' seconds').
+CICE_TIMER = re.compile(r'^Timer\s+\d+:\s*(.+?)\s+([\d.]+) seconds\s*$')
+
+# Written by the run script in the experiment directory, the time in seconds
+# before and after the model runs, see run.py.
+RUN_TIMES = 'run_times'
+
+def default_db():
+
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.abspath(os.path.join(script_path, '../exp/', 'telemetry.db'))
+
+def connect(db):
+
+    conn = sqlite3.connect(db)
+    conn.executescript(SCHEMA)
+
+    # Databases made before walltime was recorded.
+    columns = [c[1] for c in conn.execute('pragma table_info(runs)')]
+    if 'walltime' not in columns:
+        with conn:
+            conn.execute('alter table runs add column walltime real')
+
+    return conn
+
+def parse_timers(text):
+    """
+    Find the model timers in some output. Returns a list of (component,
+    name, seconds) tuples. For MOM this is the time on the slowest PE.
+    """
+
+    timers = []
+    for line in text.splitlines():
+        m = MOM_TIMER.match(line)
+        if m:
+            timers.append(('ocean', m.group(1).strip(), float(m.group(3))))
+            continue
+        m = CICE_TIMER.match(line)
+        if m:
+            timers.append(('ice', m.group(1).strip(), float(m.group(2))))
+
+    return timers
+
+def read_timers(exp_dir):
+    """
+    Timers from the output of the last run in 'exp_dir'.
+    """
+
+    timers = []
+    for f in [os.path.join(exp_dir, 'OCN_RUNDIR', 'stdout.txt'),
+              os.path.join(exp_dir, 'ICE_RUNDIR', 'ice_diag.d')]:
+        if os.path.exists(f):
+            with open(f) as fh:
+                timers.extend(parse_timers(fh.read()))
+
+    return timers
+
+def read_walltime(exp_dir):
+    """
+    How long the model ran for, from the times written by the run script.
+    None if they aren't both there.
+    """
+
+    filename = os.path.join(exp_dir, RUN_TIMES)
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename) as f:
+        times = f.read().split()
+    if len(times) != 2:
+        return None
+
+    return float(times[1]) - float(times[0])
+
+def model_runtime(timers):
+    """
+    The run time of the coupled model, taken from the MOM 'Total runtime'
+    clock, None if it wasn't found.
+    """
+
+    for component, name, seconds in timers:
+        if component == 'ocean' and name == 'Total runtime':
+            return seconds
+    return None
+
+def record(db, exp_name, model, exp_dir, config, run_id, start_date, end_date, sim_days, elapsed=None):
+    """
+    Store a run. 'elapsed' is the time in seconds from submission to
+    completion, if known, this includes time in the queue. 'config' is the
+    contents of run_config.yaml.
+    """
+
+    timers = read_timers(exp_dir)
+    layout = [int(config[m]['ncpus']) for m in ['atm', 'ice', 'ocean']]
+    ncpus = int(config.get('ncpus', sum(layout)))
+
+    conn = connect(db)
+    with conn:
+        cur = conn.execute('insert into runs (experiment, model, run_id, start_date, end_date, recorded, elapsed, \
+                            walltime, runtime, sim_days, atm_ncpus, ice_ncpus, ocn_ncpus, ncpus) \
+                            values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           [exp_name, model, run_id, str(start_date), str(end_date), time.time(), elapsed,
+                            read_walltime(exp_dir), model_runtime(timers), sim_days] + layout + [ncpus])
+        conn.executemany('insert into timers (run, component, name, seconds) values (?, ?, ?, ?)',
+                         [(cur.lastrowid, c, n, s) for c, n, s in timers])
+    conn.close()
+
+def throughput(seconds, sim_days, ncpus):
+    """
+    Returns simulated years per day and core-hours per simulated year.
+    """
+
+    sim_years = sim_days / 365.0
+    return (sim_years / (seconds / 86400.0), ncpus*seconds / 3600.0 / sim_years)
+
+def report(db, experiment=None, timers=False):
+    """
+    Throughput is worked out from the model's own run time, or failing that
+    the wall time of the model in the run script. Runs with neither are
+    shown as unknown, the time from submission includes queueing.
+    """
+
+    conn = connect(db)
+
+    query = 'select id, experiment, start_date, end_date, recorded, coalesce(runtime, walltime), sim_days, \
+             atm_ncpus, ice_ncpus, ocn_ncpus, ncpus from runs'
+    args = []
+    if experiment is not None:
+        query += ' where experiment = ?'
+        args.append(experiment)
+    rows = conn.execute(query + ' order by recorded', args).fetchall()
+
+    print '%-20s %-16s %-10s %-24s %10s %8s %10s' % ('experiment', 'recorded', 'segment', 'layout (atm/ice/ocn)',
+                                                     'wall (s)', 'SYPD', 'CHSY')
+    layouts = {}
+    for (run, exp, start, end, recorded, seconds, sim_days, atm, ice, ocn, ncpus) in rows:
+        layout = '%s/%s/%s = %s' % (atm, ice, ocn, ncpus)
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(recorded))
+        if not seconds or not sim_days:
+            print '%-20s %-16s %-10s %-24s %10s' % (exp, when, start, layout, 'unknown')
+            continue
+
+        sypd, chsy = throughput(seconds, sim_days, ncpus)
+        print '%-20s %-16s %-10s %-24s %10.1f %8.2f %10.1f' % (exp, when, start, layout, seconds, sypd, chsy)
+        layouts.setdefault((exp, layout), []).append((sypd, chsy))
+
+        if timers:
+            for component, name, s in conn.execute('select component, name, seconds from timers \
+                                                    where run = ? order by component, seconds desc', [run]):
+                print '    %-6s %-32s %10.1f' % (component, name, s)
+
+    print
+    print '%-20s %-24s %6s %8s %10s' % ('experiment', 'layout (atm/ice/ocn)', 'runs', 'SYPD', 'CHSY')
+    for (exp, layout), values in sorted(layouts.items()):
+        sypd = sum([v[0] for v in values]) / len(values)
+        chsy = sum([v[1] for v in values]) / len(values)
+        print '%-20s %-24s %6s %8.2f %10.1f' % (exp, layout, len(values), sypd, chsy)
+
+    conn.close()
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=default_db(), help="The telemetry database, defaults to exp/telemetry.db.")
+    parser.add_argument("--experiment", default=None, help="Only report on this experiment.")
+    parser.add_argument("--timers", action='store_true', default=False, help="Show the model timers for each run.")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.stderr.write('No telemetry database %s.\n' % args.db)
+        return 1
+
+    report(args.db, args.experiment, args.timers)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import argparse
+import fractions
+
+import set_model_option
+from editsession import EditSession
+
+"""
+Find the ocean, ice and coupling timesteps that fit together and apply them.
+
+For a set of timesteps to be valid:
+
+    - the ocean and ice timesteps divide the ice-ocean coupling timestep,
+    - the coupling timestep divides a day, so that runs of any number of
+      days work, the run length, and the period of every field exchanged
+      with the atmosphere in the namcouple.
+
+Every valid combination up to the largest timesteps known to be stable,
+by default the ones the experiment uses now, is listed with the largest
+first. The chosen one is applied to the experiment's config directory,
+including the namcouple coupling periods and lags and the run length if
+one was given, in one edit session, see set_model_option.py and
+editsession.py. It is checked before anything is changed.
+"""
+
+SECONDS_PER_DAY = 86400
+
+def divisors(n):
+
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+def atmosphere_periods(nc):
+    """
+    The coupling periods of the fields exchanged with the atmosphere.
+    """
+
+    return sorted(set([f.period for f in nc.fields
+                       if os.path.basename(f.restart) in ['a2i.nc', 'i2a.nc']]))
+
+def common_period(lengths):
+    """
+    The largest period that divides all the given lengths of time.
+    """
+
+    return reduce(fractions.gcd, lengths, SECONDS_PER_DAY)
+
+def solve(period, max_ocean, max_ice, max_coupling, min_timestep=1):
+    """
+    All the valid (ocean, ice, coupling) timesteps, largest first. Every
+    timestep divides the coupling timestep which divides 'period'.
+    """
+
+    choices = []
+    for cpl in divisors(period):
+        if cpl > max_coupling:
+            continue
+        for ocn in divisors(cpl):
+            if ocn < min_timestep or ocn > max_ocean:
+                continue
+            for ice in divisors(cpl):
+                if ice < min_timestep or ice > max_ice:
+                    continue
+                choices.append((ocn, ice, cpl))
+
+    # The smaller of the ocean and ice timesteps limits how fast the model goes.
+    choices.sort(key=lambda c: (min(c[0], c[1]), max(c[0], c[1]), c[2]), reverse=True)
+
+    return choices
+
+def current(session, experiment, model):
+    """
+    The timesteps the experiment uses now, the run length of the ice and
+    the periods of the atmosphere coupling fields.
+    """
+
+    ocn = session.namelist(set_model_option.input_ocn % experiment)
+    cice = session.namelist(set_model_option.cice_in % experiment)
+    dt_ice = int(cice.get_value('setup_nml', 'dt'))
+
+    periods = []
+    for n in set_model_option.namcouple:
+        periods.extend(atmosphere_periods(session.namcouple(n % experiment, model)))
+
+    return {'ocean' : int(ocn.get_value('ocean_model_nml', 'dt_ocean')),
+            'ice' : dt_ice,
+            'coupling' : int(ocn.get_value('auscom_ice_nml', 'dt_cpl')),
+            'ice_runtime' : dt_ice*int(cice.get_value('setup_nml', 'npt')),
+            'atmosphere_periods' : periods}
+
+def check(choice, period, ice_runtime):
+    """
+    Why the (ocean, ice, coupling) timesteps in 'choice' don't fit, an empty
+    list if they do. 'period' is what the coupling timestep must divide and
+    'ice_runtime' the run length of the ice, see main().
+    """
+
+    (ocn, ice, cpl) = choice
+    problems = []
+    if cpl % ocn != 0:
+        problems.append('ocean timestep %s does not divide the coupling timestep %s' % (ocn, cpl))
+    if cpl % ice != 0:
+        problems.append('ice timestep %s does not divide the coupling timestep %s' % (ice, cpl))
+    if period % cpl != 0:
+        problems.append('coupling timestep %s does not divide %s seconds' % (cpl, period))
+    if ice_runtime % ice != 0:
+        problems.append('ice timestep %s does not divide the ice run time of %s seconds' % (ice, ice_runtime))
+
+    return problems
+
+def apply(session, experiment, choice, model, period, ice_runtime, runtime=None):
+    """
+    Set the (ocean, ice, coupling) timesteps in 'choice', and the run length
+    if 'runtime' is given. Raises ValueError, before anything is changed, if
+    the timesteps don't fit, see check().
+    """
+
+    problems = check(choice, period, ice_runtime)
+    if problems:
+        raise ValueError('Not applying timesteps:\n    ' + '\n    '.join(problems))
+
+    (ocn, ice, cpl) = choice
+    if runtime is not None:
+        set_model_option.set_runtime(session, experiment, runtime)
+    set_model_option.set_ocean_timestep(session, experiment, ocn)
+    set_model_option.set_ice_timestep(session, experiment, ice)
+    set_model_option.set_coupling_timestep(session, experiment, cpl, model)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("experiment", help="The experiment to find timesteps for.")
+    parser.add_argument("--runtime", type=int, default=None, help="The run length in seconds, the coupling timestep must divide it. It is set along with the timesteps by --apply. Defaults to the ice run length, dt*npt in cice_in.nml, which is left as it is.")
+    parser.add_argument("--max_ocean_timestep", type=int, default=None, help="The largest stable ocean timestep, defaults to the current one.")
+    parser.add_argument("--max_ice_timestep", type=int, default=None, help="The largest stable ice timestep, defaults to the current one.")
+    parser.add_argument("--max_coupling_timestep", type=int, default=None, help="The largest ice-ocean coupling timestep, defaults to the current one.")
+    parser.add_argument("--min_timestep", type=int, default=60, help="Don't list timesteps smaller than this, defaults to 60.")
+    parser.add_argument("--show", type=int, default=10, help="The number of choices to list, defaults to 10.")
+    parser.add_argument("--apply", type=int, default=None, help="Apply the choice with this rank, 1 is the largest.")
+    parser.add_argument("--model", default="auscom", help="The model being used, either access or auscom.")
+
+    args = parser.parse_args()
+
+    session = EditSession()
+    now = current(session, args.experiment, args.model)
+
+    runtime = args.runtime if args.runtime is not None else now['ice_runtime']
+    # The ice run length is kept when the ice timestep changes, so that has to divide too.
+    period = common_period([runtime, now['ice_runtime']] + now['atmosphere_periods'])
+
+    max_ocean = args.max_ocean_timestep or now['ocean']
+    max_ice = args.max_ice_timestep or now['ice']
+    max_coupling = args.max_coupling_timestep or now['coupling']
+
+    choices = solve(period, max_ocean, max_ice, max_coupling, args.min_timestep)
+
+    print 'Current timesteps: ocean %s, ice %s, coupling %s' % (now['ocean'], now['ice'], now['coupling'])
+    print 'Coupling timestep must divide %s seconds' % period
+    if not choices:
+        sys.stderr.write('No valid timesteps.\n')
+        return 1
+
+    print '%6s %10s %10s %10s %10s' % ('rank', 'ocean', 'ice', 'coupling', 'ice steps')
+    for rank, (ocn, ice, cpl) in enumerate(choices[:args.show]):
+        print '%6s %10s %10s %10s %10s' % (rank + 1, ocn, ice, cpl, now['ice_runtime'] // ice)
+
+    if args.apply is not None:
+        if not (1 <= args.apply <= len(choices)):
+            sys.stderr.write('--apply must be between 1 and %s.\n' % len(choices))
+            return 1
+
+        choice = choices[args.apply - 1]
+        try:
+            apply(session, args.experiment, choice, args.model, period, now['ice_runtime'], args.runtime)
+            session.commit()
+        except ValueError as e:
+            sys.stderr.write('%s\n' % e)
+            return 1
+        print 'Applied ocean %s, ice %s, coupling %s' % choice
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
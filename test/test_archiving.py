@@ -0,0 +1,79 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import archiving
+
+bin_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin')
+
+def write(filename, text):
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        f.write(text)
+
+class TestArchiving(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.exp_dir = os.path.join(self.dir, 'exp')
+        self.archive_dir = os.path.join(self.dir, 'archive')
+
+        write(os.path.join(self.exp_dir, 'OCN_RUNDIR', 'ocean_month.nc'), 'ocean')
+        write(os.path.join(self.exp_dir, 'OCN_RUNDIR', 'ocean_scalar.nc'), 'scalar')
+        write(os.path.join(self.exp_dir, 'OCN_RUNDIR', 'input.nml'), 'namelist')
+        write(os.path.join(self.exp_dir, 'ICE_RUNDIR', 'HISTORY', 'iceh.0001-01.nc'), 'ice')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read_md5sums(self):
+        with open(os.path.join(self.archive_dir, 'md5sums')) as f:
+            return sorted([line.split()[1] for line in f])
+
+    def test_find_tool(self):
+
+        self.assertEqual(archiving.find_tool(['mppnccombine']), os.path.join(os.path.realpath(bin_dir), 'mppnccombine'))
+        self.assertEqual(archiving.find_tool(['not_a_real_tool']), None)
+
+    def test_postprocess(self):
+        """
+        Only the collected files are processed, not others put in the
+        archive, such as replaced inputs.
+        """
+
+        files = archiving.collect(self.exp_dir, self.archive_dir)
+        self.assertEqual(len(files), 3)
+        self.assertTrue(os.path.exists(os.path.join(self.exp_dir, 'OCN_RUNDIR', 'input.nml')))
+
+        write(os.path.join(self.archive_dir, 'OCN_RUNDIR', 'INPUT', 'ocean_temp_salt.res.nc'), 'restart')
+        archiving.postprocess(self.archive_dir, files[:2], processes=1, compress_level=0)
+        self.assertEqual(self.read_md5sums(), sorted([os.path.relpath(f, self.archive_dir) for f in files[:2]]))
+        self.assertTrue(archiving.is_complete(self.archive_dir))
+
+        # By default everything collect() would have moved.
+        archiving.postprocess(self.archive_dir, processes=1, compress_level=0)
+        self.assertEqual(self.read_md5sums(), ['ICE_RUNDIR/HISTORY/iceh.0001-01.nc',
+                                               'OCN_RUNDIR/ocean_month.nc', 'OCN_RUNDIR/ocean_scalar.nc'])
+
+    def test_combine(self):
+
+        tool = os.path.join(self.dir, 'fake_combine')
+        write(tool, '#!/bin/sh\nshift\nout=$1\nshift\ncat "$@" > $out && rm "$@"\n')
+        os.chmod(tool, 0755)
+
+        d = os.path.join(self.archive_dir, 'OCN_RUNDIR')
+        tiles = [os.path.join(d, 'ocean_daily.nc.%04d' % i) for i in range(2)]
+        for t in tiles:
+            write(t, 'tile\n')
+
+        files = archiving.combine(tiles + [os.path.join(d, 'ocean_scalar.nc')], tool)
+        self.assertEqual(files, [os.path.join(d, 'ocean_daily.nc'), os.path.join(d, 'ocean_scalar.nc')])
+        self.assertFalse(os.path.exists(tiles[0]))
+
+if __name__ == '__main__':
+    unittest.main()
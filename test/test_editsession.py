@@ -0,0 +1,63 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+from editsession import EditSession
+
+exp_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../exp/cnyf2.mom5')
+
+class TestEditSession(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        for f in ['input.nml', 'input_ice.nml', 'cice_in.nml', 'namcouple']:
+            shutil.copy(os.path.join(exp_dir, f), self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, name):
+        with open(os.path.join(self.dir, name)) as f:
+            return f.read()
+
+    def test_commit(self):
+        """
+        Files are read once and only changed files are written.
+        """
+
+        original = self.read('cice_in.nml')
+
+        with EditSession() as session:
+            nml = session.namelist(os.path.join(self.dir, 'input.nml'))
+            self.assertTrue(session.namelist(os.path.join(self.dir, 'input.nml')) is nml)
+            nml.set_value('ocean_model_nml', 'dt_ocean', 900)
+            session.namelist(os.path.join(self.dir, 'cice_in.nml'))
+            self.assertEqual(session.modified(), [os.path.join(self.dir, 'input.nml')])
+
+        self.assertEqual(self.read('cice_in.nml'), original)
+        self.assertTrue('dt_ocean = 900' in self.read('input.nml'))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['cice_in.nml', 'input.nml', 'input_ice.nml', 'namcouple'])
+
+    def test_inconsistent(self):
+        """
+        Nothing is written if the files don't agree.
+        """
+
+        original = [self.read(f) for f in ['input.nml', 'input_ice.nml']]
+
+        session = EditSession()
+        session.namelist(os.path.join(self.dir, 'input.nml')).set_value('auscom_ice_nml', 'dt_cpl', 900)
+        session.namelist(os.path.join(self.dir, 'input.nml')).set_value('ocean_solo_nml', 'dt_cpld', 900)
+        session.namelist(os.path.join(self.dir, 'input_ice.nml')).set_value('coupling_nml', 'dt_cice', 900)
+        session.namelist(os.path.join(self.dir, 'cice_in.nml'))
+        self.assertEqual(len(session.validate()), 2)
+        self.assertRaises(ValueError, session.commit)
+
+        self.assertEqual([self.read(f) for f in ['input.nml', 'input_ice.nml']], original)
+
+if __name__ == '__main__':
+    unittest.main()
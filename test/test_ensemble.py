@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import ensemble
+import scheduler
+
+class TestEnsemble(unittest.TestCase):
+
+    def test_experiment_cpus(self):
+
+        self.assertEqual(ensemble.experiment_cpus({'ncpus' : 16}), 16)
+        self.assertEqual(ensemble.experiment_cpus({'atm' : {'ncpus' : 1}, 'ice' : {'ncpus' : 6},
+                                                   'ocean' : {'ncpus' : 120}}), 127)
+
+    def test_run_ensemble(self):
+        """
+        Members submit jobs to one scheduler and monitor, and are never
+        using more than the CPU budget between them.
+        """
+
+        job_scheduler = scheduler.LocalScheduler()
+        monitor = scheduler.JobMonitor(job_scheduler, sentinel_interval=0.05, min_interval=0.05, max_interval=0.1)
+        experiments = [('a', 4), ('b', 4), ('c', 2), ('d', 6), ('e', 8)]
+        ncpus = dict(experiments)
+
+        lock = threading.Lock()
+        state = {'used' : 0, 'most' : 0}
+        job_ids = {}
+
+        def run_one(name):
+
+            with lock:
+                state['used'] += ncpus[name]
+                state['most'] = max(state['most'], state['used'])
+
+            job_ids[name] = job_scheduler.submit('sleep 0.2; test %s != d' % name)
+            monitor.wait(job_ids[name])
+
+            with lock:
+                state['used'] -= ncpus[name]
+            return job_scheduler.jobs[job_ids[name]].returncode
+
+        results = ensemble.run_ensemble(experiments, 10, run_one)
+        monitor.stop()
+
+        self.assertEqual([r['name'] for r in results], ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual([r['ret'] == 0 for r in results], [True, True, True, False, True])
+        self.assertEqual(len(set(job_ids.values())), 5)
+        self.assertTrue(state['most'] <= 10)
+        self.assertEqual(state['used'], 0)
+
+        self.assertRaises(AssertionError, ensemble.run_ensemble, [('big', 12)], 10, run_one)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import unittest
+import sys
+import os
+import glob
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+from fnamelist import FortranNamelist, Namcouple
+
+exp_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../exp')
+
+nml_text = """! A comment before the first group.
+&setup_nml
+    days_per_year  = 365
+  , dt             = 1800   ! seconds
+  , histfreq       = 'm','x','x'
+  , history_dir    = './HISTORY/'
+  , latpnt(1)      =  90.
+  , latpnt(2)      = -65.
+/
+&cable
+  cable_user%CABLE_RUNTIME_COUPLED = .FALSE.   !change to TRUE
+  cable_user%FWSOIL_SWITCH = 'standard'
+/
+ &NLSTCALL
+ RUN_TARGET_END=  0 , 0 , 90 , 0 , 0 , 0 ,
+ LTIMER=.TRUE.,
+ &END
+&setup_nml
+    dt = 3600
+/
+"""
+
+class TestFortranNamelist(unittest.TestCase):
+
+    def setUp(self):
+
+        (fd, self.filename) = tempfile.mkstemp(suffix='.nml')
+        with os.fdopen(fd, 'w') as f:
+            f.write(nml_text)
+        self.nml = FortranNamelist(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_round_trip(self):
+        """
+        Every namelist in the experiments is written back unchanged.
+        """
+
+        files = glob.glob(os.path.join(exp_dir, '*', '*.nml')) + \
+                glob.glob(os.path.join(exp_dir, '*', 'config', '*.nml')) + \
+                glob.glob(os.path.join(exp_dir, '*', 'atm_tmp_ctrl', 'CNTL*'))
+        self.assertTrue(len(files) > 0)
+
+        for filename in files:
+            with open(filename) as f:
+                text = f.read()
+            self.assertEqual(str(FortranNamelist(filename)), text, filename)
+
+    def test_get_value(self):
+
+        self.assertEqual(self.nml.get_value('setup_nml', 'dt'), '1800')
+        self.assertEqual(self.nml.get_value('setup_nml', 'histfreq'), "'m','x','x'")
+        self.assertEqual(self.nml.get_value('setup_nml', 'history_dir'), "'./HISTORY/'")
+        self.assertEqual(self.nml.get_value('setup_nml', 'latpnt(2)'), '-65.')
+        self.assertEqual(self.nml.get_value('cable', 'cable_user%CABLE_RUNTIME_COUPLED'), '.FALSE.')
+        self.assertEqual(self.nml.get_value('NLSTCALL', 'RUN_TARGET_END'), '0 , 0 , 90 , 0 , 0 , 0')
+        self.assertEqual(self.nml.get_value('nlstcall', 'ltimer'), '.TRUE.')
+
+    def test_repeated_group(self):
+
+        self.assertEqual(self.nml.get_value('setup_nml', 'dt', index=1), '3600')
+        self.nml.set_value('setup_nml', 'dt', 7200, index=1)
+        self.assertEqual(self.nml.get_value('setup_nml', 'dt'), '1800')
+        self.assertEqual(self.nml.get_value('setup_nml', 'dt', index=1), '7200')
+
+    def test_missing(self):
+
+        self.assertRaises(AssertionError, self.nml.get_value, 'setup_nml', 'npt')
+        self.assertRaises(AssertionError, self.nml.get_value, 'grid_nml', 'dt')
+
+    def test_set_value(self):
+        """
+        Only the value changes, formatting and comments are kept.
+        """
+
+        self.nml.set_value('setup_nml', 'dt', 900)
+        self.nml.set_value('setup_nml', 'histfreq', ["'d'", "'m'", "'x'"])
+        self.nml.set_value('cable', 'cable_user%CABLE_RUNTIME_COUPLED', '.TRUE.')
+        self.nml.set_value('NLSTCALL', 'RUN_TARGET_END', '0, 0, 31, 0, 0, 0')
+        self.nml.write()
+
+        expected = nml_text.replace('= 1800   ! seconds', '= 900   ! seconds')
+        expected = expected.replace("'m','x','x'", "'d', 'm', 'x'")
+        expected = expected.replace('= .FALSE.   !change', '= .TRUE.   !change')
+        expected = expected.replace('=  0 , 0 , 90 , 0 , 0 , 0 ,', '=  0, 0, 31, 0, 0, 0 ,')
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), expected)
+
+        nml = FortranNamelist(self.filename)
+        self.assertEqual(nml.get_value('setup_nml', 'dt'), '900')
+
+    def test_write_linked(self):
+        """
+        Writing a hard linked file leaves the other link alone.
+        """
+
+        link = self.filename + '.link'
+        os.link(self.filename, link)
+        try:
+            nml = FortranNamelist(link)
+            nml.set_value('setup_nml', 'dt', 900)
+            nml.write()
+
+            with open(self.filename) as f:
+                self.assertEqual(f.read(), nml_text)
+            self.assertEqual(FortranNamelist(link).get_value('setup_nml', 'dt'), '900')
+        finally:
+            os.remove(link)
+
+namcouple_text = """ $NFIELDS
+   2 
+ $END
+ $RUNTIME
+# 86400    ! 1  day
+ 864000
+ $END
+ $STRINGS
+swfld_ai swfld_i 367 21600 5 INPUT/a2i.nc EXPORTED
+192 94 1440 1080 nt62 cice LAG=+1800 SEQ=+1
+P  0  P  0
+#
+LOCTRANS CHECKIN MAPPING SCRIPR CHECKOUT
+INSTANT
+INT=0
+INPUT/rmp_nt62_to_cice_CONSERV_FRACNNEI.nc dst
+CONSERV LR SCALAR LATLON 10 FRACNNEI FIRST
+INT=0
+#strsu_io u_flux 170 1800 1 INPUT/i2o.nc EXPORTED
+strsu_io u_flux 170 1800 1 INPUT/i2o.nc EXPORTED
+cice cice LAG=0 SEQ=+1
+P  0  P  0
+LOCTRANS
+INSTANT
+ $END
+"""
+
+class TestNamcouple(unittest.TestCase):
+
+    def setUp(self):
+
+        (fd, self.filename) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(namcouple_text)
+        self.nc = Namcouple(self.filename, 'auscom')
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_round_trip(self):
+
+        files = glob.glob(os.path.join(exp_dir, '*', 'namcouple')) + \
+                glob.glob(os.path.join(exp_dir, '*', 'config', 'namcouple'))
+        self.assertTrue(len(files) > 0)
+
+        for filename in files:
+            with open(filename) as f:
+                text = f.read()
+            nc = Namcouple(filename)
+            self.assertEqual(str(nc), text, filename)
+            self.assertEqual(len(nc.fields), int(nc.get_keyword('NFIELDS')[0]), filename)
+
+    def test_fields(self):
+
+        self.assertEqual(len(self.nc.fields), 2)
+        f = self.nc.fields[0]
+        self.assertEqual((f.source, f.target, f.period, f.restart, f.status),
+                         ('swfld_ai', 'swfld_i', 21600, 'INPUT/a2i.nc', 'EXPORTED'))
+        self.assertEqual((f.source_grid, f.target_grid, f.lag), ('nt62', 'cice', 1800))
+        self.assertEqual(f.transformations(), ['LOCTRANS', 'CHECKIN', 'MAPPING', 'SCRIPR', 'CHECKOUT'])
+        self.assertEqual(self.nc.select(source_grid='cice'), [self.nc.fields[1]])
+
+    def test_set_ocean_timestep(self):
+        """
+        Only the lag and period tokens change, comments are left alone.
+        """
+
+        self.nc.set_ocean_timestep(3600)
+        self.nc.set_runtime(86400)
+        self.nc.write()
+
+        expected = namcouple_text.replace('LAG=+1800', 'LAG=+3600')
+        expected = expected.replace('\nstrsu_io u_flux 170 1800', '\nstrsu_io u_flux 170 3600')
+        expected = expected.replace(' 864000\n', ' 86400\n')
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), expected)
+
+if __name__ == '__main__':
+    unittest.main()
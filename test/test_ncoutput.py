@@ -0,0 +1,94 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+import netCDF4 as nc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../tools'))
+import ncoutput
+
+class TestChunkSizes(unittest.TestCase):
+
+    def test_default(self):
+
+        self.assertEqual(ncoutput.chunk_sizes([0, 300, 360], 8, 'default'), None)
+        self.assertEqual(ncoutput.chunk_sizes([100], 8, 'map'), None)
+
+    def test_map(self):
+
+        self.assertEqual(ncoutput.chunk_sizes([0, 300, 360], 8, 'map'), [1, 300, 360])
+        self.assertEqual(ncoutput.chunk_sizes([12, 5, 300, 360], 4, 'map'), [1, 1, 300, 360])
+        self.assertEqual(ncoutput.chunk_sizes([300, 360], 8, 'map'), [300, 360])
+
+    def test_timeseries(self):
+
+        # Unlimited time, 64 records of 8 bytes in 1 MB is a 45 x 45 tile.
+        self.assertEqual(ncoutput.chunk_sizes([0, 300, 360], 8, 'timeseries'),
+                         [ncoutput.TIMESERIES_CHUNK_RECORDS, 45, 45])
+        # A fixed time dimension is kept whole.
+        self.assertEqual(ncoutput.chunk_sizes([365, 5, 300, 360], 4, 'timeseries'), [365, 1, 26, 26])
+        # Small grids fit in one tile.
+        self.assertEqual(ncoutput.chunk_sizes([10, 3, 4], 8, 'timeseries'), [10, 3, 4])
+
+
+class TestSlabWriter(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.f = nc.Dataset(os.path.join(self.dir, 'out.nc'), 'w')
+        self.f.createDimension('time', None)
+        self.f.createDimension('ny', 3)
+        self.f.createDimension('nx', 4)
+
+    def tearDown(self):
+
+        self.f.close()
+        shutil.rmtree(self.dir)
+
+    def test_block_records(self):
+
+        var = ncoutput.create_variable(self.f, 'u', 'f8', ('time', 'ny', 'nx'), chunking='timeseries')
+        self.assertEqual(var.chunking(), [ncoutput.TIMESERIES_CHUNK_RECORDS, 3, 4])
+
+        # Blocks are whole chunks.
+        writer = ncoutput.SlabWriter(var, buffer_mb=1)
+        self.assertEqual(writer.block_records % ncoutput.TIMESERIES_CHUNK_RECORDS, 0)
+
+    def test_write(self):
+
+        var = ncoutput.create_variable(self.f, 'u', 'f8', ('time', 'ny', 'nx'), fill_value=-1.0, chunking='map')
+        data = np.arange(10*3*4, dtype=np.float64).reshape((10, 3, 4))
+
+        with ncoutput.SlabWriter(var) as writer:
+            writer.block_records = 4
+            writer.write(0, data[0])
+            writer.write(slice(1, 7), data[1:7])
+            # Nothing is written until a block is finished.
+            self.assertEqual(var.shape[0], 4)
+            writer.write((slice(7, 10), slice(0, 2)), data[7:10, 0:2])
+
+        self.assertEqual(var.shape, (10, 3, 4))
+        np.testing.assert_array_equal(var[:7], data[:7])
+        np.testing.assert_array_equal(var[7:, 0:2], data[7:, 0:2])
+        # The part that wasn't written is left as the fill value.
+        self.assertTrue(np.all(np.ma.getmaskarray(var[7:, 2])))
+
+    def test_write_masked(self):
+
+        var = ncoutput.create_variable(self.f, 'u', 'f8', ('time', 'ny', 'nx'), fill_value=-1.0, float32=True)
+        self.assertEqual(var.dtype, np.float32)
+
+        data = np.ma.masked_array(np.ones((2, 3, 4)), mask=False)
+        data[1, 1, 1] = np.ma.masked
+        with ncoutput.SlabWriter(var) as writer:
+            writer.write(slice(0, 2), data)
+
+        self.assertEqual(np.ma.count_masked(var[:]), 1)
+        self.assertTrue(var[:].mask[1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
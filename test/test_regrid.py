@@ -0,0 +1,209 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+import netCDF4 as nc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../tools/grids'))
+import regrid
+
+class TestWeights(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+
+        weights = regrid.make_weights(np.array([2, 0, 1, 0]), np.array([1, 1, 0, 2]),
+                                      np.array([0.25, 0.75, 1.0, 1.0]), 3, 3)
+        weights['src_grid_area'] = np.array([1.0, 2.0, 3.0])
+        weights['dst_grid_frac'] = np.array([1.0, 0.5, 1.0])
+
+        filename = os.path.join(self.dir, 'rmp.nc')
+        regrid.write_weights(filename, weights)
+        saved = regrid.read_weights(filename)
+
+        # Links are sorted by destination then source.
+        self.assertEqual(list(saved['src_address']), [1, 0, 2, 0])
+        self.assertEqual(list(saved['dst_address']), [0, 1, 1, 2])
+        self.assertEqual(list(saved['remap_matrix']), [1.0, 0.75, 0.25, 1.0])
+        self.assertEqual((saved['src_grid_size'], saved['dst_grid_size']), (3, 3))
+        self.assertEqual(list(saved['src_grid_area']), [1.0, 2.0, 3.0])
+        self.assertEqual(list(saved['dst_grid_frac']), [1.0, 0.5, 1.0])
+        self.assertEqual(saved['src_grid_frac'], None)
+        self.assertEqual(saved['dst_grid_area'], None)
+
+        # Addresses are one-based in the file.
+        with nc.Dataset(filename) as f:
+            self.assertEqual(list(f.variables['src_address'][:]), [2, 1, 3, 1])
+
+        src = np.array([[[1.0, 2.0, 4.0]]])
+        dest = regrid.apply_weights(regrid.weights_matrix(saved), src)
+        np.testing.assert_allclose(dest, [[2.0, 1.75, 1.0]])
+
+
+class TestMass(unittest.TestCase):
+
+    def test_compute_mass_chunk(self):
+
+        values = np.arange(8, dtype=np.float64).reshape((2, 2, 2))
+        area = np.array([[1.0, 2.0], [3.0, 4.0]])
+        frac = np.array([[1.0, 0.0], [0.5, 1.0]])
+
+        np.testing.assert_allclose(regrid.compute_mass_chunk(values, area), [20.0, 60.0])
+        np.testing.assert_allclose(regrid.compute_mass_chunk(values, area, frac), [15.0, 41.0])
+
+    def test_conservation_errors(self):
+
+        src_mass = np.array([10.0, 0.0, -4.0])
+        dest_mass = np.array([10.5, 0.25, -4.0])
+        np.testing.assert_allclose(regrid.conservation_errors(src_mass, dest_mass), [0.05, 0.25, 0.0])
+
+
+class TestFieldTable(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+
+        filename = os.path.join(self.dir, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def test_matm_table(self):
+
+        table = self.write('data_4_matm.table', '2\n\n/in/t_10.nc # temperature\nt_10\n/in/q_10.nc\nq_10\n')
+        self.assertEqual(regrid.read_field_table(table),
+                         [('/in/t_10.nc', 't_10', None), ('/in/q_10.nc', 'q_10', None)])
+
+    def test_manifest(self):
+
+        table = self.write('manifest', '# src field [dest]\n/in/a.nc u\n\n/in/a.nc v\n/in/a.nc w /out/w.nc\n')
+        fields = regrid.read_field_table(table)
+        self.assertEqual(fields, [('/in/a.nc', 'u', None), ('/in/a.nc', 'v', None),
+                                  ('/in/a.nc', 'w', '/out/w.nc')])
+
+        self.assertEqual(regrid.group_fields(fields, '/regridded'),
+                         [('/in/a.nc', ['u', 'v'], '/regridded/a.nc'), ('/in/a.nc', ['w'], '/out/w.nc')])
+
+    def test_check_field_shapes(self):
+
+        src = os.path.join(self.dir, 'src.nc')
+        with nc.Dataset(src, 'w') as f:
+            f.createDimension('time', None)
+            f.createDimension('ny', 3)
+            f.createDimension('nx', 4)
+            f.createDimension('nx_small', 2)
+            f.createVariable('u', 'f8', ('time', 'ny', 'nx'))
+            f.createVariable('v', 'f8', ('time', 'ny', 'nx_small'))
+
+        self.assertEqual(regrid.check_field_shapes([(src, ['u'], None)], (3, 4)), [])
+        problems = regrid.check_field_shapes([(src, ['u', 'v', 'w'], None)], (3, 4))
+        self.assertEqual(len(problems), 2)
+        self.assertTrue('v in %s is on a 3 x 2 grid' % src in problems[0])
+        self.assertEqual(problems[1], 'w is not in %s' % src)
+
+
+class TestKDTreeWeights(unittest.TestCase):
+
+    def setUp(self):
+
+        # A 2 degree source grid and a destination grid offset from it.
+        self.src_lons, self.src_lats = np.meshgrid(np.arange(0.0, 360.0, 2.0), np.arange(-10.0, 12.0, 2.0))
+        self.dest_lons, self.dest_lats = np.meshgrid(np.arange(0.5, 360.0, 3.0), np.arange(-9.5, 10.0, 3.0))
+
+    def regrid(self, weights, src):
+        return regrid.apply_weights(regrid.weights_matrix(weights), src.reshape((1,) + src.shape))[0]
+
+    def test_nearest(self):
+
+        weights = regrid.nearest_weights(self.src_lons, self.src_lats, self.dest_lons, self.dest_lats)
+        dest = self.regrid(weights, self.src_lons)
+
+        # Each destination point gets the longitude of the closest source point.
+        expected = np.round(self.dest_lons.flatten() / 2.0)*2.0 % 360.0
+        np.testing.assert_allclose(dest, expected)
+
+    def test_nearest_masked(self):
+
+        src_mask = self.src_lons < 180.0
+        weights = regrid.nearest_weights(self.src_lons, self.src_lats, self.dest_lons, self.dest_lats, src_mask)
+        self.assertFalse(np.any(src_mask.flatten()[weights['src_address']]))
+
+    def test_bilinear(self):
+
+        # Linear in latitude so interpolation is exact away from the edges.
+        weights = regrid.bilinear_weights(self.src_lons, self.src_lats, self.dest_lons, self.dest_lats)
+        dest = self.regrid(weights, 2.0*self.src_lats + 1.0)
+        np.testing.assert_allclose(dest, 2.0*self.dest_lats.flatten() + 1.0, atol=1e-2)
+
+        # Each destination point's weights sum to 1.
+        sums = np.bincount(weights['dst_address'], weights['remap_matrix'], minlength=self.dest_lons.size)
+        np.testing.assert_allclose(sums, 1.0)
+
+    def test_bilinear_periodic(self):
+
+        # Points between the last and first columns use quads across the seam.
+        dest_lons = np.array([[359.0]])
+        dest_lats = np.array([[1.0]])
+        weights = regrid.bilinear_weights(self.src_lons, self.src_lats, dest_lons, dest_lats)
+        self.assertEqual(len(weights['src_address']), 4)
+        columns = set(np.unravel_index(weights['src_address'], self.src_lons.shape)[1])
+        self.assertEqual(columns, set([0, self.src_lons.shape[1] - 1]))
+        np.testing.assert_allclose(weights['remap_matrix'], 0.25, atol=1e-3)
+
+
+class TestApplyMasked(unittest.TestCase):
+
+    def setUp(self):
+
+        # Two destination points, the first the mean of source points 0 and 1,
+        # the second the mean of source points 2 and 3.
+        weights = regrid.make_weights(np.array([0, 1, 2, 3]), np.array([0, 0, 1, 1]),
+                                      np.array([0.5, 0.5, 0.5, 0.5]), 4, 2)
+        matrix = regrid.weights_matrix(weights)
+        self.apply = lambda chunk: regrid.apply_weights(matrix, chunk)
+        self.src = np.array([[[1.0, 3.0, 5.0, 7.0]], [[2.0, 4.0, 6.0, 8.0]]])
+
+    def test_unmasked(self):
+
+        dest, dest_frac = regrid.apply_masked(self.apply, self.src)
+        np.testing.assert_allclose(dest, [[2.0, 6.0], [3.0, 7.0]])
+        self.assertEqual(dest_frac, None)
+
+    def test_renormalised(self):
+
+        # Masked points are left out rather than counted as 0.
+        valid = np.ones(self.src.shape, dtype=bool)
+        valid[0, 0, 1] = False
+        valid[1, 0, 2] = False
+
+        dest, dest_frac = regrid.apply_masked(self.apply, self.src, valid)
+        np.testing.assert_allclose(dest, [[1.0, 6.0], [3.0, 8.0]])
+        np.testing.assert_allclose(dest_frac, [[0.5, 1.0], [1.0, 0.5]])
+        self.assertFalse(np.any(np.ma.getmaskarray(dest)))
+
+    def test_fully_masked(self):
+
+        # Destination points with no valid source points are masked.
+        valid = np.ones(self.src.shape, dtype=bool)
+        valid[0, 0, 2:] = False
+
+        dest, dest_frac = regrid.apply_masked(self.apply, self.src, valid)
+        np.testing.assert_array_equal(np.ma.getmaskarray(dest), [[False, True], [False, False]])
+        np.testing.assert_allclose(dest_frac, [[1.0, 0.0], [1.0, 1.0]])
+        np.testing.assert_allclose(dest.compressed(), [2.0, 3.0, 7.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import datetime
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import run
+
+class TestPrepareContrun(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        for d in ['config', 'ATM_RUNDIR', 'ICE_RUNDIR/INPUT', 'ICE_RUNDIR/RESTART',
+                  'OCN_RUNDIR/INPUT', 'OCN_RUNDIR/RESTART']:
+            os.makedirs(os.path.join(self.dir, d))
+
+        for f in ['ICE_RUNDIR/RESTART/u_star.nc', 'ICE_RUNDIR/RESTART/sicemass.nc',
+                  'ICE_RUNDIR/RESTART/iced.00020101', 'OCN_RUNDIR/RESTART/ocean_temp_salt.res.nc',
+                  'config/input.nml']:
+            with open(os.path.join(self.dir, f), 'w') as fh:
+                fh.write(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_twice(self):
+        """
+        Restarts that have already been promoted are left where they are.
+        """
+
+        date = datetime.date(2, 1, 1)
+        run.prepare_contrun(self.dir, 'auscom', date)
+        run.prepare_contrun(self.dir, 'auscom', date)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir, 'ICE_RUNDIR', 'INPUT'))),
+                         ['sicemass.nc', 'u_star.nc'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir, 'ICE_RUNDIR', 'RESTART'))),
+                         ['ice.restart_file', 'iced.00020101'])
+        self.assertEqual(os.listdir(os.path.join(self.dir, 'OCN_RUNDIR', 'INPUT')), ['ocean_temp_salt.res.nc'])
+        self.assertEqual(os.listdir(os.path.join(self.dir, 'OCN_RUNDIR', 'RESTART')), [])
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'archive')))
+
+class TestChain(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_run_script(self):
+        """
+        A chained segment prepares the next one before touching the sentinel.
+        """
+
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../exp/cnyf2.mom5/run_config.yaml')) as f:
+            config = yaml.safe_load(f)
+        sentinel = os.path.join(self.dir, 'run_complete')
+
+        with open(run.make_run_script('cnyf2.mom5', 'auscom', self.dir, config, sentinel)) as f:
+            script = f.read()
+        self.assertFalse('--post_segment' in script)
+        self.assertTrue(script.rstrip().endswith('touch %s' % sentinel))
+
+        with open(run.make_run_script('cnyf2.mom5', 'auscom', self.dir, config, sentinel, post_segment=True)) as f:
+            lines = f.read().strip().splitlines()
+        self.assertTrue(lines[-2].endswith('run.py %s --post_segment || exit 1' % os.path.basename(self.dir)))
+        self.assertEqual(lines[-1], 'touch %s' % sentinel)
+
+    def test_chain_state(self):
+
+        state = {'model' : 'auscom', 'init_date' : '00010101', 'runtime_months' : 1,
+                 'segments' : 3, 'segment' : 2, 'start_date' : '00010201', 'end_date' : '00010301'}
+        run.write_chain_state(self.dir, state)
+        self.assertEqual(run.read_chain_state(self.dir), state)
+        self.assertEqual(os.listdir(self.dir), ['chain_state.yaml'])
+
+if __name__ == '__main__':
+    unittest.main()
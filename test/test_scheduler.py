@@ -0,0 +1,89 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import scheduler
+
+qstat_output = """Job id            Name             User              Time Use S Queue
+----------------  ---------------- ----------------  -------- - -----
+123.r-man2        cnyf2.mom5       abc123            01:02:03 R normal
+qstat: 23.r-man2 Job has finished, use -x or -H to obtain historical job information
+qstat: Unknown Job Id 1234.r-man2
+"""
+
+class BrokenScheduler(scheduler.Scheduler):
+
+    def finished(self, job_ids):
+        raise OSError(2, 'No such file or directory: qstat')
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_qstat(self):
+
+        job_ids = ['123.r-man2', '23.r-man2', '1234.r-man2', '12.r-man2']
+        self.assertEqual(scheduler.parse_qstat(qstat_output, job_ids), set(['23.r-man2', '1234.r-man2']))
+        self.assertEqual(scheduler.parse_qstat('', job_ids), set())
+
+    def test_direct(self):
+        """
+        Job ids are unique when submitting from many threads, and a job
+        that depends on a failed one doesn't run.
+        """
+
+        s = scheduler.DirectScheduler()
+        ids = []
+        threads = [threading.Thread(target=lambda: ids.append(s.submit('true'))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(ids)), 8)
+
+        marker = os.path.join(self.dir, 'ran')
+        failed = s.submit('false')
+        after = s.submit('touch %s' % marker, depends_on=failed)
+        self.assertNotEqual(s.returncodes[after], 0)
+        self.assertFalse(os.path.exists(marker))
+        self.assertEqual(s.finished([failed, after]), set([failed, after]))
+
+    def test_monitor(self):
+        """
+        Jobs are waited for through the sentinel or the scheduler.
+        """
+
+        s = scheduler.LocalScheduler()
+        monitor = scheduler.JobMonitor(s, sentinel_interval=0.1, min_interval=0.1, max_interval=0.2)
+
+        sentinel = os.path.join(self.dir, 'done')
+        first = s.submit('sleep 0.2; touch %s' % sentinel)
+        second = s.submit('true', depends_on=first)
+        monitor.wait(first, sentinel)
+        self.assertTrue(os.path.exists(sentinel))
+        monitor.wait(second)
+        self.assertEqual(s.jobs[second].returncode, 0)
+        monitor.stop()
+
+    def test_monitor_error(self):
+        """
+        A failed scheduler query is raised by every wait() rather than
+        leaving them waiting forever.
+        """
+
+        monitor = scheduler.JobMonitor(BrokenScheduler(), sentinel_interval=0.05)
+        monitor.add('1.r-man2')
+        self.assertRaises(OSError, monitor.wait, '1.r-man2')
+        self.assertRaises(OSError, monitor.wait, '2.r-man2')
+        monitor.stop()
+
+if __name__ == '__main__':
+    unittest.main()
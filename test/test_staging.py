@@ -0,0 +1,79 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import staging
+
+def write(filename, text):
+    with open(filename, 'w') as f:
+        f.write(text)
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+class TestStaging(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, 'src')
+        self.dest = os.path.join(self.dir, 'dest')
+        os.makedirs(self.src)
+        os.makedirs(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_stage(self):
+        """
+        Read-only files are linked, writable ones copied, and nothing is
+        done the second time.
+        """
+
+        write(os.path.join(self.src, 'grid_spec.nc'), 'grid')
+        write(os.path.join(self.src, 'i2o.nc'), 'coupling')
+        files = [(os.path.join(self.src, 'grid_spec.nc'), self.dest, False),
+                 (os.path.join(self.src, 'i2o.nc'), self.dest, True)]
+
+        self.assertEqual(staging.stage(files), {'linked' : 1, 'copied' : 1, 'skipped' : 0})
+        self.assertTrue(os.path.samefile(os.path.join(self.src, 'grid_spec.nc'),
+                                         os.path.join(self.dest, 'grid_spec.nc')))
+        self.assertFalse(os.path.samefile(os.path.join(self.src, 'i2o.nc'),
+                                          os.path.join(self.dest, 'i2o.nc')))
+
+        manifest = staging.read_manifest(self.dest)
+        self.assertEqual(staging.stage(files), {'linked' : 0, 'copied' : 0, 'skipped' : 2})
+        self.assertEqual(staging.read_manifest(self.dest), manifest)
+
+        # A copy the model has written to is staged again.
+        write(os.path.join(self.dest, 'i2o.nc'), 'written by the model')
+        os.utime(os.path.join(self.dest, 'i2o.nc'), (0, 0))
+        self.assertEqual(staging.stage(files), {'linked' : 0, 'copied' : 1, 'skipped' : 1})
+        self.assertEqual(read(os.path.join(self.dest, 'i2o.nc')), 'coupling')
+
+    def test_promote(self):
+        """
+        Replaced files are archived, and promoting again is a no-op.
+        """
+
+        archive = os.path.join(self.dir, 'archive')
+        write(os.path.join(self.dir, 'ocean_temp_salt.res.nc'), 'old')
+        staging.stage([(os.path.join(self.dir, 'ocean_temp_salt.res.nc'), self.dest, True)])
+        write(os.path.join(self.src, 'ocean_temp_salt.res.nc'), 'new')
+
+        self.assertEqual(staging.promote(self.src, self.dest, archive), ['ocean_temp_salt.res.nc'])
+        self.assertEqual(read(os.path.join(self.dest, 'ocean_temp_salt.res.nc')), 'new')
+        self.assertEqual(read(os.path.join(archive, 'ocean_temp_salt.res.nc')), 'old')
+        self.assertEqual(os.listdir(self.src), [])
+        self.assertTrue('ocean_temp_salt.res.nc' not in staging.read_manifest(self.dest))
+
+        self.assertEqual(staging.promote(self.src, self.dest, archive, ['ocean_temp_salt.res.nc']), [])
+        self.assertEqual(read(os.path.join(self.dest, 'ocean_temp_salt.res.nc')), 'new')
+        self.assertEqual(read(os.path.join(archive, 'ocean_temp_salt.res.nc')), 'old')
+
+if __name__ == '__main__':
+    unittest.main()
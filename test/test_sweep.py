@@ -0,0 +1,95 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import sweep
+import set_model_option
+from fnamelist import FortranNamelist
+
+base = 'cnyf2.mom5-0.25'
+
+# The experiment paths in set_model_option, all under exp_dir.
+PATHS = ['exp_dir', 'input_atm', 'namcouple', 'input_ice', 'cice_in', 'input_ocn']
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.name = '%s.test_sweep' % base
+        self.dest = os.path.join(self.dir, self.name)
+
+        # Make variants in a copy of the base experiment, not in exp/.
+        self.paths = dict([(p, getattr(set_model_option, p)) for p in PATHS])
+        exp_dir = set_model_option.exp_dir
+        for p in PATHS:
+            value = getattr(set_model_option, p)
+            if isinstance(value, list):
+                value = [v.replace(exp_dir, self.dir) for v in value]
+            else:
+                value = value.replace(exp_dir, self.dir)
+            setattr(set_model_option, p, value)
+        shutil.copytree(os.path.join(exp_dir, base), os.path.join(self.dir, base))
+
+    def tearDown(self):
+
+        for p, value in self.paths.items():
+            setattr(set_model_option, p, value)
+        shutil.rmtree(self.dir)
+
+    def test_names(self):
+
+        self.assertEqual(sweep.parse_param('dt_ocean=900,1800'), ('dt_ocean', ['900', '1800']))
+        self.assertEqual(sweep.parse_param('cice_in.nml:ice_nml:ndte=120'),
+                         ('cice_in.nml:ice_nml:ndte', ['120']))
+        self.assertRaises(AssertionError, sweep.parse_param, 'ndte=120')
+        self.assertEqual(sweep.variant_name(base, [('dt_ocean', '900'), ('cice_in.nml:ice_nml:ndte', '240')]),
+                         base + '.dt_ocean-900.ndte-240')
+
+    def test_copy_experiment(self):
+        """
+        Large files are linked, run output is left behind.
+        """
+
+        src = os.path.join(self.dir, 'src')
+        os.makedirs(os.path.join(src, 'config'))
+        os.makedirs(os.path.join(src, 'OCN_RUNDIR'))
+        with open(os.path.join(src, 'config', 'input.nml'), 'w') as f:
+            f.write('&ocean_model_nml\n/\n')
+        with open(os.path.join(src, 'mom5xx'), 'wb') as f:
+            f.write('\\0'*sweep.LINK_MIN_BYTES)
+        open(os.path.join(src, 'run_complete'), 'w').close()
+
+        dest = os.path.join(self.dir, 'dest')
+        sweep.copy_experiment(src, dest)
+        self.assertEqual(sorted(os.listdir(dest)), ['config', 'mom5xx'])
+        self.assertTrue(os.path.samefile(os.path.join(src, 'mom5xx'), os.path.join(dest, 'mom5xx')))
+        self.assertFalse(os.path.samefile(os.path.join(src, 'config', 'input.nml'),
+                                          os.path.join(dest, 'config', 'input.nml')))
+
+    def test_make_variant(self):
+
+        params = [('dt_ocean', '900'), ('cice_in.nml:ice_nml:ndte', '240')]
+        self.assertEqual(sweep.make_variant((base, self.name, params, 'auscom')), (self.name, None))
+
+        config = os.path.join(self.dest, 'config')
+        self.assertEqual(FortranNamelist(os.path.join(config, 'input.nml')).get_value('ocean_model_nml', 'dt_ocean'), '900')
+        self.assertEqual(FortranNamelist(os.path.join(config, 'cice_in.nml')).get_value('ice_nml', 'ndte'), '240')
+
+        with open(os.path.join(self.dest, sweep.MANIFEST)) as f:
+            manifest = yaml.safe_load(f)
+        self.assertEqual(manifest['base'], base)
+        self.assertEqual(manifest['parameters'], dict(params))
+        self.assertEqual(sorted(manifest['changes'].keys()), ['config/cice_in.nml', 'config/input.nml'])
+        self.assertEqual([(c['old'].split()[-1], c['new'].split()[-1]) for c in manifest['changes']['config/input.nml']],
+                         [('450', '900')])
+
+        # An existing experiment is left alone.
+        self.assertEqual(sweep.make_variant((base, self.name, params, 'auscom')), (self.name, 'already exists'))
+
+if __name__ == '__main__':
+    unittest.main()
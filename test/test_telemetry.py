@@ -0,0 +1,89 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import sqlite3
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+import telemetry
+
+mom_output = """ MOM4: --- completed ---
+                                          tmin          tmax          tavg          tstd  tfrac grain pemin pemax
+%s
+%s
+""" % ('%-32s%14.6f%14.6f%14.6f%14.6f%7.3f%6d%6d%6d' % ('Total runtime', 3500.0, 3600.5, 3550.0, 10.0, 1.0, 0, 0, 959),
+       '%-32s%14.6f%14.6f%14.6f%14.6f%7.3f%6d%6d%6d' % ('Ocean: barotropic', 100.0, 120.25, 110.0, 5.0, 0.031, 11, 0, 959))
+
+cice_output = """Timer   1: Total      3590.12 seconds
+Timer   2: Step        3400.00 seconds
+ End of CICE
+"""
+
+config = {'atm' : {'ncpus' : 1}, 'ice' : {'ncpus' : 6}, 'ocean' : {'ncpus' : 120}}
+
+class TestTelemetry(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        for d, name, text in [('OCN_RUNDIR', 'stdout.txt', mom_output), ('ICE_RUNDIR', 'ice_diag.d', cice_output)]:
+            os.makedirs(os.path.join(self.dir, d))
+            with open(os.path.join(self.dir, d, name), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_timers(self):
+
+        timers = telemetry.parse_timers(mom_output + cice_output)
+        self.assertEqual(timers, [('ocean', 'Total runtime', 3600.5), ('ocean', 'Ocean: barotropic', 120.25),
+                                  ('ice', 'Total', 3590.12), ('ice', 'Step', 3400.0)])
+        self.assertEqual(telemetry.model_runtime(timers), 3600.5)
+        self.assertEqual(telemetry.model_runtime([]), None)
+
+    def test_record(self):
+
+        db = os.path.join(self.dir, 'telemetry.db')
+        with open(os.path.join(self.dir, telemetry.RUN_TIMES), 'w') as f:
+            f.write('1000\n4700\n')
+        telemetry.record(db, 'cnyf2.mom5', 'auscom', self.dir, config, '123.r-man2',
+                         '00010101', '00020101', 365, 9000.0)
+
+        conn = sqlite3.connect(db)
+        runs = conn.execute('select experiment, run_id, elapsed, walltime, runtime, sim_days, ncpus from runs').fetchall()
+        self.assertEqual(runs, [('cnyf2.mom5', '123.r-man2', 9000.0, 3700.0, 3600.5, 365, 127)])
+        self.assertEqual(conn.execute('select count(*) from timers').fetchone()[0], 4)
+        conn.close()
+
+    def test_walltime(self):
+        """
+        Without both times from the run script the wall time is unknown,
+        the time since submission is never used instead.
+        """
+
+        self.assertEqual(telemetry.read_walltime(self.dir), None)
+        with open(os.path.join(self.dir, telemetry.RUN_TIMES), 'w') as f:
+            f.write('1000\n')
+        self.assertEqual(telemetry.read_walltime(self.dir), None)
+
+    def test_old_database(self):
+
+        db = os.path.join(self.dir, 'telemetry.db')
+        conn = sqlite3.connect(db)
+        conn.execute('create table runs (id integer primary key, experiment text, elapsed real, runtime real)')
+        conn.close()
+
+        conn = telemetry.connect(db)
+        self.assertTrue('walltime' in [c[1] for c in conn.execute('pragma table_info(runs)')])
+        conn.close()
+
+    def test_throughput(self):
+
+        sypd, chsy = telemetry.throughput(86400.0, 730, 100)
+        self.assertAlmostEqual(sypd, 2.0)
+        self.assertAlmostEqual(chsy, 1200.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+from timesteps import solve, common_period, check, apply
+from editsession import EditSession
+
+class TestTimesteps(unittest.TestCase):
+
+    def test_common_period(self):
+
+        self.assertEqual(common_period([21600, 86400*5]), 21600)
+        self.assertEqual(common_period([5400]), 5400)
+
+    def test_solve(self):
+        """
+        Every timestep divides the coupling timestep, largest first.
+        """
+
+        choices = solve(21600, 1800, 3600, 3600, min_timestep=60)
+        self.assertEqual(choices[0], (1800, 3600, 3600))
+        for ocn, ice, cpl in choices:
+            self.assertEqual(21600 % cpl, 0)
+            self.assertEqual(cpl % ocn, 0)
+            self.assertEqual(cpl % ice, 0)
+            self.assertTrue(60 <= ocn <= 1800 and 60 <= ice <= 3600 and cpl <= 3600)
+
+        self.assertEqual(solve(5400, 1800, 1800, 1800, min_timestep=60)[0], (1800, 1800, 1800))
+        self.assertEqual(solve(50, 1800, 1800, 1800, min_timestep=60), [])
+
+    def test_check(self):
+        """
+        Timesteps that don't fit are refused before anything is read or
+        changed.
+        """
+
+        self.assertEqual(check((1800, 3600, 3600), 21600, 86400), [])
+        self.assertEqual(len(check((700, 2400, 5000), 21600, 86000)), 4)
+
+        session = EditSession()
+        self.assertRaises(ValueError, apply, session, 'no-such-experiment', (1800, 2400, 5000), 'auscom', 21600, 86400)
+        self.assertEqual(session.files, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
 import sys
+import os
 import struct
 import numpy as np
 import argparse
 import netCDF4 as nc
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import ncoutput
+
 def read_header(file, print_it):
     """
     """
@@ -31,10 +35,12 @@ def read_field(file, nx, ny):
     buf = file.read(8*nx*ny)
     return np.reshape(struct.unpack('>'+str(nx*ny)+'d',buf),(ny,nx))
 
-def convert_to_netcdf(restart_file, output_file, config):
+def convert_to_netcdf(restart_file, output_file, config, output_options=None, buffer_mb=256):
     """
-    Convert a CICE restart file to netcdf.
+    Convert a CICE restart file to netcdf. 'output_options' are passed to
+    ncoutput.create_variable().
     """
+    output_options = dict(output_options or {})
     nx = config['nx']
     ny = config['ny']
 
@@ -48,22 +54,25 @@ def convert_to_netcdf(restart_file, output_file, config):
 
     # FIXME: improve variable names and add descriptions.
     for var in ['aicen', 'vicen', 'vsnon', 'trcrn']:
-        v = f_ice.createVariable(var, 'f8', dimensions=('num_ice_cat', 'ny', 'nx'))
-        for n in range(config['num_ice_cat']):
-            v[n,:,:] = read_field(restart_file, nx, ny)
-
-    eicen = f_ice.createVariable('eicen', 'f8', dimensions=('num_ice_layers', 'ny', 'nx'))
-    for n in range(config['num_ice_layers']):
-        eicen[n,:,:] = read_field(restart_file, nx, ny)
-    esnon = f_ice.createVariable('esnon', 'f8', dimensions=('num_snow_layers', 'ny', 'nx'))
-    for n in range(config['num_snow_layers']):
-        esnon[n,:,:] = read_field(restart_file, nx, ny)
+        v = ncoutput.create_variable(f_ice, var, 'f8', ('num_ice_cat', 'ny', 'nx'), **output_options)
+        with ncoutput.SlabWriter(v, buffer_mb) as w:
+            for n in range(config['num_ice_cat']):
+                w.write(n, read_field(restart_file, nx, ny))
+
+    eicen = ncoutput.create_variable(f_ice, 'eicen', 'f8', ('num_ice_layers', 'ny', 'nx'), **output_options)
+    with ncoutput.SlabWriter(eicen, buffer_mb) as w:
+        for n in range(config['num_ice_layers']):
+            w.write(n, read_field(restart_file, nx, ny))
+    esnon = ncoutput.create_variable(f_ice, 'esnon', 'f8', ('num_snow_layers', 'ny', 'nx'), **output_options)
+    with ncoutput.SlabWriter(esnon, buffer_mb) as w:
+        for n in range(config['num_snow_layers']):
+            w.write(n, read_field(restart_file, nx, ny))
 
     vars = ['uvel', 'vvel', 'scale_factor', 'swvdr', 'swvdf', 'swir', 'swif', 'strocnxT', 'strocnyT', \
             'stressp_1', 'stressp_2', 'stressp_3', 'stressp_4', 'stressm_1', 'stressm_2', 'stressm_3',\
             'stressm_4', 'stress12_1', 'stress12_2', 'stress12_3', 'sstress12_4', 'iceumask']
     for var in vars:
-        v = f_ice.createVariable(var, 'f8', dimensions=('ny', 'nx'))
+        v = ncoutput.create_variable(f_ice, var, 'f8', ('ny', 'nx'), **output_options)
         v[:,:] = read_field(restart_file, nx, ny)
 
     f_ice.close()
@@ -79,6 +88,7 @@ def main():
     parser.add_argument("--num_ice_cat", default=5, type=int, help="The number of ice categories.")
     parser.add_argument("--num_ice_layers", default=4, type=int, help="The number of ice layers.")
     parser.add_argument("--num_snow_layers", default=1, type=int, help="The number of snow layers.")
+    ncoutput.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -95,7 +105,7 @@ def main():
 
     file = open(args.input, 'rb')
     read_header(file, args.print_header)
-    convert_to_netcdf(file, output, config)
+    convert_to_netcdf(file, output, config, ncoutput.options(args), args.buffer_mb)
     file.close()
 
 if __name__ == '__main__':
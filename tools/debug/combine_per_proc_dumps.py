@@ -7,6 +7,9 @@ import os
 import argparse
 import netCDF4 as nc
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import ncoutput
+
 """
 Combine per-proc dumps into a single global field.
 """
@@ -16,6 +19,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('var_name', help='Name of the variable to combine.')
     parser.add_argument('--path', help='Path to directory where all the inputs are found.')
+    ncoutput.add_arguments(parser)
     args = parser.parse_args()
 
     if not args.path:
@@ -33,23 +37,31 @@ def main():
     output.createDimension('ny', 1080)
     output.createDimension('time', time_pts)
     output.createVariable('time', 'f8', ('time'))
-    output.createVariable(args.var_name, 'f8', ('time', 'ny', 'nx'))
-
-    # Open each file in turn, copy over each slab to the output. 
-    cpu_id = 0
-    for j in range(30):
-        for i in range(32):
-            input_name = '{}.{}.nc'.format(os.path.join(args.path, args.var_name), str(cpu_id).zfill(6))
-            print('combining {}'.format(input_name))
-            with nc.Dataset(input_name) as f:
-                x_start = i * 45
-                x_end = ((i + 1) * 45)
-                y_start = j * 36
-                y_end = ((j + 1) * 36)
-                # Not that we need to exclude halos in the input. 
-                output.variables[args.var_name][:,y_start:y_end,x_start:x_end] = f.variables[args.var_name][:,1:-1,1:-1]
-            cpu_id += 1
-        
+    var = ncoutput.create_variable(output, args.var_name, 'f8', ('time', 'ny', 'nx'), **ncoutput.options(args))
+
+    # Copy over a block of timesteps at a time so that the output is written
+    # in a few large pieces rather than one small slab per input.
+    writer = ncoutput.SlabWriter(var, args.buffer_mb)
+    for t_start in range(0, time_pts, writer.block_records):
+        t_end = min(t_start + writer.block_records, time_pts)
+
+        # Open each file in turn, copy over each slab to the output. 
+        cpu_id = 0
+        for j in range(30):
+            for i in range(32):
+                input_name = '{}.{}.nc'.format(os.path.join(args.path, args.var_name), str(cpu_id).zfill(6))
+                print('combining {}'.format(input_name))
+                with nc.Dataset(input_name) as f:
+                    x_start = i * 45
+                    x_end = ((i + 1) * 45)
+                    y_start = j * 36
+                    y_end = ((j + 1) * 36)
+                    # Not that we need to exclude halos in the input. 
+                    writer.write((slice(t_start, t_end), slice(y_start, y_end), slice(x_start, x_end)),
+                                 f.variables[args.var_name][t_start:t_end,1:-1,1:-1])
+                cpu_id += 1
+
+    writer.flush()
     output.close()
 
     return 0
@@ -7,6 +7,9 @@ import argparse
 import numpy as np
 import netCDF4 as nc
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import ncoutput
+
 """
 Combine per-procs output files into a single netcdf file.
 """
@@ -19,6 +22,7 @@ def main():
     parser.add_argument('y_procs', help='The number of procs in the y direction.')
     parser.add_argument('--dir', help='The directory containing input files.', default='./')
     parser.add_argument('--verbose', help='Print progress.', action='store_true')
+    ncoutput.add_arguments(parser)
     args = parser.parse_args()
         
     postfix = '.nc'
@@ -44,42 +48,49 @@ def main():
     output.createDimension('x', x_dim * x_procs)
     output.createDimension('y', y_dim * y_procs)
     output.createDimension('t', t_dim)
-    output.createVariable(args.var, 'f', ('t', 'y', 'x'))
+    var = ncoutput.create_variable(output, args.var, 'f', ('t', 'y', 'x'), **ncoutput.options(args))
 
     # Number of digits in the input file number.
     digits = len(input_files[0]) - len(args.var) - len('.') - len(postfix)
 
-    fnum = 0
-    y_start = 0
-    not_zero = False
-    for y in range(y_procs):
+    # Copy a block of timesteps at a time so that the output is written in a
+    # few large pieces rather than one small slab per input.
+    writer = ncoutput.SlabWriter(var, args.buffer_mb)
+    for t_start in range(0, t_dim, writer.block_records):
+        t_end = min(t_start + writer.block_records, t_dim)
+
+        fnum = 0
+        y_start = 0
+        for y in range(y_procs):
 
-        x_start = 0
-        for x in range(x_procs):
+            x_start = 0
+            for x in range(x_procs):
 
-            # Construct the filename for this proc, open it and copy to output file.
-            basename = args.var + '.' + str(fnum).zfill(digits) + postfix
-            filename = os.path.join(args.dir, basename)
+                # Construct the filename for this proc, open it and copy to output file.
+                basename = args.var + '.' + str(fnum).zfill(digits) + postfix
+                filename = os.path.join(args.dir, basename)
 
-            if args.verbose:
-                print 'Processing %s' % filename
+                if args.verbose:
+                    print 'Processing %s' % filename
 
-            if not os.path.exists(filename):
-                sys.stderr.write('File %s, not found' % filename)
-                output.close()
-                return 1
+                if not os.path.exists(filename):
+                    sys.stderr.write('File %s, not found' % filename)
+                    output.close()
+                    return 1
 
-            input_file = nc.Dataset(filename)
-            assert((len(input_file.dimensions['x']) == x_dim) and (len(input_file.dimensions['y']) == y_dim))
-            output.variables[args.var][:,y_start:(y_start + y_dim),x_start:(x_start + x_dim)] = input_file.variables[args.var][:,:,:]
-            input_file.close()
+                input_file = nc.Dataset(filename)
+                assert((len(input_file.dimensions['x']) == x_dim) and (len(input_file.dimensions['y']) == y_dim))
+                writer.write((slice(t_start, t_end), slice(y_start, y_start + y_dim), slice(x_start, x_start + x_dim)),
+                             input_file.variables[args.var][t_start:t_end,:,:])
+                input_file.close()
 
-            fnum = fnum + 1
+                fnum = fnum + 1
 
-            x_start = x_start + x_dim
+                x_start = x_start + x_dim
 
-        y_start = y_start + y_dim
+            y_start = y_start + y_dim
 
+    writer.flush()
     output.close()
 
 if __name__ == "__main__":
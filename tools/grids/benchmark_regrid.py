@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+import sys, os
+import argparse
+import json
+import time
+import resource
+import platform
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+import netCDF4 as nc
+import numpy as np
+
+import regrid
+
+"""
+Benchmark regrid.py on synthetic grids of increasing resolution.
+
+Regular and tripolar grids are generated in the format read by
+regrid.read_grid(), along with a synthetic field with several timesteps.
+Grid construction, weight generation, weight application and output writing
+are timed separately and the peak memory use of each case is reported. The
+results are written as JSON so that they can be compared between versions.
+"""
+
+# Where the two poles of the tripolar grid are (degrees east) and the
+# latitude at which the bipolar cap starts.
+TRIPOLE_LON = 80.0
+TRIPOLE_JOIN_LAT = 65.0
+
+def lonlat_to_xyz(lons, lats):
+    """
+    Unit vectors of points with the given longitudes and latitudes (in
+    degrees). The result has an extra last dimension of size 3.
+    """
+
+    lons = np.deg2rad(lons)
+    lats = np.deg2rad(lats)
+
+    return np.stack((np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)), axis=-1)
+
+def xyz_to_lonlat(xyz):
+    """
+    Inverse of lonlat_to_xyz(), longitudes are between 0 and 360.
+    """
+
+    xyz = xyz / np.linalg.norm(xyz, axis=-1)[..., np.newaxis]
+    lons = np.rad2deg(np.arctan2(xyz[..., 1], xyz[..., 0])) % 360.0
+    lats = np.rad2deg(np.arcsin(np.clip(xyz[..., 2], -1.0, 1.0)))
+
+    return lons, lats
+
+def slerp(a, b, t):
+    """
+    Points a fraction 't' of the way along the great circles from unit
+    vectors 'a' to 'b'.
+    """
+
+    t = np.asarray(t)[..., np.newaxis]
+    dot = np.clip(np.sum(a*b, axis=-1), -1.0, 1.0)[..., np.newaxis]
+    omega = np.arccos(dot)
+    sin_omega = np.sin(omega)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = (np.sin((1 - t)*omega)*a + np.sin(t*omega)*b) / sin_omega
+    # Where the end points are the same.
+    return np.where(sin_omega > 1e-12, p, a*np.ones_like(p))
+
+def regular_nodes(res):
+    """
+    Cell corners of a regular grid with spacing 'res' degrees, as unit
+    vectors with shape (ny + 1, nx + 1, 3).
+    """
+
+    nx = int(round(360.0 / res))
+    ny = int(round(180.0 / res))
+    lons, lats = np.meshgrid(np.linspace(0.0, 360.0, nx + 1), np.linspace(-90.0, 90.0, ny + 1))
+
+    return lonlat_to_xyz(lons, lats)
+
+def tripolar_nodes(res):
+    """
+    Cell corners of a tripolar grid with nominal spacing 'res' degrees. South
+    of TRIPOLE_JOIN_LAT the grid is regular, to the north there is a bipolar
+    cap with poles on the join latitude at TRIPOLE_LON and TRIPOLE_LON + 180.
+    Grid lines in the cap are great circles from the join latitude to the
+    fold between the two poles.
+    """
+
+    nodes = regular_nodes(res)
+    ny = nodes.shape[0] - 1
+    nx = nodes.shape[1] - 1
+    join = int(round((TRIPOLE_JOIN_LAT + 90.0) / res))
+    num_cap = ny - join
+
+    lons = np.linspace(0.0, 360.0, nx + 1)
+    start = lonlat_to_xyz(lons, np.ones_like(lons)*TRIPOLE_JOIN_LAT)
+
+    # The fold runs from one pole over the North Pole to the other, each
+    # column ends on it and the two halves of the grid meet there.
+    pole1 = lonlat_to_xyz(TRIPOLE_LON, TRIPOLE_JOIN_LAT)
+    pole2 = lonlat_to_xyz(TRIPOLE_LON + 180.0, TRIPOLE_JOIN_LAT)
+    t = ((lons - TRIPOLE_LON) % 360.0) / 180.0
+    t = np.where(t > 1.0, 2.0 - t, t)
+    end = slerp(pole1[np.newaxis, :], pole2[np.newaxis, :], t)
+
+    for k in range(1, num_cap + 1):
+        nodes[join + k, :, :] = slerp(start, end, float(k) / num_cap)
+
+    return nodes
+
+def make_grid_arrays(nodes):
+    """
+    Cell centres and corners, in degrees, from corner nodes. The corners
+    have shape (4, ny, nx) and are ordered anti-clockwise from the south
+    west, as expected by regrid.read_grid().
+    """
+
+    corners = np.stack((nodes[:-1, :-1], nodes[:-1, 1:], nodes[1:, 1:], nodes[1:, :-1]))
+    lons, lats = xyz_to_lonlat(np.sum(corners, axis=0))
+    clons, clats = xyz_to_lonlat(corners)
+
+    return lons, lats, clons, clats
+
+def write_grid(filename, kind, res):
+    """
+    Write a synthetic grid of type 'kind', 'regular' or 'tripolar', to
+    'filename'. Variables are named as in a CICE grid and are in radians.
+    Returns the grid definition tuple used by regrid.py.
+    """
+
+    if kind == 'regular':
+        nodes = regular_nodes(res)
+    else:
+        assert(kind == 'tripolar')
+        nodes = tripolar_nodes(res)
+    lons, lats, clons, clats = make_grid_arrays(nodes)
+
+    with nc.Dataset(filename, 'w') as f:
+        f.createDimension('nx', lons.shape[1])
+        f.createDimension('ny', lons.shape[0])
+        f.createDimension('nc', 4)
+        for name, data, dims in [('tlon', lons, ('ny', 'nx')), ('tlat', lats, ('ny', 'nx')),
+                                 ('clon_t', clons, ('nc', 'ny', 'nx')), ('clat_t', clats, ('nc', 'ny', 'nx'))]:
+            var = f.createVariable(name, 'f8', dims)
+            var.units = 'radians'
+            var[:] = np.deg2rad(data)
+
+    return (filename, 'tlon', 'tlat', 'clon_t', 'clat_t')
+
+def write_field(filename, grid_def, field_name, num_times):
+    """
+    Write a synthetic field with 'num_times' timesteps on the grid 'grid_def'.
+    """
+
+    with nc.Dataset(grid_def[0]) as g:
+        lons = np.rad2deg(g.variables[grid_def[1]][:])
+        lats = np.rad2deg(g.variables[grid_def[2]][:])
+    field = regrid.analytic_field(lons, lats)
+
+    with nc.Dataset(filename, 'w') as f:
+        f.createDimension('nx', lons.shape[1])
+        f.createDimension('ny', lons.shape[0])
+        f.createDimension('time', None)
+        f.createVariable('time', 'f8', ('time'))[:] = np.arange(num_times)
+        var = f.createVariable(field_name, 'f8', ('time', 'ny', 'nx'), chunksizes=(1,) + lons.shape)
+        for t in range(num_times):
+            var[t, :, :] = field*(1.0 + 0.1*np.sin(2*np.pi*t/num_times))
+
+def peak_memory_mb():
+    """
+    Peak resident memory of this process in MB.
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, OS X reports bytes.
+    if sys.platform == 'darwin':
+        return peak / 1024.0**2
+    return peak / 1024.0
+
+def generate_weights(src_def, dest_def, method, weights_file):
+    """
+    Generate weights between two open grids and save them to 'weights_file'.
+    """
+
+    if method != 'conserve':
+        regrid.write_weights(weights_file, regrid.kdtree_weights(src_def, dest_def, method), method)
+        return
+
+    src_grid, dest_grid, src_field, dest_field, src_frac, dest_frac, src_area, dest_area = \
+        regrid.setup_grid_and_fields(src_def, dest_def)
+    esmf_weights_file = weights_file + '.esmf'
+    routehandle = regrid.make_routehandle(src_field, dest_field, src_frac, dest_frac, esmf_weights_file)
+    regrid.save_weights(weights_file, esmf_weights_file, src_grid, dest_grid, src_frac, dest_frac, src_area, dest_area)
+
+    regrid.ESMP.ESMP_FieldRegridRelease(routehandle)
+    for field in [src_field, dest_field, src_frac, dest_frac, src_area, dest_area]:
+        regrid.ESMP.ESMP_FieldDestroy(field)
+    regrid.ESMP.ESMP_GridDestroy(src_grid)
+    regrid.ESMP.ESMP_GridDestroy(dest_grid)
+
+def run_case(case):
+    """
+    Run one benchmark case, this is done in a separate process so that the
+    peak memory is that of the case alone. Returns a dictionary of results.
+    """
+
+    src_kind, dest_kind, res, method, num_times, chunk_size, work_dir = case
+    name = '%s_to_%s_%sdeg' % (src_kind, dest_kind, res)
+    prefix = os.path.join(work_dir, name)
+    timings = {}
+
+    # Synthetic inputs, this isn't part of regrid.py so is only reported.
+    start = time.time()
+    src_def = write_grid(prefix + '_src_grid.nc', src_kind, res)
+    dest_def = write_grid(prefix + '_dest_grid.nc', dest_kind, res)
+    write_field(prefix + '_src_field.nc', src_def, 'field', num_times)
+    timings['synthesise'] = time.time() - start
+
+    src_grid_file = nc.Dataset(src_def[0])
+    dest_grid_file = nc.Dataset(dest_def[0])
+    src_def = (src_grid_file,) + src_def[1:]
+    dest_def = (dest_grid_file,) + dest_def[1:]
+
+    start = time.time()
+    src_grid = regrid.read_grid(src_def)
+    dest_grid = regrid.read_grid(dest_def)
+    regrid.grid_hash(src_grid)
+    regrid.grid_hash(dest_grid)
+    timings['grid'] = time.time() - start
+    dest_shape = dest_grid[0].shape
+
+    weights_file = prefix + '_weights.nc'
+    start = time.time()
+    generate_weights(src_def, dest_def, method, weights_file)
+    timings['weights'] = time.time() - start
+
+    start = time.time()
+    weights = regrid.read_weights(weights_file)
+    matrix = regrid.weights_matrix(weights)
+    timings['load'] = time.time() - start
+
+    # Read, apply and write each chunk, timing them separately.
+    timings['read'] = 0.0
+    timings['apply'] = 0.0
+    timings['write'] = 0.0
+    src_file = nc.Dataset(prefix + '_src_field.nc')
+    src_vars, missing_values = regrid.open_src_fields(src_file, ['field'])
+    dest_file, dest_vars = regrid.create_dest_file(prefix + '_dest_field.nc', ['field'], dest_shape, missing_values)
+    for chunk_start in range(0, num_times, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, num_times)
+
+        start = time.time()
+        src_chunk, valid = regrid.read_chunk(src_vars, chunk_start, chunk_end, missing_values)
+        timings['read'] += time.time() - start
+
+        start = time.time()
+        dest_chunk = regrid.regrid_saved(matrix, weights, src_chunk, valid)
+        timings['apply'] += time.time() - start
+
+        start = time.time()
+        dest_vars[0][chunk_start:chunk_end, :, :] = dest_chunk.reshape((chunk_end - chunk_start,) + dest_shape)
+        dest_file.sync()
+        timings['write'] += time.time() - start
+
+    src_file.close()
+    dest_file.close()
+    src_grid_file.close()
+    dest_grid_file.close()
+
+    if method == 'conserve':
+        regrid.ESMP.ESMP_Finalize()
+
+    return {'name' : name, 'src_grid' : src_kind, 'dest_grid' : dest_kind,
+            'resolution' : res, 'method' : method, 'src_shape' : list(src_grid[0].shape),
+            'dest_shape' : list(dest_shape), 'num_times' : num_times,
+            'num_links' : len(weights['remap_matrix']), 'timings' : timings,
+            'peak_memory_mb' : peak_memory_mb()}
+
+def regrid_version():
+    """
+    The git version of regrid.py, or None if it can't be found.
+    """
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.realpath(regrid.__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolutions", default='1,0.25,0.1', help="Comma separated grid spacings \
+                                                                      in degrees, defaults to 1,0.25,0.1.")
+    parser.add_argument("--src_grid", default='regular', choices=['regular', 'tripolar'],
+                        help="The type of source grid, defaults to regular.")
+    parser.add_argument("--dest_grid", default='tripolar', choices=['regular', 'tripolar'],
+                        help="The type of destination grid, defaults to tripolar.")
+    parser.add_argument("--method", default=None, choices=['conserve', 'nearest', 'bilinear'],
+                        help="The regridding method, defaults to conserve if ESMP is available, \
+                              otherwise bilinear.")
+    parser.add_argument("--num_times", default=8, type=int, help="The number of timesteps in the \
+                                                                   synthetic field, defaults to 8.")
+    parser.add_argument("--chunk_size", default=4, type=int, help="The number of timesteps regridded \
+                                                                    at once, defaults to 4.")
+    parser.add_argument("--work_dir", default=None, help="Where to write grids, fields and weights. \
+                                                          Defaults to a temporary directory which is removed.")
+    parser.add_argument("--output", default='benchmark_regrid.json', help="The JSON results file, \
+                                                                           defaults to benchmark_regrid.json.")
+
+    args = parser.parse_args()
+
+    method = args.method
+    if method is None:
+        method = 'conserve' if regrid.ESMP is not None else 'bilinear'
+    if method == 'conserve' and regrid.ESMP is None:
+        sys.stderr.write("ESMP is needed for the conserve method.\n")
+        return 1
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='benchmark_regrid')
+    elif not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    # A new process for each case, so memory use is independent.
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    results = []
+    try:
+        for res in [float(r) for r in args.resolutions.split(',')]:
+            case = (args.src_grid, args.dest_grid, res, method, args.num_times, args.chunk_size, work_dir)
+            result = pool.apply(run_case, [case])
+            results.append(result)
+
+            print '%s:' % result['name']
+            for name in ['synthesise', 'grid', 'weights', 'load', 'read', 'apply', 'write']:
+                print "       %-12s= %.3fs" % (name, result['timings'][name])
+            print "       %-12s= %.1fMB" % ('peak memory', result['peak_memory_mb'])
+    finally:
+        pool.close()
+        pool.join()
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump({'regrid_version' : regrid_version(), 'host' : platform.node(),
+                   'date' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'results' : results},
+                  f, indent=4, sort_keys=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
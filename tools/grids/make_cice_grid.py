@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
 import sys
+import os
 import argparse
 import netCDF4 as nc
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import ncoutput
+
 """
 Make a new CICE grid using a MOM5 ocean grid.
 
@@ -32,8 +36,10 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--ocean", help="The input ocean grid.", default='ocean_hgrid.nc')
     parser.add_argument("--ice", help="The output ice grid.", default='ice_grid.nc') 
+    ncoutput.add_arguments(parser)
 
     args = parser.parse_args()
+    output_options = ncoutput.options(args)
 
     # Ocean grid. The new CICE grid is based on this.
     f_ocn = nc.Dataset(args.ocean, 'r')
@@ -50,34 +56,34 @@ def main():
     f_ice_w.createDimension('nc', 4)
 
     # All CICE grid variables. 
-    ulat = f_ice_w.createVariable('ulat', 'f8', dimensions=('ny', 'nx'))
+    ulat = ncoutput.create_variable(f_ice_w, 'ulat', 'f8', ('ny', 'nx'), **output_options)
     ulat.units = "radians"
     ulat.title = "Latitude of U points"
-    ulon = f_ice_w.createVariable('ulon', 'f8', dimensions=('ny', 'nx'))
+    ulon = ncoutput.create_variable(f_ice_w, 'ulon', 'f8', ('ny', 'nx'), **output_options)
     ulon.units = "radians"
     ulon.title = "Longitude of U points"
-    tlat = f_ice_w.createVariable('tlat', 'f8', dimensions=('ny', 'nx'))
+    tlat = ncoutput.create_variable(f_ice_w, 'tlat', 'f8', ('ny', 'nx'), **output_options)
     tlat.units = "radians"
     tlat.title = "Latitude of T points"
-    tlon = f_ice_w.createVariable('tlon', 'f8', dimensions=('ny', 'nx'))
+    tlon = ncoutput.create_variable(f_ice_w, 'tlon', 'f8', ('ny', 'nx'), **output_options)
     tlon.units = "radians"
     tlon.title = "Longitude of T points"
-    htn = f_ice_w.createVariable('htn', 'f8', dimensions=('ny', 'nx'))
+    htn = ncoutput.create_variable(f_ice_w, 'htn', 'f8', ('ny', 'nx'), **output_options)
     htn.units = "cm"
     htn.title = "Width of T cells on North side."
-    hte = f_ice_w.createVariable('hte', 'f8', dimensions=('ny', 'nx'))
+    hte = ncoutput.create_variable(f_ice_w, 'hte', 'f8', ('ny', 'nx'), **output_options)
     hte.units = "cm"
     hte.title = "Width of T cells on East side."
-    angle = f_ice_w.createVariable('angle', 'f8', dimensions=('ny', 'nx'))
+    angle = ncoutput.create_variable(f_ice_w, 'angle', 'f8', ('ny', 'nx'), **output_options)
     angle.units = "radians"
     angle.title = "Rotation angle of U cells."
-    angleT = f_ice_w.createVariable('angleT', 'f8', dimensions=('ny', 'nx'))
+    angleT = ncoutput.create_variable(f_ice_w, 'angleT', 'f8', ('ny', 'nx'), **output_options)
     angleT.units = "radians"
     angleT.title = "Rotation angle of T cells."
-    tarea = f_ice_w.createVariable('tarea', 'f8', dimensions=('ny', 'nx'))
+    tarea = ncoutput.create_variable(f_ice_w, 'tarea', 'f8', ('ny', 'nx'), **output_options)
     tarea.units = "m^2"
     tarea.title = "Area of T cells."
-    uarea = f_ice_w.createVariable('uarea', 'f8', dimensions=('ny', 'nx'))
+    uarea = ncoutput.create_variable(f_ice_w, 'uarea', 'f8', ('ny', 'nx'), **output_options)
     uarea.units = "m^2"
     uarea.title = "Area of U cells."
 
@@ -1,11 +1,29 @@
 #!/usr/bin/env python
 
 import sys, os
+import shutil
 import argparse
 import ast
-import ESMP
+import glob
+import hashlib
+import time
+import threading
+import Queue
+import multiprocessing
+import collections
 import netCDF4 as nc
 import numpy as np
+import scipy.sparse
+import scipy.spatial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import ncoutput
+
+# ESMP is only needed to generate weights, saved weights can be applied without it.
+try:
+    import ESMP
+except ImportError:
+    ESMP = None
 
 """
 Regrid CICE inputs, based on ESMP tutorial at:
@@ -18,6 +36,16 @@ def find_nearest(a, val):
     """
     return np.abs(a[0,:,:] - val).argmin()
 
+def analytic_field(lons, lats):
+    """
+    Analytic test field evaluated at the given longitudes and latitudes (in degrees).
+    """
+
+    theta = np.deg2rad(lons)
+    phi = np.deg2rad(90.0 - lats)
+
+    return 2.0 + np.cos(theta)**2 * np.cos(2.0*phi)
+
 def build_analytic_field(field, grid, domask):
     '''
     PRECONDITIONS: An ESMP_Field has been created as 'field'.  'grid' has
@@ -27,36 +55,17 @@ def build_analytic_field(field, grid, domask):
     POSTCONDITIONS: The 'field' has been initialized to an analytic field.\n
     RETURN VALUES: \n ESMP_Field :: field \n
     '''
-    DEG2RAD = 3.141592653589793/180.0
 
     # get the field pointer
     fieldPtr = ESMP.ESMP_FieldGetPtr(field) 
-     
-    # get the grid bounds and coordinate pointers
-    exLB, exUB = ESMP.ESMP_GridGetCoord(grid, ESMP.ESMP_STAGGERLOC_CENTER)
-
-    # get the mask
-    if domask:
-        mask = ESMP.ESMP_GridGetItem(grid, item=ESMP.ESMP_GRIDITEM_MASK)
 
-    # get the coordinate pointers and set the coordinates
+    # get the coordinate pointers
     [x,y] = [0, 1]
     gridXCoord = ESMP.ESMP_GridGetCoordPtr(grid, x, ESMP.ESMP_STAGGERLOC_CENTER)
     gridYCoord = ESMP.ESMP_GridGetCoordPtr(grid, y, ESMP.ESMP_STAGGERLOC_CENTER)
 
-    p = 0 
-    for i1 in range(exLB[1], exUB[1]): 
-        for i0 in range(exLB[0], exUB[0]): 
-            theta = DEG2RAD*gridXCoord[p]
-            phi = DEG2RAD*(90.0 - gridYCoord[p])
-            fieldPtr[p] = 2.0 + np.cos(theta)**2 * np.cos(2.0*phi)
-            p = p + 1
+    fieldPtr[:] = analytic_field(gridXCoord[:], gridYCoord[:])
 
-    '''
-    theta = np.array(DEG2RAD*gridXCoord[:])
-    phi = np.array(DEG2RAD*(90. - gridYCoord[:]))
-    fieldPtr[:] = 2. + np.cos(theta[:])**2 * np.cos(2.*phi[:])
-    '''
     return field
 
 
@@ -73,24 +82,60 @@ def compute_mass(valuefield, areafield, fracfield, dofrac):
     RETURN VALUES: integer :: mass \n
     '''
 
-    mass = 0.0
     ESMP.ESMP_FieldRegridGetArea(areafield)
     area = ESMP.ESMP_FieldGetPtr(areafield)
     value = ESMP.ESMP_FieldGetPtr(valuefield)
-    frac = 0
+
     if dofrac:
         frac = ESMP.ESMP_FieldGetPtr(fracfield)
-
-    for i in range(valuefield.size):
-        if dofrac:
-            mass += area[i]*value[i]*frac[i]
-        else:
-            mass += area[i]*value[i]
+        mass = np.sum(area*value*frac)
+    else:
+        mass = np.sum(area*value)
 
     return (mass, area)
 
 
-def compare_fields(interp_field, exact_field, dstfracfield, srcmass, dstmass):
+def compute_mass_chunk(values, area, frac=None):
+    """
+    Compute the mass of each timestep in a chunk of fields. 'values' has
+    shape (ntimes, ...) with the remaining dimensions matching 'area' and
+    'frac'. Returns an array of ntimes masses.
+    """
+
+    cell_mass = area.flatten()
+    if frac is not None:
+        cell_mass = cell_mass*frac.flatten()
+
+    return np.dot(values.reshape(values.shape[0], cell_mass.size), cell_mass)
+
+
+def conservation_errors(src_mass, dest_mass):
+    """
+    Relative difference between source and destination masses, one per
+    timestep. Where the source mass is 0 the absolute difference is used.
+    """
+
+    errors = np.abs(dest_mass - src_mass)
+    nonzero = (src_mass != 0.0)
+    errors[nonzero] = errors[nonzero] / np.abs(src_mass[nonzero])
+
+    return errors
+
+
+def field_errors(interp, exact, dstfrac):
+    """
+    Error of 'interp' compared to 'exact' at every point. This is a relative
+    error except where 'exact' is 0.
+    """
+
+    errors = np.abs(interp/dstfrac - exact)
+    nonzero = (exact != 0.0)
+    errors[nonzero] = errors[nonzero] / np.abs(exact[nonzero])
+
+    return errors
+
+
+def compare_fields(interp_field, exact_field, dstfracfield, srcmass, dstmass, timings=None):
     '''
     PRECONDITIONS: 'interp_field' is a Field that holds the values resulting
                   from a regridding operation, 'exact_field' is a Field
@@ -102,8 +147,9 @@ def compare_fields(interp_field, exact_field, dstfracfield, srcmass, dstmass):
     POSTCONDITIONS: The interpolation accuracy of a regridding operation is
                   determined by comparing the 'interp_field' to the 
                   'exact_field'.  The mass conservation is validated by
-                  comparing the 'srcmass' to the 'dstmass'.\n
-    RETURN VALUES: None \n
+                  comparing the 'srcmass' to the 'dstmass'. 'timings' are
+                  reported along with the errors.\n
+    RETURN VALUES: bool :: passed \n
     '''
 
     vm = ESMP.ESMP_VMGetGlobal()
@@ -117,27 +163,29 @@ def compare_fields(interp_field, exact_field, dstfracfield, srcmass, dstmass):
     if (interp_field.size != exact_field.size):
         raise TypeError('compare_fields: Fields must be the same size!')
 
-    # initialize to True, and check for False point values
-    total_error = 0.0
-    max_error = 0.0
-    min_error = 1000000.0
-    for i in range(interp_field.size):
-        if (exact[i] != 0.0):
-            err = abs(interp[i]/dstfrac[i] - exact[i])/abs(exact[i])
-        else:
-            err = abs(interp[i]/dstfrac[i] - exact[i])
-        total_error = total_error + err
+    return report_errors(field_errors(interp, exact, dstfrac), srcmass, dstmass, timings)
+
+def report_errors(errors, srcmass, dstmass, timings=None):
+    """
+    Print a summary of regridding errors, conservation and optionally
+    timings, a list of (name, seconds) tuples.
+
+    Returns True if the interpolation and conservation errors are acceptable.
+    """
 
-        if (err > max_error): 
-            max_error = err
-        if (err < min_error): 
-            min_error = err
+    total_error = np.sum(errors)
+    max_error = np.max(errors)
+    min_error = np.min(errors)
 
-    # check the mass
+    # check the mass, this is skipped for weights that are not conservative.
     csrv = False
-    csrv_error = abs(dstmass - srcmass)/srcmass
-    if (csrv_error < 10e-12):
+    if srcmass is None or dstmass is None:
        csrv = True
+       csrv_error = None
+    else:
+       csrv_error = abs(dstmass - srcmass)/srcmass
+       if (csrv_error < 10e-12):
+          csrv = True
     itrp = False
     if (max_error < 10E-2):
         itrp = True
@@ -152,39 +200,987 @@ def compare_fields(interp_field, exact_field, dstfracfield, srcmass, dstmass):
     print "       Csrv error  = "+str(csrv_error)
     print "       srcmass     = "+str(srcmass)
     print "       dstmass     = "+str(dstmass)
+    if timings is not None:
+        for name, seconds in timings:
+            print "       %-12s= %.3fs" % (name, seconds)
   
-    return
+    return (itrp and csrv)
+
+def make_routehandle(srcfield, dstfield, srcfracfield, dstfracfield, filename=None):
+    """
+    Compute the conservative regridding weights between 'srcfield' and
+    'dstfield' and return the ESMP routehandle. This is the expensive part of
+    regridding and only needs to be done once per grid pair.
+
+    If 'filename' is given the weights are also written to that file (ESMF
+    format), provided the ESMP version supports it.
+    """
+
+    kwargs = {'srcMaskValues' : np.array([1], dtype=np.int32),
+              'dstMaskValues' : np.array([1], dtype=np.int32),
+              'regridmethod' : ESMP.ESMP_REGRIDMETHOD_CONSERVE,
+              'unmappedaction' : ESMP.ESMP_UNMAPPEDACTION_ERROR,
+              'srcFracField' : srcfracfield,
+              'dstFracField' : dstfracfield}
+
+    if filename is not None:
+        if hasattr(ESMP, 'ESMP_FieldRegridStoreFile'):
+            return ESMP.ESMP_FieldRegridStoreFile(srcfield, dstfield, filename, createRH=True, **kwargs)
+        else:
+            sys.stderr.write('WARNING: this version of ESMP can\'t write weights, they will not be saved.\n')
 
-def run_regridding(srcfield, dstfield, srcfracfield, dstfracfield):
+    return ESMP.ESMP_FieldRegridStore(srcfield, dstfield, **kwargs)
+
+def run_regridding(srcfield, dstfield, srcfracfield, dstfracfield, routehandle=None):
     '''
     PRECONDITIONS: Two ESMP_Fields have been created and a regridding operation 
                    is desired from 'srcfield' to 'dstfield'.  The 'srcfracfield'
                    and 'dstfractfield' are Fields created to hold
                    the fractions of the source and destination fields which 
-                   contribute to the regridding operation.\n
+                   contribute to the regridding operation. 'routehandle' is
+                   optional, if given it is reused, otherwise weights are
+                   computed and released within this call.\n
     POSTCONDITIONS: An ESMP regridding operation has set the data on 'dstfield', 
                     'srcfracfield', and 'dstfracfield'.\n
     RETURN VALUES: \n ESMP_Field :: dstfield \n ESMP_Field :: srcfracfield \n
                    ESMP_Field :: dstfracfield \n
     '''
+
+    if routehandle is not None:
+        ESMP.ESMP_FieldRegrid(srcfield, dstfield, routehandle)
+        return dstfield, srcfracfield, dstfracfield
+
     # call the regridding functions
-    routehandle = ESMP.ESMP_FieldRegridStore(srcfield, dstfield,
-                                             srcMaskValues=np.array([1], dtype=np.int32),
-                                             dstMaskValues=np.array([1], dtype=np.int32),
-                                             regridmethod=ESMP.ESMP_REGRIDMETHOD_CONSERVE,
-                                             unmappedaction=ESMP.ESMP_UNMAPPEDACTION_ERROR,
-                                             srcFracField=srcfracfield, 
-                                             dstFracField=dstfracfield)
+    routehandle = make_routehandle(srcfield, dstfield, srcfracfield, dstfracfield)
     ESMP.ESMP_FieldRegrid(srcfield, dstfield, routehandle)
     ESMP.ESMP_FieldRegridRelease(routehandle)
 
     return dstfield, srcfracfield, dstfracfield
 
-def make_grid(field_def, mask=None):
+def grid_hash(grid_arrays):
+    """
+    Return a hash of the grid centres and corners. Used as a key for saved
+    weights, these don't depend on the mask, see apply_masked().
     """
-    Define a grid
 
-    Use the cice grid. 
+    h = hashlib.sha1()
+    for a in grid_arrays:
+        h.update(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+
+    return h.hexdigest()
+
+def weights_filename(weights_dir, src_hash, dest_hash, method='conserve'):
+    """
+    Name of the weights file for a particular pair of grids.
+    """
+
+    return os.path.join(weights_dir, 'rmp_%s_to_%s_%s.nc' % (src_hash[:16], dest_hash[:16], method))
+
+def read_weights(filename):
+    """
+    Read a SCRIP weights file. ESMF format weights files are also understood.
+
+    Returns a dictionary keyed by the SCRIP variable names. Addresses are
+    converted to be zero-based. Fractions and areas are None if not present.
+    """
+
+    esmf_names = {'src_address' : 'col', 'dst_address' : 'row',
+                  'remap_matrix' : 'S', 'src_grid_size' : 'n_a',
+                  'dst_grid_size' : 'n_b', 'src_grid_frac' : 'frac_a',
+                  'dst_grid_frac' : 'frac_b', 'src_grid_area' : 'area_a',
+                  'dst_grid_area' : 'area_b'}
+
+    weights = {}
+    with nc.Dataset(filename) as f:
+        is_esmf = 'remap_matrix' not in f.variables
+
+        def name(n):
+            return esmf_names[n] if is_esmf else n
+
+        weights['src_grid_size'] = len(f.dimensions[name('src_grid_size')])
+        weights['dst_grid_size'] = len(f.dimensions[name('dst_grid_size')])
+        weights['src_address'] = np.array(f.variables[name('src_address')][:], dtype=np.int64) - 1
+        weights['dst_address'] = np.array(f.variables[name('dst_address')][:], dtype=np.int64) - 1
+
+        # Only the first weight is needed for first order conservative.
+        remap_matrix = np.array(f.variables[name('remap_matrix')][:], dtype=np.float64)
+        if len(remap_matrix.shape) == 2:
+            remap_matrix = remap_matrix[:, 0]
+        weights['remap_matrix'] = remap_matrix
+
+        for n in ['src_grid_frac', 'dst_grid_frac', 'src_grid_area', 'dst_grid_area']:
+            if name(n) in f.variables:
+                weights[n] = np.array(f.variables[name(n)][:], dtype=np.float64)
+            else:
+                weights[n] = None
+
+    return weights
+
+def write_weights(filename, weights, method='conserve'):
+    """
+    Write out weights (as returned by read_weights()) in SCRIP format.
+
+    Links are sorted by destination then source address so the file contents
+    do not depend on how the weights were generated.
+    """
+
+    order = np.lexsort((weights['src_address'], weights['dst_address']))
+
+    with nc.Dataset(filename, 'w') as f:
+        f.title = 'regrid.py weights'
+        f.map_method = method
+        f.normalization = 'destarea'
+        f.conventions = 'SCRIP'
+
+        f.createDimension('src_grid_size', weights['src_grid_size'])
+        f.createDimension('dst_grid_size', weights['dst_grid_size'])
+        f.createDimension('num_links', len(order))
+        f.createDimension('num_wgts', 1)
+
+        f.createVariable('src_address', 'i4', ('num_links'))
+        f.createVariable('dst_address', 'i4', ('num_links'))
+        f.createVariable('remap_matrix', 'f8', ('num_links', 'num_wgts'))
+        f.variables['src_address'][:] = weights['src_address'][order] + 1
+        f.variables['dst_address'][:] = weights['dst_address'][order] + 1
+        f.variables['remap_matrix'][:, 0] = weights['remap_matrix'][order]
+
+        for n, dim in [('src_grid_frac', 'src_grid_size'), ('dst_grid_frac', 'dst_grid_size'),
+                       ('src_grid_area', 'src_grid_size'), ('dst_grid_area', 'dst_grid_size')]:
+            if weights[n] is not None:
+                f.createVariable(n, 'f8', (dim))
+                f.variables[n][:] = weights[n]
+
+# Seconds PET 0 waits for the other PETs in gather_fields().
+GATHER_TIMEOUT = 600
+
+def gather_tag(filename, pet_count):
+    """
+    A tag that is the same on every PET in this run and differs from other
+    runs, made from the modification time of 'filename', which the PETs have
+    just written together, and the number of PETs. ESMP has no broadcast to
+    send one from PET 0.
+    """
+
+    return '%sp%d' % (pet_count, int(os.stat(filename).st_mtime*1e6))
+
+def remove_parts(tmp_prefix, keep_tag=None):
+    """
+    Remove the part files written by gather_fields() for 'tmp_prefix',
+    except those tagged 'keep_tag'.
+    """
+
+    for part in glob.glob('%s.*.part*.npz*' % tmp_prefix):
+        if keep_tag is not None and part.startswith('%s.%s.part' % (tmp_prefix, keep_tag)):
+            continue
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+
+def gather_fields(fields, grid, tmp_prefix, tag):
+    """
+    Gather ESMP fields, which may be decomposed across PETs, onto PET 0.
+    Each PET writes its part of the fields to a temporary file beginning with
+    'tmp_prefix' and 'tag', see gather_tag(), PET 0 waits for all of the parts
+    and puts them together. Parts left by other runs are removed by PET 0
+    and never read. PET 0 gives up with an IOError if a part hasn't turned
+    up after GATHER_TIMEOUT seconds, e.g. because that PET has died.
+
+    Returns a list of flattened global arrays on PET 0 and None on other PETs.
+    """
+
+    local_pet, pet_count = initialise_esmp()
+    local = [np.copy(ESMP.ESMP_FieldGetPtr(f)) for f in fields]
+    if pet_count == 1:
+        return local
+
+    lb, ub = ESMP.ESMP_GridGetCoord(grid, ESMP.ESMP_STAGGERLOC_CENTER)
+
+    # Write to a temporary name and rename so that PET 0 never sees a partial file.
+    part = '%s.%s.part%s.npz' % (tmp_prefix, tag, local_pet)
+    with open(part + '.tmp', 'wb') as f:
+        np.savez(f, lb, ub, *local)
+    os.rename(part + '.tmp', part)
+
+    if local_pet != 0:
+        return None
+
+    remove_parts(tmp_prefix, keep_tag=tag)
+
+    parts = []
+    deadline = time.time() + GATHER_TIMEOUT
+    for pet in range(pet_count):
+        part = '%s.%s.part%s.npz' % (tmp_prefix, tag, pet)
+        while not os.path.exists(part):
+            if time.time() > deadline:
+                remove_parts(tmp_prefix)
+                raise IOError('gather_fields: no part from PET %s after %s seconds, expected %s' %
+                              (pet, GATHER_TIMEOUT, part))
+            time.sleep(1)
+        with np.load(part) as p:
+            parts.append([p['arr_%s' % i] for i in range(len(fields) + 2)])
+        os.remove(part)
+
+    ny = max([p[1][1] for p in parts])
+    nx = max([p[1][0] for p in parts])
+    gathered = [np.empty((ny, nx)) for f in fields]
+    for p in parts:
+        lb, ub = p[0], p[1]
+        for i, a in enumerate(gathered):
+            a[lb[1]:ub[1], lb[0]:ub[0]] = p[i + 2].reshape(ub[1] - lb[1], ub[0] - lb[0])
+
+    return [a.flatten() for a in gathered]
+
+def save_weights(filename, esmf_filename, src_grid, dest_grid, src_frac, dest_frac, src_area, dest_area):
+    """
+    Convert weights written by ESMP to a SCRIP weights file. Fractions and
+    areas are taken from the ESMP fields used to generate the weights.
+
+    This must be called on all PETs, the file is written by PET 0. Links are
+    sorted by write_weights() so the result does not depend on the number of
+    PETs.
+    """
+
+    ESMP.ESMP_FieldRegridGetArea(src_area)
+    ESMP.ESMP_FieldRegridGetArea(dest_area)
+    tag = gather_tag(esmf_filename, initialise_esmp()[1])
+    src_arrays = gather_fields([src_frac, src_area], src_grid, filename + '.src', tag)
+    dest_arrays = gather_fields([dest_frac, dest_area], dest_grid, filename + '.dest', tag)
+
+    local_pet, _ = initialise_esmp()
+    if local_pet != 0:
+        return
+
+    weights = read_weights(esmf_filename)
+    weights['src_grid_frac'], weights['src_grid_area'] = src_arrays
+    weights['dst_grid_frac'], weights['dst_grid_area'] = dest_arrays
+
+    # Write to a temporary file first so that an interrupted run doesn't
+    # leave a partial weights file behind.
+    tmp_filename = filename + '.tmp'
+    write_weights(tmp_filename, weights)
+    os.rename(tmp_filename, filename)
+    os.remove(esmf_filename)
+
+def weights_matrix(weights):
+    """
+    Build a sparse (dst_grid_size x src_grid_size) matrix from weights read
+    with read_weights().
+    """
+
+    return scipy.sparse.csr_matrix((weights['remap_matrix'],
+                                    (weights['dst_address'], weights['src_address'])),
+                                   shape=(weights['dst_grid_size'], weights['src_grid_size']))
+
+def apply_weights(matrix, src):
+    """
+    Regrid a chunk of timesteps with a single sparse matrix multiply.
+
+    'src' has shape (ntimes, ny, nx), the result has shape (ntimes, dst_grid_size).
+    """
+
+    src = src.reshape(src.shape[0], matrix.shape[1])
+    return matrix.dot(src.T).T
+
+def unit_vectors(lons, lats):
+    """
+    Cartesian coordinates on the unit sphere of points with the given
+    longitudes and latitudes (in degrees). Returns an array of shape
+    (npoints, 3). Distances between these don't depend on the longitude
+    convention so periodicity is handled for free.
+    """
+
+    lons = np.deg2rad(np.asarray(lons, dtype=np.float64).flatten())
+    lats = np.deg2rad(np.asarray(lats, dtype=np.float64).flatten())
+
+    return np.column_stack((np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)))
+
+def make_weights(src_address, dst_address, remap_matrix, src_grid_size, dst_grid_size):
+    """
+    Put together a weights dictionary in the same form as read_weights().
+    """
+
+    return {'src_address' : src_address, 'dst_address' : dst_address,
+            'remap_matrix' : remap_matrix, 'src_grid_size' : src_grid_size,
+            'dst_grid_size' : dst_grid_size, 'src_grid_frac' : None,
+            'dst_grid_frac' : None, 'src_grid_area' : None,
+            'dst_grid_area' : None}
+
+def nearest_weights(src_lons, src_lats, dest_lons, dest_lats, src_mask=None):
+    """
+    Nearest neighbour weights. Each destination point takes the value of the
+    closest unmasked source cell centre.
+    """
+
+    src_points = np.arange(src_lons.size)
+    if src_mask is not None:
+        src_points = np.flatnonzero(~np.asarray(src_mask, dtype=bool).flatten())
+
+    tree = scipy.spatial.cKDTree(unit_vectors(src_lons, src_lats)[src_points])
+    _, nearest = tree.query(unit_vectors(dest_lons, dest_lats))
+
+    return make_weights(src_points[nearest], np.arange(dest_lons.size),
+                        np.ones(dest_lons.size), src_lons.size, dest_lons.size)
+
+def inverse_bilinear(x, y, iterations=8):
+    """
+    Find the bilinear coordinates (s, t) of the origin in each of the quads
+    with corners 'x' and 'y', arrays of shape (nquads, 4). Uses Newton's
+    method, the origin is inside a quad if both s and t are between 0 and 1.
+    """
+
+    ax, bx, cx, dx = x[:, 0], x[:, 1] - x[:, 0], x[:, 3] - x[:, 0], x[:, 0] - x[:, 1] + x[:, 2] - x[:, 3]
+    ay, by, cy, dy = y[:, 0], y[:, 1] - y[:, 0], y[:, 3] - y[:, 0], y[:, 0] - y[:, 1] + y[:, 2] - y[:, 3]
+
+    s = np.ones(x.shape[0])*0.5
+    t = np.ones(x.shape[0])*0.5
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            fx = ax + bx*s + cx*t + dx*s*t
+            fy = ay + by*s + cy*t + dy*s*t
+            dxds, dxdt = bx + dx*t, cx + dx*s
+            dyds, dydt = by + dy*t, cy + dy*s
+            det = dxds*dydt - dxdt*dyds
+            s = s - (fx*dydt - dxdt*fy)/det
+            t = t - (dxds*fy - dyds*fx)/det
+
+    return s, t
+
+def bilinear_weights(src_lons, src_lats, dest_lons, dest_lats, src_mask=None):
+    """
+    Bilinear weights. The source cell centres are the corners of the
+    interpolation quads, the quad containing a destination point is one of
+    the four around its nearest source centre. Destination points that are
+    not inside a quad, e.g. beyond the last row of centres or next to masked
+    points, fall back to nearest neighbour.
+    """
+
+    ny, nx = src_lons.shape
+    src_xyz = unit_vectors(src_lons, src_lats)
+    dest_xyz = unit_vectors(dest_lons, dest_lats)
+    ndest = dest_xyz.shape[0]
+    if src_mask is not None:
+        src_mask = np.asarray(src_mask, dtype=bool).flatten()
+
+    _, nearest = scipy.spatial.cKDTree(src_xyz).query(dest_xyz)
+    nearest_j, nearest_i = np.unravel_index(nearest, (ny, nx))
+
+    # Quads are projected onto the plane tangent to the sphere at the
+    # destination point, so the destination point is at the origin.
+    lons = np.deg2rad(np.asarray(dest_lons, dtype=np.float64).flatten())
+    lats = np.deg2rad(np.asarray(dest_lats, dtype=np.float64).flatten())
+    east = np.column_stack((-np.sin(lons), np.cos(lons), np.zeros(ndest)))
+    north = np.column_stack((-np.sin(lats)*np.cos(lons), -np.sin(lats)*np.sin(lons), np.cos(lats)))
+
+    found = np.zeros(ndest, dtype=bool)
+    corners = np.zeros((ndest, 4), dtype=np.int64)
+    s = np.zeros(ndest)
+    t = np.zeros(ndest)
+    eps = 1e-10
+
+    for di, dj in [(-1, -1), (0, -1), (-1, 0), (0, 0)]:
+        j = nearest_j + dj
+        candidate = ~found & (j >= 0) & (j < ny - 1)
+        j = np.clip(j, 0, ny - 2)
+
+        # Periodic in i.
+        i = (nearest_i + di) % nx
+        i_next = (i + 1) % nx
+        quad = np.column_stack((j*nx + i, j*nx + i_next, (j + 1)*nx + i_next, (j + 1)*nx + i))
+        if src_mask is not None:
+            candidate &= ~np.any(src_mask[quad], axis=1)
+
+        corner_xyz = src_xyz[quad]
+        height = np.einsum('nkc,nc->nk', corner_xyz, dest_xyz)
+        candidate &= np.all(height > 0, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.einsum('nkc,nc->nk', corner_xyz, east)/height
+            y = np.einsum('nkc,nc->nk', corner_xyz, north)/height
+        quad_s, quad_t = inverse_bilinear(x, y)
+
+        with np.errstate(invalid='ignore'):
+            inside = candidate & (quad_s >= -eps) & (quad_s <= 1 + eps) & \
+                                 (quad_t >= -eps) & (quad_t <= 1 + eps)
+        corners[inside] = quad[inside]
+        s[inside] = quad_s[inside]
+        t[inside] = quad_t[inside]
+        found |= inside
+
+    remap_matrix = np.column_stack(((1 - s)*(1 - t), s*(1 - t), s*t, (1 - s)*t))
+    src_address = [corners[found].flatten()]
+    dst_address = [np.repeat(np.flatnonzero(found), 4)]
+    remap_matrix = [remap_matrix[found].flatten()]
+
+    missing = np.flatnonzero(~found)
+    if missing.size > 0:
+        nearest = nearest_weights(src_lons, src_lats, np.asarray(dest_lons).flatten()[missing],
+                                  np.asarray(dest_lats).flatten()[missing], src_mask)
+        src_address.append(nearest['src_address'])
+        dst_address.append(missing[nearest['dst_address']])
+        remap_matrix.append(nearest['remap_matrix'])
+
+    return make_weights(np.concatenate(src_address), np.concatenate(dst_address),
+                        np.concatenate(remap_matrix), src_lons.size, ndest)
+
+def kdtree_weights(src_def, dest_def, method, src_mask=None):
+    """
+    Generate 'nearest' or 'bilinear' weights between two grids without ESMP.
+    """
+
+    src_lons, src_lats, _, _ = read_grid(src_def)
+    dest_lons, dest_lats, _, _ = read_grid(dest_def)
+
+    if method == 'nearest':
+        return nearest_weights(src_lons, src_lats, dest_lons, dest_lats, src_mask)
+    else:
+        assert(method == 'bilinear')
+        return bilinear_weights(src_lons, src_lats, dest_lons, dest_lats, src_mask)
+
+def read_chunk(src_vars, start, end, missing_values):
+    """
+    Read timesteps 'start' to 'end' of each of 'src_vars', stacked along the
+    time axis. 'missing_values' gives the missing value of each variable (or
+    None).
+
+    Returns the chunk and a boolean array which is False where there are
+    missing values, or None if none of the variables have a missing value.
+    """
+
+    src_chunk = np.concatenate([np.array(v[start:end,:,:], dtype=np.float64) for v in src_vars])
+
+    valid = None
+    for i, missing_value in enumerate(missing_values):
+        if missing_value is not None:
+            if valid is None:
+                valid = np.ones(src_chunk.shape, dtype=bool)
+            field_chunk = src_chunk[i*(end - start):(i + 1)*(end - start)]
+            valid[i*(end - start):(i + 1)*(end - start)] = (field_chunk != missing_value)
+
+    return src_chunk, valid
+
+def source_valid(valid, src_mask):
+    """
+    Combine the missing values in a chunk, 'valid' as returned by
+    read_chunk(), with the static source mask, which is True where masked.
+    Returns None if there's nothing masked.
+    """
+
+    if src_mask is None:
+        return valid
+
+    src_valid = ~src_mask.reshape((1,) + src_mask.shape)
+    if valid is None:
+        return src_valid
+
+    return valid & src_valid
+
+def apply_masked(apply, src_chunk, valid=None):
+    """
+    Regrid a chunk of timesteps with 'apply', a function that regrids an
+    array of shape (ntimes, ny, nx) using unmasked weights. 'valid' is False
+    where the source is masked or missing, these points are left out by
+    dividing by the regridded valid fraction. This costs one extra sparse
+    multiply, but the same weights can be used with any mask, including
+    one that changes every timestep.
+
+    Returns the regridded chunk, masked where no valid source points
+    contribute, and the fraction of each destination point covered by valid
+    source points. These are the plain regridded chunk and None if 'valid'
+    is None.
+    """
+
+    if valid is None:
+        return apply(src_chunk), None
+
+    dest_frac = apply(valid.astype(np.float64))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dest_chunk = apply(np.where(valid, src_chunk, 0.0))/dest_frac
+
+    mask = np.zeros(dest_chunk.shape, dtype=bool)
+    mask |= ~(dest_frac > 0.0)
+
+    return np.ma.masked_array(dest_chunk, mask=mask), dest_frac
+
+def mask_dest(dest_chunk, dest_mask):
+    """
+    Mask the destination points where 'dest_mask' is True.
+    """
+
+    if dest_mask is None:
+        return dest_chunk
+
+    dest_chunk = np.ma.masked_array(dest_chunk)
+    dest_chunk[:, dest_mask.flatten()] = np.ma.masked
+
+    return dest_chunk
+
+def check_conservation(weights, src_chunk, dest_chunk, valid=None, dest_frac=None):
+    """
+    Check that regridding a chunk of timesteps with 'weights' conserved mass.
+    Nothing is checked if the weights don't have cell areas. 'valid' and
+    'dest_frac' are as used and returned by apply_masked(), only the mass
+    of the valid source points is expected to be conserved.
+    """
+
+    if weights['src_grid_area'] is not None and weights['dst_grid_area'] is not None:
+        if valid is not None:
+            src_chunk = np.where(valid, src_chunk, 0.0)
+            dest_chunk = np.ma.filled(dest_chunk, 0.0)*dest_frac
+        src_mass = compute_mass_chunk(src_chunk, weights['src_grid_area'], weights['src_grid_frac'])
+        dest_mass = compute_mass_chunk(dest_chunk, weights['dst_grid_area'])
+        np.testing.assert_array_less(conservation_errors(src_mass, dest_mass), 1e-6)
+
+def regrid_saved(matrix, weights, src_chunk, valid, src_mask=None, dest_mask=None):
+    """
+    Regrid a chunk of timesteps with saved weights, 'matrix' is made from
+    'weights' with weights_matrix(). The masks are applied and conservation
+    is checked.
+    """
+
+    valid = source_valid(valid, src_mask)
+    dest_chunk, dest_frac = apply_masked(lambda a: apply_weights(matrix, a), src_chunk, valid)
+    check_conservation(weights, src_chunk, dest_chunk, valid, dest_frac)
+
+    return mask_dest(dest_chunk, dest_mask)
+
+def regrid_stream(src_vars, src_time, dest_vars, dest_time, regrid_chunk, chunk_size, missing_values=None):
+    """
+    Regrid each of 'src_vars' into the corresponding 'dest_vars'
+    'chunk_size' timesteps at a time. The variables must share a time axis.
+    'regrid_chunk' is called with an array of shape (ntimes, ny, nx) and the
+    valid points returned by read_chunk(), and returns the regridded chunk.
+    The fields are stacked along the time axis so that they are all
+    regridded in one call.
+
+    Reading and writing are done in separate threads, connected to the
+    regridding by small queues, so at most a few chunks are held in memory.
+    Peak memory use is therefore set by 'chunk_size' rather than the length
+    of the input.
+
+    'missing_values' gives the missing value of each source variable (or
+    None). Regridded chunks can be masked arrays, masked points are written
+    as the destination variable's missing value.
+    """
+
+    if missing_values is None:
+        missing_values = [None]*len(src_vars)
+
+    # The netCDF library is not thread safe, so reads and writes can't
+    # happen at the same time. They still overlap with the regridding.
+    nc_lock = threading.Lock()
+    read_queue = Queue.Queue(maxsize=2)
+    write_queue = Queue.Queue(maxsize=2)
+    errors = []
+    stop = threading.Event()
+
+    num_times = src_vars[0].shape[0]
+    assert(all([v.shape[0] == num_times for v in src_vars]))
+    chunks = [(start, min(start + chunk_size, num_times)) for start in range(0, num_times, chunk_size)]
+
+    def reader():
+        try:
+            for start, end in chunks:
+                if stop.is_set():
+                    break
+                with nc_lock:
+                    time_chunk = src_time[start:end]
+                    src_chunk, valid = read_chunk(src_vars, start, end, missing_values)
+                read_queue.put((start, end, time_chunk, src_chunk, valid))
+        except Exception:
+            errors.append(sys.exc_info())
+        read_queue.put(None)
+
+    def writer():
+        try:
+            writers = [ncoutput.SlabWriter(v, output_buffer_mb) for v in dest_vars]
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                start, end, time_chunk, dest_chunk = item
+                with nc_lock:
+                    dest_time[start:end] = time_chunk
+                    for i, w in enumerate(writers):
+                        w.write(slice(start, end), dest_chunk[i*(end - start):(i + 1)*(end - start)])
+            with nc_lock:
+                for w in writers:
+                    w.flush()
+        except Exception:
+            errors.append(sys.exc_info())
+            # Keep draining so the regridding doesn't block.
+            while write_queue.get() is not None:
+                pass
+
+    threads = [threading.Thread(target=reader), threading.Thread(target=writer)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    reading_done = False
+    try:
+        while not errors:
+            item = read_queue.get()
+            if item is None:
+                reading_done = True
+                break
+            start, end, time_chunk, src_chunk, valid = item
+            print 'Regridding timesteps %s to %s' % (start, end - 1)
+
+            dest_chunk = regrid_chunk(src_chunk, valid)
+            write_queue.put((start, end, time_chunk, dest_chunk.reshape((src_chunk.shape[0],) + dest_vars[0].shape[1:])))
+    finally:
+        write_queue.put(None)
+
+        # Make sure the reader isn't left blocked if we stopped early.
+        stop.set()
+        while not reading_done:
+            reading_done = (read_queue.get() is None)
+
+        for t in threads:
+            t.join()
+
+    if errors:
+        exc_type, exc_value, exc_tb = errors[0]
+        raise exc_type, exc_value, exc_tb
+
+def read_field_table(filename):
+    """
+    Read a list of fields to regrid. This is either a MATM data_4_matm.table,
+    where the first line is the number of fields followed by a filename and
+    field name line for each field, or a manifest with one field per line
+    of the form: source_filename field_name [destination_filename]
+
+    Returns a list of (source_filename, field_name, destination_filename)
+    with destination_filename None if it was not given.
+    """
+
+    with open(filename) as f:
+        lines = [l.split('#')[0].strip() for l in f.readlines()]
+
+    fields = []
+    if lines[0].isdigit():
+        num_fields = int(lines[0])
+        lines = [l for l in lines[1:] if l != '']
+        for i in range(num_fields):
+            fields.append((lines[2*i], lines[2*i + 1], None))
+    else:
+        for l in lines:
+            if l == '':
+                continue
+            items = l.split()
+            assert(len(items) in [2, 3])
+            fields.append((items[0], items[1], items[2] if len(items) == 3 else None))
+
+    return fields
+
+def group_fields(fields, output_dir):
+    """
+    Group fields that come from the same source file, and are going to the
+    same destination file, so that they can be read and regridded together.
+
+    Returns a list of (source_filename, [field_names], destination_filename).
+    """
+
+    groups = []
+    for src_filename, field_name, dest_filename in fields:
+        if dest_filename is None:
+            dest_filename = os.path.join(output_dir, os.path.basename(src_filename))
+
+        for src, names, dest in groups:
+            if src == src_filename and dest == dest_filename:
+                names.append(field_name)
+                break
+        else:
+            groups.append((src_filename, [field_name], dest_filename))
+
+    return groups
+
+def check_field_shapes(groups, src_shape):
+    """
+    Check that the fields in 'groups', see group_fields(), are on the source
+    grid, which has shape (ny, nx). Returns a list of problems, empty if
+    there are none.
+    """
+
+    problems = []
+    for src_filename, field_names, _ in groups:
+        with nc.Dataset(src_filename) as f:
+            for field_name in field_names:
+                if field_name not in f.variables:
+                    problems.append('%s is not in %s' % (field_name, src_filename))
+                    continue
+                shape = f.variables[field_name].shape[-2:]
+                if tuple(shape) != tuple(src_shape):
+                    problems.append('%s in %s is on a %s x %s grid, the source grid is %s x %s' %
+                                    ((field_name, src_filename) + tuple(shape) + tuple(src_shape)))
+
+    return problems
+
+def open_src_fields(src_file, field_names):
+    """
+    Return the variables 'field_names' from 'src_file', set up to read raw
+    data, and their missing values.
+    """
+
+    src_vars = []
+    missing_values = []
+    for field_name in field_names:
+        src_var = src_file.variables[field_name]
+        assert(len(src_var.shape) == 3)
+
+        # Missing values are found in read_chunk(), read the raw data.
+        missing_values.append(getattr(src_var, 'missing_value', None))
+        src_var.set_auto_mask(False)
+        src_vars.append(src_var)
+
+    return src_vars, missing_values
+
+# Used for masked destination points when the source field has no missing value.
+DEFAULT_MISSING_VALUE = 1.0e20
+
+# Set from the command line, see ncoutput.add_arguments().
+output_options = {'chunking' : 'map'}
+output_buffer_mb = 256
+
+def create_dest_file(dest_filename, field_names, dest_shape, missing_values=None):
+    """
+    Create the new file 'dest_filename' with a variable for each of 'field_names'.
+    'missing_values' are those of the source fields (or None).
+    """
+
+    if missing_values is None:
+        missing_values = [None]*len(field_names)
+
+    assert(not os.path.exists(dest_filename))
+    dest_file = nc.Dataset(dest_filename, 'w')
+
+    dest_file.createDimension('nx', dest_shape[1])
+    dest_file.createDimension('ny', dest_shape[0])
+    dest_file.createDimension('time', None)
+    dest_file.createVariable('time', 'f8', ('time'))
+
+    dest_vars = []
+    for field_name, missing_value in zip(field_names, missing_values):
+        if missing_value is None:
+            missing_value = DEFAULT_MISSING_VALUE
+
+        # By default chunk by timestep, which suits the way the models read their forcing.
+        dest_var = ncoutput.create_variable(dest_file, field_name, 'f8', ('time', 'ny', 'nx'),
+                                            fill_value=missing_value, **output_options)
+        dest_var.missing_value = np.array(missing_value, dtype=dest_var.dtype)
+        dest_vars.append(dest_var)
+
+    return dest_file, dest_vars
+
+def regrid_fields(src_filename, field_names, dest_filename, dest_shape, regrid_chunk, chunk_size):
+    """
+    Regrid the fields 'field_names' from 'src_filename' and write them to
+    the new file 'dest_filename'.
+    """
+
+    src_file = nc.Dataset(src_filename, 'r')
+    src_vars, missing_values = open_src_fields(src_file, field_names)
+    dest_file, dest_vars = create_dest_file(dest_filename, field_names, dest_shape, missing_values)
+
+    regrid_stream(src_vars, src_file.variables['time'], dest_vars, dest_file.variables['time'],
+                  regrid_chunk, chunk_size, missing_values)
+
+    src_file.close()
+    dest_file.close()
+
+def save_weights_arrays(weights_file):
+    """
+    Save the sparse matrix, areas and fractions from 'weights_file' as .npy
+    files in a directory alongside it, so that they can be memory mapped.
+    Nothing is done if this has already been done. Returns the directory.
+    """
+
+    arrays_dir = weights_file + '.npy'
+    if os.path.exists(arrays_dir):
+        return arrays_dir
+
+    weights = read_weights(weights_file)
+    matrix = weights_matrix(weights)
+
+    # Write to a temporary directory first so that an interrupted run doesn't
+    # leave a partial set of arrays behind.
+    tmp_dir = arrays_dir + '.tmp.%s' % os.getpid()
+    os.mkdir(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'shape.npy'), np.array(matrix.shape))
+    for name in ['data', 'indices', 'indptr']:
+        np.save(os.path.join(tmp_dir, name + '.npy'), getattr(matrix, name))
+    for name in ['src_grid_frac', 'src_grid_area', 'dst_grid_area']:
+        if weights[name] is not None:
+            np.save(os.path.join(tmp_dir, name + '.npy'), weights[name])
+    os.rename(tmp_dir, arrays_dir)
+
+    return arrays_dir
+
+def load_weights_arrays(arrays_dir):
+    """
+    Memory map the arrays saved by save_weights_arrays(). Returns the sparse
+    matrix and a dictionary with the areas and fractions, see read_weights().
+    """
+
+    def load(name):
+        filename = os.path.join(arrays_dir, name + '.npy')
+        if not os.path.exists(filename):
+            return None
+        return np.load(filename, mmap_mode='r')
+
+    matrix = scipy.sparse.csr_matrix((load('data'), load('indices'), load('indptr')),
+                                     shape=tuple(load('shape')), copy=False)
+    weights = {}
+    for name in ['src_grid_frac', 'src_grid_area', 'dst_grid_area']:
+        weights[name] = load(name)
+
+    return matrix, weights
+
+# Per process state for the regridding workers, see init_worker().
+worker_state = {}
+
+def init_worker(arrays_dir, src_mask=None, dest_mask=None):
+    """
+    Set up a regridding worker process. The weights are memory mapped so the
+    pages are shared between all workers.
+    """
+
+    worker_state['matrix'], worker_state['weights'] = load_weights_arrays(arrays_dir)
+    worker_state['src_mask'] = src_mask
+    worker_state['dest_mask'] = dest_mask
+    worker_state['files'] = {}
+
+def regrid_worker(task):
+    """
+    Read, regrid and check one chunk of timesteps in a worker process.
+    """
+
+    src_filename, field_names, start, end = task
+
+    if src_filename not in worker_state['files']:
+        worker_state['files'][src_filename] = nc.Dataset(src_filename, 'r')
+    src_vars, missing_values = open_src_fields(worker_state['files'][src_filename], field_names)
+
+    src_chunk, valid = read_chunk(src_vars, start, end, missing_values)
+
+    return regrid_saved(worker_state['matrix'], worker_state['weights'], src_chunk, valid,
+                        worker_state['src_mask'], worker_state['dest_mask'])
+
+def regrid_fields_parallel(pool, workers, src_filename, field_names, dest_filename, dest_shape, chunk_size):
+    """
+    Like regrid_fields() but the time chunks are regridded by a pool of worker
+    processes, 'workers' is the size of the pool. This process writes the
+    results in time order.
+    """
+
+    src_file = nc.Dataset(src_filename, 'r')
+    src_vars, missing_values = open_src_fields(src_file, field_names)
+    src_time = src_file.variables['time']
+    dest_file, dest_vars = create_dest_file(dest_filename, field_names, dest_shape, missing_values)
+
+    num_times = src_vars[0].shape[0]
+    assert(all([v.shape[0] == num_times for v in src_vars]))
+    chunks = [(start, min(start + chunk_size, num_times)) for start in range(0, num_times, chunk_size)]
+
+    # Only keep a couple of chunks per worker in flight to bound memory use.
+    max_pending = 2*workers
+    pending = collections.deque()
+    writers = [ncoutput.SlabWriter(v, output_buffer_mb) for v in dest_vars]
+    for i, (start, end) in enumerate(chunks):
+        pending.append((start, end, pool.apply_async(regrid_worker, [(src_filename, field_names, start, end)])))
+
+        while pending and (len(pending) >= max_pending or i == len(chunks) - 1):
+            start, end, result = pending.popleft()
+            dest_chunk = result.get()
+            print 'Regridded timesteps %s to %s' % (start, end - 1)
+
+            dest_chunk = dest_chunk.reshape((dest_chunk.shape[0],) + tuple(dest_shape))
+            dest_file.variables['time'][start:end] = src_time[start:end]
+            for j, w in enumerate(writers):
+                w.write(slice(start, end), dest_chunk[j*(end - start):(j + 1)*(end - start)])
+
+    for w in writers:
+        w.flush()
+    src_file.close()
+    dest_file.close()
+
+# Set from --grid_cache_dir, see read_grid().
+grid_cache_dir = None
+grid_cache_arrays = ['lons', 'lats', 'x_corner', 'y_corner']
+
+def grid_cache_path(field_def):
+    """
+    Directory in grid_cache_dir for a grid. The key is the grid file path,
+    its modification time and size and the variable names, so the cache is
+    not used once the file has changed.
+    """
+
+    f, lon_name, lat_name, clon_name, clat_name = field_def
+
+    filename = os.path.realpath(f.filepath())
+    key = '%s %r %s %s %s %s %s' % (filename, os.path.getmtime(filename), os.path.getsize(filename),
+                                    lon_name, lat_name, clon_name, clat_name)
+
+    return os.path.join(grid_cache_dir, hashlib.sha1(key).hexdigest())
+
+def write_grid_cache(cache_path, grid_arrays):
+    """
+    Save the arrays returned by prepare_grid() and their hash to 'cache_path'.
+    """
+
+    # Write to a temporary directory first so that an interrupted run, or
+    # another process, never sees a partial cache.
+    tmp_dir = cache_path + '.tmp.%s' % os.getpid()
+    os.makedirs(tmp_dir)
+    for name, a in zip(grid_cache_arrays, grid_arrays):
+        np.save(os.path.join(tmp_dir, name + '.npy'), a)
+    with open(os.path.join(tmp_dir, 'hash'), 'w') as f:
+        f.write(grid_hash(grid_arrays))
+
+    try:
+        os.rename(tmp_dir, cache_path)
+    except OSError:
+        # Another process got there first.
+        shutil.rmtree(tmp_dir)
+
+def read_grid(field_def):
+    """
+    Read the grid centres and corners from file and convert them into the
+    form needed by ESMP. Returns (lons, lats, x_corner, y_corner) in degrees,
+    the corners are flattened.
+
+    If grid_cache_dir is set the arrays are kept there and memory mapped on
+    later reads, so they are only prepared once and pages are shared between
+    processes using the same grid.
+    """
+
+    if grid_cache_dir is None:
+        return prepare_grid(field_def)
+
+    cache_path = grid_cache_path(field_def)
+    if not os.path.exists(cache_path):
+        write_grid_cache(cache_path, prepare_grid(field_def))
+
+    return tuple([np.load(os.path.join(cache_path, name + '.npy'), mmap_mode='r') for name in grid_cache_arrays])
+
+def read_grid_hash(field_def):
+    """
+    The grid_hash() of a grid, this is read from the cache if there is one.
+    """
+
+    if grid_cache_dir is None:
+        return grid_hash(read_grid(field_def))
+
+    cache_path = grid_cache_path(field_def)
+    if not os.path.exists(cache_path):
+        write_grid_cache(cache_path, prepare_grid(field_def))
+
+    with open(os.path.join(cache_path, 'hash')) as f:
+        return f.read().strip()
+
+def prepare_grid(field_def):
+    """
+    Does the work of read_grid().
     """
 
     f, lon_name, lat_name, clon_name, clat_name = field_def
@@ -199,30 +1195,15 @@ def make_grid(field_def, mask=None):
     clats = np.copy(f.variables[clat_name])
     clats = np.rad2deg(clats)
 
-    # Create a grid with 1 periodic dimension.
-    grid = ESMP.ESMP_GridCreate1PeriDim(np.array((lons.shape[1], lons.shape[0]), dtype=np.int32))
-
-    # Add centres to grid.
-    ESMP.ESMP_GridAddCoord(grid, staggerloc=ESMP.ESMP_STAGGERLOC_CENTER)
-    lb_center, ub_center = ESMP.ESMP_GridGetCoord(grid, ESMP.ESMP_STAGGERLOC_CENTER)
+    # The grid is periodic in x so there is one more row of corners than
+    # centres but the same number of columns.
+    nx = lons.shape[1]
+    ny = lons.shape[0] + 1
 
-    [x, y] = [0, 1]
-    x_center = ESMP.ESMP_GridGetCoordPtr(grid, x, ESMP.ESMP_STAGGERLOC_CENTER)
-    y_center = ESMP.ESMP_GridGetCoordPtr(grid, y, ESMP.ESMP_STAGGERLOC_CENTER)
-    x_center[:] = lons.flatten()
-    y_center[:] = lats.flatten()
-
-    # Add corners to grid. 
-    ESMP.ESMP_GridAddCoord(grid, staggerloc=ESMP.ESMP_STAGGERLOC_CORNER)
-    lb_corner, ub_corner = ESMP.ESMP_GridGetCoord(grid, ESMP.ESMP_STAGGERLOC_CORNER)
-    nx, ny = ub_corner[:] - lb_corner[:]
-
-    x_corner = ESMP.ESMP_GridGetCoordPtr(grid, x, ESMP.ESMP_STAGGERLOC_CORNER)
+    x_corner = np.empty((ny, nx))
     x_corner[:] = np.NAN
-    x_corner = x_corner.reshape(ny, nx)
-    y_corner = ESMP.ESMP_GridGetCoordPtr(grid, y, ESMP.ESMP_STAGGERLOC_CORNER)
+    y_corner = np.empty((ny, nx))
     y_corner[:] = np.NAN
-    y_corner = y_corner.reshape(ny, nx)
 
     # Need to copy over the corners which are shape (4, 300, 360) to flat a (301, 360) 
     # array (for example). This is done by copying over all the corner 0 coordinates,
@@ -244,22 +1225,80 @@ def make_grid(field_def, mask=None):
     # Check that there are no NANs left.
     assert not (np.isnan(np.sum(x_corner)) or np.isnan(np.sum(y_corner)))
 
+    return (lons, lats, x_corner, y_corner)
+
+def make_grid(field_def, mask=None):
+    """
+    Define a grid
+
+    Use the cice grid. 
+    """
+
+    lons, lats, x_corner_in, y_corner_in = read_grid(field_def)
+
+    # Create a grid with 1 periodic dimension.
+    grid = ESMP.ESMP_GridCreate1PeriDim(np.array((lons.shape[1], lons.shape[0]), dtype=np.int32))
+
+    # Add centres to grid.
+    ESMP.ESMP_GridAddCoord(grid, staggerloc=ESMP.ESMP_STAGGERLOC_CENTER)
+    lb_center, ub_center = ESMP.ESMP_GridGetCoord(grid, ESMP.ESMP_STAGGERLOC_CENTER)
+
+    [x, y] = [0, 1]
+    # When running on more than one PET the grid is decomposed, each PET
+    # only sets its own part which is given by the bounds.
+    x_center = ESMP.ESMP_GridGetCoordPtr(grid, x, ESMP.ESMP_STAGGERLOC_CENTER)
+    y_center = ESMP.ESMP_GridGetCoordPtr(grid, y, ESMP.ESMP_STAGGERLOC_CENTER)
+    x_center[:] = lons[lb_center[1]:ub_center[1], lb_center[0]:ub_center[0]].flatten()
+    y_center[:] = lats[lb_center[1]:ub_center[1], lb_center[0]:ub_center[0]].flatten()
+
+    # Add corners to grid. 
+    ESMP.ESMP_GridAddCoord(grid, staggerloc=ESMP.ESMP_STAGGERLOC_CORNER)
+    lb_corner, ub_corner = ESMP.ESMP_GridGetCoord(grid, ESMP.ESMP_STAGGERLOC_CORNER)
+
+    # The grid is periodic in x so there is one more row of corners than centres.
+    x_corner_in = x_corner_in.reshape(lons.shape[0] + 1, lons.shape[1])
+    y_corner_in = y_corner_in.reshape(lons.shape[0] + 1, lons.shape[1])
+
+    x_corner = ESMP.ESMP_GridGetCoordPtr(grid, x, ESMP.ESMP_STAGGERLOC_CORNER)
+    y_corner = ESMP.ESMP_GridGetCoordPtr(grid, y, ESMP.ESMP_STAGGERLOC_CORNER)
+    x_corner[:] = x_corner_in[lb_corner[1]:ub_corner[1], lb_corner[0]:ub_corner[0]].flatten()
+    y_corner[:] = y_corner_in[lb_corner[1]:ub_corner[1], lb_corner[0]:ub_corner[0]].flatten()
+
     if mask is not None:
        print 'Using mask'
        ESMP.ESMP_GridAddItem(grid, item=ESMP.ESMP_GRIDITEM_MASK)
        m = ESMP.ESMP_GridGetItem(grid, item=ESMP.ESMP_GRIDITEM_MASK)
-       mask = mask.reshape(m.shape[0])
+       mask = mask[lb_center[1]:ub_center[1], lb_center[0]:ub_center[0]].reshape(m.shape[0])
        m[mask == True] = 1
        m[mask == False] = 0
-       import pdb
-       pdb.set_trace()
 
     return grid
 
+# Set by initialise_esmp(), ESMP can only be initialised once.
+esmp_pets = None
+
+def initialise_esmp():
+    """
+    Initialise ESMP if that hasn't been done already.
+
+    Returns the local PET and the number of PETs. There is more than one
+    PET when running under mpirun.
+    """
+
+    global esmp_pets
+
+    if esmp_pets is None:
+        ESMP.ESMP_Initialize()
+        ESMP.ESMP_LogSet(True)
+
+        vm = ESMP.ESMP_VMGetGlobal()
+        esmp_pets = ESMP.ESMP_VMGet(vm)
+
+    return esmp_pets
+
 def setup_grid_and_fields(src_def, dest_def, src_mask=None, dest_mask=None):
 
-    ESMP.ESMP_Initialize()
-    ESMP.ESMP_LogSet(True)
+    initialise_esmp()
 
     # Create source and destination grids.
     src_grid = make_grid(src_def, src_mask)
@@ -278,29 +1317,113 @@ def setup_grid_and_fields(src_def, dest_def, src_mask=None, dest_mask=None):
 
     return (src_grid, dest_grid, src_field, dest_field, src_frac, dest_frac, src_area, dest_area)
 
-def test_regrid():
+def test_regrid(src_def, dest_def, weights_file=None, method='conserve'):
     """
-    Check the OASIS grids by regridding and analytic function and comparing to the expected result.
+    Check regridding between two grids by regridding an analytic function and comparing to the
+    expected result. The errors, conservation and the time taken to generate and apply weights
+    are reported.
 
-    This does not pass, although close. Need to experiment with some different grid setups to see 
-    what's going on. Leave this for now.
+    If 'weights_file' exists the weights are read from it and ESMP is not needed, otherwise they are
+    generated with ESMP, or a KD-tree for the 'nearest' and 'bilinear' methods, (and saved to
+    'weights_file' if it is given).
     """
-    src_grid, dest_grid, src_field, dest_field, src_frac, dest_frac, src_area, dest_area = setup_grid_and_fields()
 
-    dest_exact = ESMP.ESMP_FieldCreateGrid(dest_grid, 'dest_exact')
+    weights = None
+    if method != 'conserve' and (weights_file is None or not os.path.exists(weights_file)):
+        start = time.time()
+        weights = kdtree_weights(src_def, dest_def, method)
+        timings = [('Weights', time.time() - start)]
 
-    # Intialise analytic test field.
-    src_field = build_analytic_field(src_field, src_grid, False)
-    dest_exact = build_analytic_field(dest_exact, dest_grid, False)
+        if weights_file is not None:
+            write_weights(weights_file, weights, method)
 
-    # Do the regridding 
-    dest_field, src_frac, dest_frac = run_regridding(src_field, dest_field, src_frac, dest_frac)
+    elif weights_file is None or not os.path.exists(weights_file):
+        if ESMP is None:
+            sys.stderr.write("ESMP is not available and no saved weights were found.\n")
+            return 1
 
-    # Compute mass
-    src_mass, _ = compute_mass(src_field, src_area, src_frac, True)
-    dest_mass, _ = compute_mass(dest_field, dest_area, 0, False)
+        src_grid, dest_grid, src_field, dest_field, src_frac, dest_frac, src_area, dest_area = setup_grid_and_fields(src_def, dest_def)
+
+        dest_exact = ESMP.ESMP_FieldCreateGrid(dest_grid, 'dest_exact')
+
+        # Intialise analytic test field.
+        src_field = build_analytic_field(src_field, src_grid, False)
+        dest_exact = build_analytic_field(dest_exact, dest_grid, False)
+
+        # Do the regridding 
+        esmf_weights_file = None
+        if weights_file is not None:
+            esmf_weights_file = weights_file + '.esmf'
+
+        timings = []
+        start = time.time()
+        routehandle = make_routehandle(src_field, dest_field, src_frac, dest_frac, esmf_weights_file)
+        timings.append(('Weights', time.time() - start))
+
+        start = time.time()
+        dest_field, src_frac, dest_frac = run_regridding(src_field, dest_field, src_frac, dest_frac, routehandle)
+        timings.append(('Apply', time.time() - start))
+
+        # Compute mass
+        src_mass, _ = compute_mass(src_field, src_area, src_frac, True)
+        dest_mass, _ = compute_mass(dest_field, dest_area, 0, False)
+
+        print 'ESMP regridding:'
+        passed = compare_fields(dest_field, dest_exact, dest_frac, src_mass, dest_mass, timings)
+
+        saved = (esmf_weights_file is not None and os.path.exists(esmf_weights_file))
+        if saved:
+            save_weights(weights_file, esmf_weights_file, src_grid, dest_grid, src_frac, dest_frac, src_area, dest_area)
+
+        ESMP.ESMP_FieldRegridRelease(routehandle)
+        for field in [src_field, dest_field, dest_exact, src_frac, dest_frac, src_area, dest_area]:
+            ESMP.ESMP_FieldDestroy(field)
+        ESMP.ESMP_GridDestroy(src_grid)
+        ESMP.ESMP_GridDestroy(dest_grid)
+        ESMP.ESMP_Finalize()
+
+        # The saved weights are checked on PET 0 only.
+        local_pet, _ = initialise_esmp()
+        if local_pet != 0:
+            return 0
+
+        if not saved:
+            return 0 if passed else 1
+
+    # Regrid using the saved weights.
+    if weights is None:
+        timings = []
+        start = time.time()
+        weights = read_weights(weights_file)
+        timings.append(('Load', time.time() - start))
+    matrix = weights_matrix(weights)
+
+    src_lons, src_lats, _, _ = read_grid(src_def)
+    dest_lons, dest_lats, _, _ = read_grid(dest_def)
+    src = analytic_field(src_lons, src_lats)[np.newaxis, :, :]
+    dest_exact = analytic_field(dest_lons, dest_lats).flatten()
+
+    start = time.time()
+    dest = apply_weights(matrix, src)
+    timings.append(('Apply', time.time() - start))
+
+    dest_frac = weights['dst_grid_frac']
+    if dest_frac is None:
+        dest_frac = np.ones_like(dest_exact)
+
+    src_mass = None
+    dest_mass = None
+    if weights['src_grid_area'] is not None and weights['dst_grid_area'] is not None:
+        src_mass = compute_mass_chunk(src, weights['src_grid_area'], weights['src_grid_frac'])[0]
+        dest_mass = compute_mass_chunk(dest, weights['dst_grid_area'])[0]
+
+    if weights_file is not None:
+        print 'Saved weights %s:' % weights_file
+    else:
+        print '%s weights:' % method
+    passed = report_errors(field_errors(dest[0, :], dest_exact, dest_frac), src_mass, dest_mass, timings)
 
-    compare_fields(dest_field, dest_exact, dest_frac, src_mass, dest_mass)
+    return 0 if passed else 1
 
 def main():
 
@@ -310,7 +1433,7 @@ def main():
                          corner latitudes field.\"")
     parser.add_argument("dest_grid", help="A Python tuple describing the destination grid. \
                          It has the same format as the source grid argument.")
-    parser.add_argument("field", help="A field tuples describing the field to regrid. \
+    parser.add_argument("field", nargs='?', help="A field tuples describing the field to regrid. \
                          The tuple is: source filename, field name, destination filename. E.g. \
                          %s \"('grid.nc', 'lons', 'lats', 'clons', 'clats')\" \
                          \"('grid.new.nc', 'lons', 'lats', 'clons', 'clats')\" \
@@ -325,9 +1448,54 @@ def main():
     parser.add_argument("--dest_mask_file", help="Specify a mask for the dest field.")
     parser.add_argument("--dest_mask_var", help="The dest mask variable name.")
     parser.add_argument("--flip_dest_mask", action='store_true', help="Invert the dest mask. Program expectes 1 or True to represent masked.")
-
+    parser.add_argument("--weights_dir", help="Directory in which to save regridding weights. If weights for the \
+                                               same source and destination grids are found here they are \
+                                               reused and weight generation is skipped.")
+    parser.add_argument("--weights", help="Weights file to use. If it exists it is applied without needing ESMP, \
+                                           otherwise weights are generated and saved to it.")
+    parser.add_argument("--grid_cache_dir", help="Directory in which to cache the prepared grid centres and \
+                                                   corners. Later runs using the same grid files memory map \
+                                                   these instead of reading and converting the grids again.")
+    parser.add_argument("--chunk_size", default=64, type=int, help="The number of timesteps read, regridded and \
+                                                                     written at once, defaults to 64. This sets \
+                                                                     the peak memory use.")
+    parser.add_argument("--batch", help="Regrid all the fields listed in this file instead of a single field. \
+                                         The file can be a MATM data_4_matm.table or a manifest with lines of the \
+                                         form: source_filename field_name [destination_filename]. Fields from \
+                                         the same source file are regridded together.")
+    parser.add_argument("--output_dir", default='./', help="Where to write regridded files for --batch when \
+                                                             the destination is not given, defaults to the \
+                                                             current directory.")
+    parser.add_argument("--workers", default=1, type=int, help="The number of processes used to regrid time \
+                                                                 chunks in parallel when using saved weights, \
+                                                                 defaults to 1.")
+    parser.add_argument("--method", default='conserve', choices=['conserve', 'nearest', 'bilinear'],
+                        help="The regridding method, defaults to conserve. The nearest and bilinear methods \
+                              use a KD-tree search of the grid centres and don't need ESMP. Use \
+                              bilinear for state fields such as SST.")
+    parser.add_argument("--selftest", action='store_true', help="Regrid an analytic field between the source and \
+                                                                 destination grids and report the accuracy, conservation and \
+                                                                 time taken. The field argument is not needed.")
+
+    ncoutput.add_arguments(parser, chunking='map')
     args = parser.parse_args()
 
+    global output_buffer_mb
+    output_options.update(ncoutput.options(args))
+    output_buffer_mb = args.buffer_mb
+
+    global grid_cache_dir
+    if args.grid_cache_dir:
+        if not os.path.exists(args.grid_cache_dir):
+            os.makedirs(args.grid_cache_dir)
+        grid_cache_dir = args.grid_cache_dir
+
+    if args.weights_dir and not os.path.exists(args.weights_dir):
+        os.makedirs(args.weights_dir)
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
     # Open src and dest grid files provided on the command line.
     args_src_grid = list(ast.literal_eval(args.src_grid))
     args_dest_grid = list(ast.literal_eval(args.dest_grid))
@@ -340,22 +1508,27 @@ def main():
     args_src_grid[0] = src_grid_file
     args_dest_grid[0] = dest_grid_file
 
-    src_file, field_name, dest_file = ast.literal_eval(args.field)
-    src_file = nc.Dataset(src_file, 'r')
-    src_field_tmp = np.copy(src_file.variables[field_name])
+    if args.selftest:
+        weights_file = args.weights
+        if weights_file is None and args.weights_dir:
+            weights_file = weights_filename(args.weights_dir, read_grid_hash(args_src_grid),
+                                            read_grid_hash(args_dest_grid), args.method)
+        ret = test_regrid(args_src_grid, args_dest_grid, weights_file, args.method)
+        src_grid_file.close()
+        dest_grid_file.close()
+        return ret
+
+    if args.batch:
+        fields = read_field_table(args.batch)
+    elif args.field is not None:
+        fields = [ast.literal_eval(args.field)]
+    else:
+        parser.error('one of the field argument or --batch is required')
 
+    # The masks are applied when regridding, together with any missing values
+    # in the fields, so the weights are the same with or without them.
     src_mask = None
     dest_mask = None
-    # Check whether the field has missing values, in which case a src mask is needed.
-    if hasattr(src_file.variables[field_name], 'missing_value'):
-        assert(args.src_mask_file is None and args.src_mask_var is None)
-        src_mask = np.ma.getmask(src_file.variables[field_name][:])
-        src_mask = src_mask[0,:,:]
-
-        # FIXME: HACK to get a particular field regridded. Put 0 everywhere where there's a missing value.
-        src_mask = None
-        src_field_tmp[src_field_tmp == src_file.variables[field_name].missing_value] = 0.0
-
     if args.src_mask_file:
         # If no missing values, then use --src_mask_var
         assert(args.src_mask_var is not None)
@@ -363,7 +1536,7 @@ def main():
         with nc.Dataset(args.src_mask_file) as f:
             src_mask = f.variables[args.src_mask_var][:]
             # In case src_mask is ints or reals, convert to proper masked array. 
-            src_mask = np.ma.make_mask(src_mask)
+            src_mask = np.ma.make_mask(src_mask, shrink=False)
 
     else:
         sys.stdout.write("INFO: no mask present, regridding without mask.\n")
@@ -377,7 +1550,7 @@ def main():
         with nc.Dataset(args.dest_mask_file) as f:
             dest_mask = f.variables[args.dest_mask_var][:]
             # In case src_mask is ints or reals, convert to proper masked array. 
-            dest_mask = np.ma.make_mask(dest_mask)
+            dest_mask = np.ma.make_mask(dest_mask, shrink=False)
 
     if args.flip_src_mask:
         assert(src_mask is not None)
@@ -387,59 +1560,137 @@ def main():
         assert(dest_mask is not None)
         dest_mask = ~dest_mask
 
-    # Create the destination file.
-    assert(not os.path.exists(dest_file))
-    dest_file = nc.Dataset(dest_file, 'w')
     dest_shape = dest_grid_file.variables[dest_lons].shape
 
-    dest_file.createDimension('nx', dest_shape[1])
-    dest_file.createDimension('ny', dest_shape[0])
-    dest_file.createDimension('time', None)
-    dest_file.createVariable('time', 'f8', ('time'))
-    dest_file.createVariable(field_name, 'f8', ('time', 'ny', 'nx'))
-
-    # Open up the source and destination grids and do setup. 
-    # _cl suffic is for 'clean', i.e. not modified since initialisation.
-    src_grid_cl, dest_grid_cl, src_field_cl, dest_field_cl, src_frac_cl, dest_frac_cl, src_area_cl, dest_area_cl = setup_grid_and_fields(args_src_grid, args_dest_grid, src_mask, dest_mask)
-
-    # Iterate over all time points and perform regridding.
-    assert(len(src_field_tmp.shape) == 3)
-    for t in range(src_field_tmp.shape[0]):
-        print 'Regridding at timestep %s' % t
-
-        # Set the time field.
-        dest_file.variables['time'][t] = src_file.variables['time'][t]
-
-        # Load the field to be regridded.
-        src_field_ptr = ESMP.ESMP_FieldGetPtr(src_field_cl) 
-
-        src_field_ptr[:] = ((src_field_tmp[t,:,:]).reshape(src_field_cl.size))[:]
-        dest_field, src_frac, dest_frac = run_regridding(src_field_cl, dest_field_cl, src_frac_cl, dest_frac_cl)
-
-        # Write out field to desination field.
-        dest_field_ptr = ESMP.ESMP_FieldGetPtr(dest_field)
-        dest_field_ptr = dest_field_ptr.reshape(dest_shape)
+    # Look for saved weights for this pair of grids.
+    weights_file = args.weights
+    if weights_file is None and args.weights_dir:
+        src_hash = read_grid_hash(args_src_grid)
+        dest_hash = read_grid_hash(args_dest_grid)
+        weights_file = weights_filename(args.weights_dir, src_hash, dest_hash, args.method)
+
+    # The grids and weights are set up once and then used for all fields.
+    groups = group_fields(fields, args.output_dir)
+
+    # The weights are only right for fields on the source grid.
+    problems = check_field_shapes(groups, src_grid_file.variables[src_lons].shape)
+    if problems:
+        sys.stderr.write('Fields not on the source grid %s:\n    %s\n' % (src_grid_filename, '\n    '.join(problems)))
+        return 1
+
+    # Under mpirun the weights are generated on all PETs, everything else is
+    # done on PET 0.
+    local_pet, pet_count = (0, 1)
+    if ESMP is not None:
+        local_pet, pet_count = initialise_esmp()
+
+    weights = None
+    use_saved_weights = (weights_file is not None and os.path.exists(weights_file))
+    if use_saved_weights:
+        print 'Using saved weights %s' % weights_file
+
+    elif args.method != 'conserve':
+        weights = kdtree_weights(args_src_grid, args_dest_grid, args.method)
+        if weights_file is not None and local_pet == 0:
+            write_weights(weights_file + '.tmp', weights, args.method)
+            os.rename(weights_file + '.tmp', weights_file)
+        use_saved_weights = True
+
+    elif ESMP is None:
+        sys.stderr.write("ESMP is not available and no saved weights were found, see --weights and --weights_dir.\n")
+        return 1
 
-        dest_file.variables[field_name][t,:,:] = dest_field_ptr[:,:] 
-
-        # Check some results. 
-        src_mass, src_area = compute_mass(src_field_cl, src_area_cl, src_frac_cl, True)
-        dest_mass, dest_area = compute_mass(dest_field, dest_area_cl, 0, False)
-        np.testing.assert_approx_equal(src_mass, dest_mass)
+    else:
+        # Open up the source and destination grids and do setup. 
+        # _cl suffic is for 'clean', i.e. not modified since initialisation.
+        src_grid_cl, dest_grid_cl, src_field_cl, dest_field_cl, src_frac_cl, dest_frac_cl, src_area_cl, dest_area_cl = setup_grid_and_fields(args_src_grid, args_dest_grid)
+
+        # The weights are the same for every timestep so only compute them once.
+        esmf_weights_file = None
+        if weights_file is not None:
+            esmf_weights_file = weights_file + '.esmf'
+        routehandle = make_routehandle(src_field_cl, dest_field_cl, src_frac_cl, dest_frac_cl, esmf_weights_file)
+        if esmf_weights_file is not None and os.path.exists(esmf_weights_file):
+            save_weights(weights_file, esmf_weights_file, src_grid_cl, dest_grid_cl, src_frac_cl, dest_frac_cl, src_area_cl, dest_area_cl)
+            use_saved_weights = True
+        elif pet_count > 1:
+            sys.stderr.write("Weights could not be saved, this is needed when running on more than one PET.\n")
+            ESMP.ESMP_Finalize()
+            return 1
 
-    # clean up
-    ESMP.ESMP_FieldDestroy(src_field_cl)
-    ESMP.ESMP_FieldDestroy(dest_field_cl)
-    ESMP.ESMP_FieldDestroy(src_frac_cl)
-    ESMP.ESMP_FieldDestroy(dest_frac_cl)
-    ESMP.ESMP_FieldDestroy(src_area_cl)
-    ESMP.ESMP_FieldDestroy(dest_area_cl)
-    ESMP.ESMP_GridDestroy(src_grid_cl)
-    ESMP.ESMP_GridDestroy(dest_grid_cl)
-    ESMP.ESMP_Finalize()
+        # Weights could not be saved, so regrid every timestep with ESMP.
+        if not use_saved_weights:
+            def esmp_apply(src_chunk):
+
+                dest_chunk = np.empty((src_chunk.shape[0], dest_field_cl.size))
+                for t in range(src_chunk.shape[0]):
+                    # Load the field to be regridded.
+                    src_field_ptr = ESMP.ESMP_FieldGetPtr(src_field_cl) 
+                    src_field_ptr[:] = src_chunk[t,:,:].reshape(src_field_cl.size)
+
+                    dest_field, src_frac, dest_frac = run_regridding(src_field_cl, dest_field_cl, src_frac_cl, dest_frac_cl, routehandle)
+                    dest_chunk[t,:] = ESMP.ESMP_FieldGetPtr(dest_field)
+
+                    # Check some results. 
+                    src_mass, src_area = compute_mass(src_field_cl, src_area_cl, src_frac_cl, True)
+                    dest_mass, dest_area = compute_mass(dest_field, dest_area_cl, 0, False)
+                    np.testing.assert_approx_equal(src_mass, dest_mass)
+
+                return dest_chunk
+
+            def regrid_chunk(src_chunk, valid):
+                dest_chunk, _ = apply_masked(esmp_apply, src_chunk, source_valid(valid, src_mask))
+
+                return mask_dest(dest_chunk, dest_mask)
+
+            for src_filename, field_names, dest_filename in groups:
+                print 'Regridding %s from %s' % (', '.join(field_names), src_filename)
+                regrid_fields(src_filename, field_names, dest_filename, dest_shape, regrid_chunk, args.chunk_size)
+
+        # clean up
+        ESMP.ESMP_FieldRegridRelease(routehandle)
+        ESMP.ESMP_FieldDestroy(src_field_cl)
+        ESMP.ESMP_FieldDestroy(dest_field_cl)
+        ESMP.ESMP_FieldDestroy(src_frac_cl)
+        ESMP.ESMP_FieldDestroy(dest_frac_cl)
+        ESMP.ESMP_FieldDestroy(src_area_cl)
+        ESMP.ESMP_FieldDestroy(dest_area_cl)
+        ESMP.ESMP_GridDestroy(src_grid_cl)
+        ESMP.ESMP_GridDestroy(dest_grid_cl)
+
+    if ESMP is not None:
+        ESMP.ESMP_Finalize()
+
+    if local_pet != 0:
+        src_grid_file.close()
+        dest_grid_file.close()
+        return 0
+
+    if use_saved_weights:
+        if weights is None:
+            weights = read_weights(weights_file)
+        matrix = weights_matrix(weights)
+
+        def regrid_chunk(src_chunk, valid):
+            return regrid_saved(matrix, weights, src_chunk, valid, src_mask, dest_mask)
+
+        pool = None
+        if args.workers > 1 and weights_file is None:
+            sys.stderr.write("WARNING: --workers needs a weights file, see --weights and --weights_dir. Using 1 worker.\n")
+        elif args.workers > 1:
+            pool = multiprocessing.Pool(args.workers, init_worker, [save_weights_arrays(weights_file), src_mask, dest_mask])
+
+        for src_filename, field_names, dest_filename in groups:
+            print 'Regridding %s from %s' % (', '.join(field_names), src_filename)
+            if pool is not None:
+                regrid_fields_parallel(pool, args.workers, src_filename, field_names, dest_filename, dest_shape, args.chunk_size)
+            else:
+                regrid_fields(src_filename, field_names, dest_filename, dest_shape, regrid_chunk, args.chunk_size)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    src_file.close()
-    dest_file.close()
     src_grid_file.close()
     dest_grid_file.close()
 
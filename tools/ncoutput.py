@@ -0,0 +1,194 @@
+import numpy as np
+import netCDF4 as nc
+
+"""
+NetCDF output shared by the tools.
+
+Variables are created with a chunk layout suited to the way the file will be
+read, with optional zlib compression and optional float32 storage. SlabWriter
+collects many small writes into a few large ones.
+
+Tools outside this directory import it with:
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+    import ncoutput
+"""
+
+# Chunks are about this size in bytes for the timeseries layout.
+TIMESERIES_CHUNK_BYTES = 2**20
+# Records in a timeseries chunk when the time dimension is unlimited.
+TIMESERIES_CHUNK_RECORDS = 64
+
+def add_arguments(parser, chunking='default'):
+    """
+    Add the common output options to an argparse parser. 'chunking' is the
+    default layout for the tool, the netCDF library defaults unless given.
+    """
+
+    parser.add_argument("--chunking", default=chunking, choices=['map', 'timeseries', 'default'],
+                        help="Chunk layout of output variables. map chunks hold a whole horizontal \
+                              field at one time, timeseries chunks hold many times for part of the \
+                              field, default uses the netCDF library defaults. Defaults to %s." % chunking)
+    parser.add_argument("--compress", default=0, type=int, choices=range(10),
+                        help="zlib compression level (with shuffle) of output variables, defaults to 0 \
+                              which is no compression.")
+    parser.add_argument("--float32", action='store_true', default=False,
+                        help="Store double precision output variables as single precision.")
+    parser.add_argument("--buffer_mb", default=256, type=int,
+                        help="Memory used to buffer writes to each variable, in MB, defaults to 256.")
+
+def options(args):
+    """
+    The create_variable() keyword arguments given by the options added with
+    add_arguments().
+    """
+
+    return {'chunking' : args.chunking, 'compress' : args.compress, 'float32' : args.float32}
+
+def chunk_sizes(shape, itemsize, chunking):
+    """
+    Chunk shape of a variable with 'shape', None for the library default.
+    Dimensions of length 0 are unlimited. The last two dimensions are taken
+    to be horizontal.
+
+    'map': one horizontal field per chunk, good for reading whole fields.
+    'timeseries': many records per chunk, with the horizontal field split
+                  into tiles, good for reading the history at a point.
+    """
+
+    if chunking == 'default' or len(shape) < 2:
+        return None
+
+    ny, nx = [max(n, 1) for n in shape[-2:]]
+    if chunking == 'map':
+        return [1]*(len(shape) - 2) + [ny, nx]
+
+    assert(chunking == 'timeseries')
+    records = 1
+    if len(shape) > 2:
+        records = shape[0] if shape[0] > 0 else TIMESERIES_CHUNK_RECORDS
+    tile = int(np.sqrt(TIMESERIES_CHUNK_BYTES / float(itemsize*records)))
+    tile = max(tile, 1)
+
+    return ([records] + [1]*(len(shape) - 3))[:len(shape) - 2] + [min(ny, tile), min(nx, tile)]
+
+def create_variable(dataset, name, dtype, dimensions, fill_value=None,
+                    chunking='default', compress=0, float32=False):
+    """
+    Create a variable in 'dataset' with the given layout, see chunk_sizes(),
+    compression level and precision. Returns the new variable.
+    """
+
+    dtype = np.dtype(dtype)
+    if float32 and dtype == np.float64:
+        dtype = np.dtype(np.float32)
+
+    kwargs = {}
+    shape = [len(dataset.dimensions[d]) for d in dimensions]
+    chunks = chunk_sizes(shape, dtype.itemsize, chunking)
+    if chunks is not None:
+        kwargs['chunksizes'] = chunks
+    if compress > 0:
+        kwargs['zlib'] = True
+        kwargs['complevel'] = compress
+        kwargs['shuffle'] = True
+    if fill_value is not None:
+        kwargs['fill_value'] = np.array(fill_value, dtype=dtype)
+
+    return dataset.createVariable(name, dtype, dimensions, **kwargs)
+
+class SlabWriter(object):
+    """
+    Buffer writes to a variable and write them out a block of records, along
+    the first dimension, at a time. This turns many small writes into a few
+    large ones.
+
+    Writes must be in record order and together they should cover every
+    record in a block, anything not written is left as the fill value. Use
+    block_records to loop over the blocks when writes span many records.
+    Call flush(), or use as a context manager, when done.
+    """
+
+    def __init__(self, var, buffer_mb=256):
+
+        self.var = var
+        self.record_shape = var.shape[1:]
+
+        record_bytes = np.prod(self.record_shape)*var.dtype.itemsize
+        self.block_records = max(1, int(buffer_mb*2**20 // record_bytes))
+
+        # Whole chunks are written at once if possible.
+        chunks = var.chunking()
+        if chunks != 'contiguous' and chunks[0] < self.block_records:
+            self.block_records -= self.block_records % chunks[0]
+
+        self.start = None
+        self.end = None
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def write(self, key, data):
+        """
+        Same as var[key] = data. 'key' is an integer or slice for the first
+        dimension, or a tuple of these for each dimension.
+        """
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        data = np.ma.filled(data, self.fill_value())
+
+        first = key[0]
+        if isinstance(first, slice):
+            assert(first.step is None)
+            start = first.start if first.start is not None else 0
+            stop = first.stop if first.stop is not None else self.var.shape[0]
+        else:
+            start = first
+            stop = first + 1
+            data = data.reshape((1,) + data.shape)
+        rest = key[1:]
+
+        # Split writes that span more than one block.
+        while start < stop:
+            block_start = start - (start % self.block_records)
+            if block_start != self.start:
+                assert(self.start is None or block_start > self.start)
+                self.flush()
+                self.start = block_start
+                self.end = block_start
+                self.buffer = np.empty((self.block_records,) + self.record_shape, dtype=self.var.dtype)
+                self.buffer[:] = self.fill_value()
+
+            block_stop = min(stop, block_start + self.block_records)
+            n = block_stop - start
+            self.buffer[(slice(start - block_start, block_stop - block_start),) + rest] = data[:n]
+            self.end = max(self.end, block_stop)
+
+            data = data[n:]
+            start = block_stop
+
+    def fill_value(self):
+        """
+        The value given to parts of the buffer that are not written.
+        """
+
+        fill = getattr(self.var, '_FillValue', None)
+        if fill is None:
+            fill = nc.default_fillvals[self.var.dtype.str[1:]]
+        return fill
+
+    def flush(self):
+        """
+        Write out the buffered block.
+        """
+
+        if self.start is not None:
+            self.var[self.start:self.end] = self.buffer[:self.end - self.start]
+        self.start = None
+        self.end = None
+        self.buffer = None